@@ -3,3 +3,4 @@
 
 from    pytest_pt  import *     # Plugin to find/execute .pt files as tests
 from    testmc.pytest  import * # t8dev test framework fixtures
+from    src.generic.fixtures  import *  # 8bitdev fixtures and overrides
@@ -0,0 +1,195 @@
+''' Build clic heap images from Python values.
+
+    `build()` lays out a Python value (usually a nested list) as cons cells
+    and obdata objects in a `HeapImage`, following the formats in
+    `objects.md`, which can then be placed in a machine's memory with a
+    single `HeapImage.deposit()`. Python values are converted as follows:
+
+    - `None` and `False`: ``nil``. `True`: ``t``.
+    - `int`: a smallint if it fits, otherwise an integer obdata object.
+    - `str` or `bytes`: a sym1 or sym2 if it can be encoded as one,
+      otherwise a symbol obdata object.
+    - `list` or `tuple`: a proper list of cons cells, one per element,
+      allocated contiguously.
+    - `Cons`: a single cons cell, e.g. for dotted pairs.
+    - `Oref`: an already-encoded object reference, used as-is.
+
+    Lists, `Cons` and obdata objects that are the same Python object are
+    allocated only once, so shared and circular structures are preserved.
+'''
+
+from    collections  import namedtuple
+from    struct  import Struct
+from    src.clic.objref  import NIL, T, ptr, smallint, sym12
+
+__all__ = ['build', 'HeapImage', 'Cons', 'Oref',
+    'FMT_FREE', 'FMT_SYMBOL', 'FMT_INTEGER']
+
+#   Obdata format IDs (the first byte of the obdata header).
+FMT_FREE    = 0x03
+FMT_SYMBOL  = 0x23
+FMT_INTEGER = 0x63
+
+Cons = namedtuple('Cons', 'car cdr')
+Cons.__doc__ = ' A single cons cell, for building dotted pairs. '
+
+class Oref(int):
+    ' A pre-encoded object reference, e.g. ``Oref(const(0xFC))``. '
+
+class HeapImage:
+    ''' An image of a heap starting at `base`, which must be dword-aligned,
+        in the `byteorder` (``'little'`` or ``'big'``) of the target CPU.
+
+        - `data`: the image as a `bytearray`.
+        - `root`: the object reference returned by the last `add()`.
+        - `relocs`: the addresses of all words in the image that are
+          pointers (the relocation map).
+    '''
+
+    def __init__(self, base=0x4000, byteorder='little'):
+        ptr(base)                           # check range and alignment
+        self.base = base
+        self.byteorder = byteorder
+        self.data = bytearray()
+        self.relocs = []
+        self.root = NIL
+        self._fmt = Struct('<H' if byteorder == 'little' else '>H')
+        self._shared = {}                   # id(value) → (value, oref)
+
+    @property
+    def end(self):
+        ' The address just past the last allocated object. '
+        return self.base + len(self.data)
+
+    def addr(self, value):
+        ''' Return the address at which `value` (a list, `Cons` or obdata
+            value previously added) was allocated.
+        '''
+        return self._shared[id(value)][1]
+
+    def alloc(self, size):
+        ''' Allocate `size` bytes, rounded up to a dword multiple, at the
+            end of the heap, returning their address.
+        '''
+        addr = self.end
+        asize = (size + 3) & ~3
+        if addr + asize > 0x10000:
+            raise MemoryError(f'heap full: ${addr:04X} + {asize}')
+        self.data.extend(bytes(asize))
+        return addr
+
+    def setword(self, addr, oref):
+        ' Store object reference `oref` at `addr`. '
+        self._fmt.pack_into(self.data, addr - self.base, oref)
+        if oref & 0x03 == 0 and oref >= 0x100:
+            self.relocs.append(addr)
+
+    def obdata(self, fmtid, data):
+        ' Allocate an obdata object with `data`, returning a pointer to it. '
+        if len(data) > 0xFF:
+            raise ValueError(f'obdata too long: {len(data)} bytes')
+        addr = self.alloc(len(data) + 2)
+        offset = addr - self.base
+        self.data[offset:offset+2+len(data)] \
+            = bytes([fmtid, len(data)]) + bytes(data)
+        return addr
+
+    def add(self, value):
+        ' Add `value` to the heap, returning its object reference. '
+        self.root = oref = self._add(value)
+        return oref
+
+    def _add(self, value):
+        if value is None or value is False:   return NIL
+        if value is True:                     return T
+        if isinstance(value, Oref):           return int(value)
+        if isinstance(value, int):
+            if -8192 <= value <= 8191:        return smallint(value)
+        elif isinstance(value, (str, bytes)):
+            if len(value) in (1, 2):
+                try:
+                    return sym12(value)
+                except ValueError:
+                    pass                    # needs a symbol object
+        elif not isinstance(value, (list, tuple)):
+            raise TypeError(f'cannot put {type(value).__name__} in heap:'
+                f' {value!r}')
+
+        shared = self._shared.get(id(value))
+        if shared is not None:
+            return shared[1]
+
+        if isinstance(value, int):
+            length = (value.bit_length() + 8) // 8
+            oref = self.obdata(FMT_INTEGER,
+                value.to_bytes(length, 'little', signed=True))
+        elif isinstance(value, str):
+            oref = self.obdata(FMT_SYMBOL, value.encode('ASCII'))
+        elif isinstance(value, bytes):
+            oref = self.obdata(FMT_SYMBOL, value)
+        elif isinstance(value, Cons):
+            oref = self.alloc(4)
+            self._shared[id(value)] = (value, oref)
+            self.setword(oref, self._add(value.car))
+            self.setword(oref+2, self._add(value.cdr))
+            return oref
+        else:
+            if not value:  return NIL
+            #   Allocate all the cells first so that the list is contiguous
+            #   and can refer to itself.
+            oref = self.alloc(4 * len(value))
+            self._shared[id(value)] = (value, oref)
+            last = oref + 4 * (len(value) - 1)
+            for cell, elem in zip(range(oref, last + 4, 4), value):
+                self.setword(cell, self._add(elem))
+                self.setword(cell+2, NIL if cell == last else cell+4)
+            return oref
+
+        self._shared[id(value)] = (value, oref)
+        return oref
+
+    def fill(self, size):
+        ''' Fill the heap out to `size` bytes from `base` with free block
+            objects, so that every address in the heap is part of an object.
+        '''
+        remain = size - len(self.data)
+        if remain < 0 or remain & 0x03:
+            raise ValueError(f'bad heap size {size}: {len(self.data)} used')
+        while remain:
+            asize = min(remain, 0x100)
+            self.obdata(FMT_FREE, bytes(asize - 2))
+            remain -= asize
+
+    def relocate(self, base):
+        ''' Move the image to start at `base`, adjusting all the pointers
+            into it and `root`.
+        '''
+        ptr(base)
+        delta = base - self.base
+        fmt = self._fmt
+        relocs = []
+        for addr in self.relocs:
+            offset = addr - self.base
+            oref = fmt.unpack_from(self.data, offset)[0]
+            if self.base <= oref < self.end:  oref += delta
+            fmt.pack_into(self.data, offset, oref)
+            relocs.append(addr + delta)
+        if self.root & 0x03 == 0 and self.base <= self.root < self.end:
+            self.root += delta
+        self._shared = { k: (v, oref + delta)
+            for k, (v, oref) in self._shared.items() }
+        self.relocs, self.base = relocs, base
+
+    def deposit(self, m):
+        ' Write the image into the memory of machine `m` at `base`. '
+        m.deposit(self.base, self.data)
+
+def build(value, base=0x4000, byteorder='little', size=None):
+    ''' Return a `HeapImage` at `base` containing `value`, whose object
+        reference is the image's `root`. If `size` is given, the heap is
+        filled out to that size with free block objects.
+    '''
+    heap = HeapImage(base, byteorder)
+    heap.add(value)
+    if size is not None:  heap.fill(size)
+    return heap
@@ -3,8 +3,17 @@
     These constants and functions generate 16-bit words as `int`s, usually
     to be deposited with `Machine.depword()` which will handle converting
     the word to the correct endianness.
+
+    The functions with plural names (`smallints()`, `syms()`, etc.) encode
+    a whole sequence of values into an `array('H')`, and `decode()` and
+    `decode_table()` do the reverse, the latter for every 16-bit word at
+    once so that a memory image can be classified in one pass.
 '''
 
+from    array  import array
+from    functools  import lru_cache
+import  sys
+
 ####################################################################
 #   Utility routines also for public consumption
 
@@ -88,6 +97,9 @@ def sym2(sym):
         raise ValueError(f'sym2 1st char cannot be $00: {sym}')
     if sym[0] > 0x7F or sym[1] > 0x7F:
         raise ValueError(f'sym2 chars must be ≤ $7F: {sym}')
+    if sym[0] == 0x40:
+        #   Would be encoded with LSB=$02, which is a sym1.
+        raise ValueError(f'sym2 1st char cannot be $40: {sym}')
     msb = sym[1]
     if sym[0] & 0x40: msb |= 0x80    # copy sym0 bit 6 to MSB bit 7
     lsb = (sym[0] << 2) & 0xFC | 0b10
@@ -115,3 +127,156 @@ def smallint(i):
     return ((i << 2) | 0b01)
 
 
+
+####################################################################
+#   Bulk encoding
+#
+#   These take a sequence of values, check them all at once, and return
+#   an `array('H')` of object references suitable for `Machine.deposit()`
+#   after conversion with `tobytes()`.
+
+def _checkrange(kind, values, lo, hi, fmt='{}'):
+    if not values:  return
+    if min(values) < lo or max(values) > hi:
+        bad = next(v for v in values if v < lo or v > hi)
+        raise ValueError(f'{kind} out of range: {fmt.format(bad)}')
+
+def _checktags(kind, values, fmt):
+    bits = 0
+    for v in values:  bits |= v
+    if bits & 0x03:
+        bad = next(v for v in values if v & 0x03)
+        raise ValueError(
+            f'bad tag bits %{bad & 0x03:02b} for {kind}: {fmt.format(bad)}')
+
+def consts(ns):
+    ' Return an `array` of `const()` object references for `ns`. '
+    ns = list(ns)
+    _checkrange('Instrinsic const', ns, 0x00, 0xFF, '${:02X}')
+    _checktags('intrinsic const', ns, '${:02X}')
+    return array('H', ns)
+
+def ptrs(addrs):
+    ' Return an `array` of `ptr()` object references for `addrs`. '
+    addrs = list(addrs)
+    _checkrange('pointer', addrs, 0x0100, 0xFFFF, '${:04X}')
+    _checktags('pointer', addrs, '${:04X}')
+    return array('H', addrs)
+
+def smallints(ints):
+    ' Return an `array` of `smallint()` object references for `ints`. '
+    ints = list(ints)
+    _checkrange('smallint', ints, -8192, 8191)
+    return array('H', [ (i << 2 | 0b01) & 0xFFFF for i in ints ])
+
+def syms(seqs):
+    ' Return an `array` of `sym12()` object references for `seqs`. '
+    return array('H', map(sym12, seqs))
+
+def tobytes(orefs, byteorder='little'):
+    ''' Return the `bytes` for a sequence of object references `orefs`
+        stored in `byteorder` (``'little'`` or ``'big'``).
+    '''
+    a = array('H', orefs)
+    if byteorder != sys.byteorder:  a.byteswap()
+    return a.tobytes()
+
+def frombytes(data, byteorder='little'):
+    ''' Return an `array('H')` of the words in `data`, which must be of
+        even length, stored in `byteorder`. This is typically used to read
+        a memory image, e.g. ``frombytes(m.bytes(0, 0x10000))``.
+    '''
+    a = array('H')
+    a.frombytes(bytes(data))
+    if byteorder != sys.byteorder:  a.byteswap()
+    return a
+
+####################################################################
+#   Decoding
+
+CONST, PTR, SMALLINT, SYM1, SYM2, OBDATA = range(6)
+TAGNAMES = ('const', 'ptr', 'smallint', 'sym1', 'sym2', 'obdata')
+
+def _tag(word):
+    lsb = word & 0xFF
+    tag = lsb & 0x03
+    if tag == 0b00:  return CONST if word < 0x100 else PTR
+    if tag == 0b01:  return SMALLINT
+    if tag == 0b10:  return SYM1 if lsb == 0b10 else SYM2
+    return OBDATA
+
+def _smallint(word):
+    i = word >> 2
+    return i - 0x4000 if i & 0x2000 else i
+
+def _symchars(word):
+    lsb, msb = word & 0xFF, word >> 8
+    if lsb == 0b10:  return msb, 0
+    return lsb >> 2 | (msb & 0x80) >> 1, msb & 0x7F
+
+def decode(word):
+    ''' Decode 16-bit object reference or obdata header `word`, returning
+        a tuple of its type (`CONST`, `PTR`, `SMALLINT`, `SYM1`, `SYM2` or
+        `OBDATA`; `TAGNAMES` gives names for these) and value:
+        - `CONST`, `PTR`: the word itself.
+        - `SMALLINT`: the integer value.
+        - `SYM1`, `SYM2`: the symbol characters as `bytes`.
+        - `OBDATA`: a tuple of the format number and data length.
+
+        This is the inverse of the encoding functions above.
+    '''
+    if not 0 <= word <= 0xFFFF:
+        raise ValueError(f'object reference out of range: {word}')
+    tag = _tag(word)
+    if tag == SMALLINT:
+        return tag, _smallint(word)
+    if tag == SYM1:
+        return tag, bytes(_symchars(word)[:1])
+    if tag == SYM2:
+        return tag, bytes(_symchars(word))
+    if tag == OBDATA:
+        return tag, ((word & 0xFF) >> 2, word >> 8)
+    return tag, word
+
+class DecodeTable:
+    ''' The decoding of every 16-bit word, as `array`s indexed by word:
+        - `tag`: the type, as returned by `decode()`.
+        - `smallint`: the smallint value, or 0 if not a smallint.
+        - `char0`, `char1`: the characters of a sym1 (for which `char1`
+          is 0) or sym2, or 0 if not a symbol.
+
+        Use `decode_table()` to get the (cached) instance.
+    '''
+
+    def __init__(self):
+        words = range(0x10000)
+        self.tag = array('B', map(_tag, words))
+        tags = self.tag
+        self.smallint = array('h', [ _smallint(w) if tags[w] == SMALLINT
+            else 0 for w in words ])
+        chars = [ _symchars(w) if tags[w] in (SYM1, SYM2) else (0, 0)
+            for w in words ]
+        self.char0 = array('B', [ c[0] for c in chars ])
+        self.char1 = array('B', [ c[1] for c in chars ])
+
+    def lookup(self, words):
+        ''' Decode all of `words` (e.g., from `frombytes()`), returning a
+            `DecodeTable`-like object with `tag`, `smallint`, `char0` and
+            `char1` arrays parallel to `words`.
+        '''
+        words = array('H', words)
+        found = object.__new__(DecodeTable)
+        for name in ('tag', 'smallint', 'char0', 'char1'):
+            table = getattr(self, name)
+            setattr(found, name,
+                array(table.typecode, map(table.__getitem__, words)))
+        return found
+
+    def count(self):
+        ' Return a `dict` of `TAGNAMES` to the number of words with each tag. '
+        return { name: self.tag.count(i) for i, name in enumerate(TAGNAMES) }
+
+@lru_cache(maxsize=None)
+def decode_table():
+    ' Return the `DecodeTable` for all 16-bit words, building it if needed. '
+    return DecodeTable()
@@ -0,0 +1,200 @@
+''' Cycle-count and size regression benchmarks for library routines.
+
+    Each CPU's ``bench.pt`` assembles the commonly used library routines
+    into one rig and uses the `bench` fixture to run each on the fixed
+    representative inputs defined here, measuring the total instructions
+    and cycles (see `src.generic.profiler` for where cycle counts come
+    from) and the routine's size in bytes, measured as the distance from
+    its symbol to the next non-local symbol in the rig.
+
+    The results are compared with the baselines committed in
+    `BASELINE_FILE`. A test fails if the routine takes more than
+    ``threshold`` (a fraction, from the baseline file) more cycles than
+    its baseline, or has grown in size; a `BenchWarning` is issued if it
+    has no baseline or is faster or smaller than its baseline (so that
+    the baseline can be updated to catch later regressions).
+
+    Running with ``./Test --bench-update`` writes the results of all
+    benchmarks run (merged from all pytest-xdist workers) into the
+    baseline file, and whenever benchmarks are run the terminal summary
+    shows a table comparing the CPUs. ``python -m src.generic.bench``
+    prints that table for the committed baselines.
+'''
+
+from    pathlib  import Path
+import  json, sys, warnings
+import  pytest
+
+from    src.generic.profiler  import Profiler
+
+__all__ = ['bench', 'BenchWarning', 'routine_size', 'results',
+    'PRDEC_INPUTS', 'CRC_DATA', 'QDIGIT_INPUTS', 'HEXSTR_INPUTS',
+    'BIGINT_INPUTS', 'DECSTR_INPUTS', 'SLOOKUP_TABLE', 'SLOOKUP_TARGETS']
+
+BASELINE_FILE = Path(__file__).with_name('bench.json')
+
+#   Column order for the comparison table, by `Registers.machname`.
+CPUS = ('6502', '6800', 'i8080')
+
+####################################################################
+#   Benchmark inputs, the same for all CPUs.
+
+PRDEC_INPUTS = (0, 7, 42, 255, 1000, 4096, 12345, 65535)
+CRC_DATA = bytes(range(0x100))
+QDIGIT_INPUTS = b'09AFaz_\x7F/:@`\x80\xFF'
+HEXSTR_INPUTS = (b'0', b'F', b'A0', b'B19', b'1234', b'aBcdE', b'G')
+BIGINT_INPUTS = (b'\x01', b'\x12\x34\x56\x78', b'\x0B' + b'\xFF' * 31)
+DECSTR_INPUTS = (b'0', b'-128', b'12345678', b'-999999999999')
+SLOOKUP_TABLE = ((0x0001, b'list'), (0x0002, b'load'), (0x0003, b'run'),
+    (0x0004, b'save'), (0x0005, b'new'), (0x0006, b'cont'))
+SLOOKUP_TARGETS = (b'list', b'cont', b'run', b'zap', b'lisp', b'x')
+
+####################################################################
+#   Measurement
+
+def routine_size(symtab, addr):
+    ''' Return the number of bytes from `addr` to the next higher
+        non-local symbol in `symtab`, or `None` if there is none.
+    '''
+    following = [ value for name, value in symtab
+        if isinstance(value, int) and value > addr and '.' not in name ]
+    return min(following) - addr if following else None
+
+class Result:
+    ' Totals for one benchmark run, and comparison with the baseline. '
+
+    FIELDS = ('calls', 'insns', 'cycles', 'bytes')
+
+    def __init__(self, calls, insns, cycles, bytes):
+        self.calls, self.insns, self.cycles, self.bytes \
+            = calls, insns, cycles, bytes
+
+    def asdict(self):
+        return { f: getattr(self, f) for f in self.FIELDS }
+
+    def compare(self, base, threshold):
+        ''' Compare against `base`, a `dict` from `asdict()`, returning
+            a tuple of lists of regression and improvement messages.
+        '''
+        worse, better = [], []
+        if self.calls != base['calls']:
+            worse.append(f'{self.calls} calls but baseline has'
+                f' {base["calls"]}; update the baseline')
+            return worse, better
+        if self.cycles > base['cycles'] * (1 + threshold):
+            worse.append(f'cycles {base["cycles"]} → {self.cycles}')
+        elif self.cycles < base['cycles']:
+            better.append(f'cycles {base["cycles"]} → {self.cycles}')
+        if base['bytes'] is not None and self.bytes is not None:
+            if self.bytes > base['bytes']:
+                worse.append(f'bytes {base["bytes"]} → {self.bytes}')
+            elif self.bytes < base['bytes']:
+                better.append(f'bytes {base["bytes"]} → {self.bytes}')
+        return worse, better
+
+class BenchWarning(UserWarning):
+    ' A benchmark has no baseline or has improved on it. '
+
+def load_baseline(path=BASELINE_FILE):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return { 'version': 1, 'threshold': 0.02, 'routines': {} }
+
+def save_baseline(baseline, path=BASELINE_FILE):
+    with open(path, 'w') as f:
+        json.dump(baseline, f, indent=1, sort_keys=True)
+        f.write('\n')
+
+#   Results of this session, ``{ routine: { cpu: Result.asdict() } }``.
+results = {}
+
+def merge(more):
+    ' Merge results (e.g., from a pytest-xdist worker) into `results`. '
+    for routine, cpus in more.items():
+        results.setdefault(routine, {}).update(cpus)
+
+@pytest.fixture
+def bench(request, m):
+    ''' Return a function
+        ``run(routine, inputs, setup=None, end=None, name=None)``
+        that calls `routine` (a symbol name) on `m` once for each of
+        `inputs` and compares the total instructions and cycles, and the
+        routine's size, with the baseline for `name` (default `routine`).
+
+        If given, ``setup(m, input)`` is called (unprofiled) before each
+        call and must return the `Registers` for the call; otherwise each
+        input is used as the `Registers` for the call. If given, `end` is
+        the name of the symbol following the routine, for where the next
+        non-local symbol is not the end of the routine (e.g., alternate
+        entry points). `name` distinguishes several benchmarks of the same
+        routine, e.g., with different inputs or build options.
+    '''
+    def run(routine, inputs, setup=None, end=None, name=None):
+        entry = m.symtab[routine]
+        with Profiler(m) as p:
+            n = 0
+            for input in inputs:
+                if setup is None:
+                    regs = input
+                else:
+                    p.detach(); regs = setup(m, input); p.attach()
+                m.call(entry, regs, maxsteps=1e7)
+                n += 1
+        size = routine_size(m.symtab, entry) if end is None \
+            else m.symtab[end] - entry
+        result = Result(n, p.insns, p.cycles, size)
+        check(request.config, name or routine, m.Registers.machname, result)
+        return result
+    return run
+
+def check(config, routine, cpu, result):
+    results.setdefault(routine, {})[cpu] = result.asdict()
+    if config.getoption('bench_update'):
+        return
+    baseline = load_baseline()
+    base = baseline['routines'].get(routine, {}).get(cpu)
+    if base is None:
+        warnings.warn(BenchWarning(f'{cpu} {routine}: no baseline'
+            ' (run with --bench-update)'))
+        return
+    worse, better = result.compare(base, baseline['threshold'])
+    if better:
+        warnings.warn(BenchWarning(f'{cpu} {routine} improved: '
+            + ', '.join(better) + ' (run with --bench-update)'))
+    if worse:
+        pytest.fail(f'{cpu} {routine} regressed: ' + ', '.join(worse),
+            pytrace=False)
+
+####################################################################
+#   Reporting
+
+def table(routines):
+    ''' Return a text table of cycles and bytes for each routine (rows)
+        and CPU (columns) from `routines`, ``{ routine: { cpu: result } }``.
+        Each entry also gives its ratio to the fastest (or smallest) CPU.
+    '''
+    cpus = [ c for c in CPUS if any(c in r for r in routines.values()) ]
+    cpus += sorted(set(c for r in routines.values() for c in r) - set(cpus))
+    header = f'{"routine":20}' + ''.join(f'{c:>24}' for c in cpus)
+    lines = [header, f'{"":20}' + f'{"cycles      bytes":>24}' * len(cpus)]
+    for routine, bycpu in sorted(routines.items()):
+        mincycles = min(r['cycles'] for r in bycpu.values())
+        minbytes = min((r['bytes'] for r in bycpu.values()
+            if r['bytes'] is not None), default=None)
+        line = f'{routine:20}'
+        for cpu in cpus:
+            r = bycpu.get(cpu)
+            if r is None:
+                line += f'{"-":>24}'; continue
+            cycles = f'{r["cycles"]} ×{r["cycles"]/mincycles:.1f}'
+            size = '?' if r['bytes'] is None \
+                else f'{r["bytes"]} ×{r["bytes"]/minbytes:.1f}'
+            line += f'{cycles:>14}{size:>10}'
+        lines.append(line)
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    path = sys.argv[1] if len(sys.argv) > 1 else BASELINE_FILE
+    print(table(load_baseline(path)['routines']))
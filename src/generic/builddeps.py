@@ -0,0 +1,186 @@
+''' Include-aware dependency tracking for the assembly builds in `Test`.
+
+    A _target_ is a source file or a named group of source files. Its
+    dependencies are the source files themselves and, transitively, every
+    file they ``include`` or ``binclude`` (ASL) or ``.include`` (ASxxxx).
+    Include names are resolved relative to the project directory, the
+    including file's directory and the directory containing the `testmc`
+    package (for its ``biosdef`` files); names that cannot be resolved are
+    tracked by name alone, so they cause a rebuild only if they appear.
+
+    The content hashes of all of a target's dependencies, along with the
+    assembler version (see `src.generic.rigcache.asl_version()`), are
+    recorded in `DBFILE` (under ``.build/obj/`` so that it's removed along
+    with the objects when cleaning) after a successful build. A target is
+    stale if it has never been recorded, its set of dependencies or any
+    of their hashes has changed, or the assembler has changed. Usage from `Test`, in the project directory::
+
+        python -m src.generic.builddeps stale  FILE...
+        python -m src.generic.builddeps record FILE...
+        python -m src.generic.builddeps stale  --group NAME PATH...
+        python -m src.generic.builddeps record --group NAME PATH...
+
+    ``stale`` prints the stale targets, one per line (and nothing if all
+    are up to date). ``record`` records the current state of the targets.
+    With ``--group``, the target is `NAME` and its sources are all of the
+    `PATH`s, with directories searched recursively for files matching
+    `SOURCE_PATTERN` (or ``--match REGEX``) and not under any ``--exclude``.
+    The default pattern includes ``.pt`` files because their ``test_rig``
+    and ``object_files`` determine what ``t8dev asl auto`` builds.
+'''
+
+from    argparse  import ArgumentParser
+from    hashlib  import sha1
+from    importlib.util  import find_spec
+from    pathlib  import Path
+import  json, os, re
+
+from    src.generic.rigcache  import asl_version
+
+PROJDIR = Path(os.environ.get('T8_PROJDIR', '.'))
+DBFILE = PROJDIR / '.build' / 'obj' / 'builddeps.json'
+
+#   Assembler source files (.a65, .a68, .i80, .z80, etc.) and unit test
+#   files, whose rigs and object file lists are also built.
+SOURCE_PATTERN = r'\.([aiz][0-9][0-9]|pt)$'
+
+#   The name under which the assembler version is recorded in a closure.
+VERSION_KEY = '(asl version)'
+
+INCLUDE = re.compile(rb'^(?:[^;\n]*\s)?\.?b?include\s+"?([^";\s]+)',
+    re.IGNORECASE | re.MULTILINE)
+
+class Deps:
+    ''' The dependencies of source files, with each file scanned and
+        hashed at most once.
+    '''
+
+    def __init__(self, projdir=PROJDIR, searchdirs=None):
+        self.projdir = Path(projdir)
+        if searchdirs is None:
+            searchdirs = [self.projdir]
+            spec = find_spec('testmc')
+            if spec and spec.origin:
+                searchdirs.append(Path(spec.origin).parent.parent)
+        self.searchdirs = searchdirs
+        self._hashes = {}       # path → sha1 hexdigest or None
+        self._includes = {}     # path → list of resolved include paths
+
+    def name(self, path):
+        ' The name under which `path` is recorded: relative if possible. '
+        try:
+            return str(Path(path).resolve().relative_to(
+                self.projdir.resolve()))
+        except ValueError:
+            return str(path)
+
+    def hash(self, path):
+        h = self._hashes.get(path, False)
+        if h is False:
+            try:
+                data = Path(path).read_bytes()
+                h = sha1(data).hexdigest()
+                self._includes[path] = [ self.resolve(m.decode(), path)
+                    for m in INCLUDE.findall(data) ]
+            except FileNotFoundError:
+                h = None
+            self._hashes[path] = h
+        return h
+
+    def resolve(self, include, includer):
+        ''' Return the path of file `include` included from `includer`;
+            this is just `include` if it can't be found.
+        '''
+        for d in self.searchdirs + [Path(includer).parent]:
+            p = Path(d, include)
+            if p.is_file():
+                return str(p)
+        return include
+
+    def closure(self, sources):
+        ''' Return a `dict` of recorded names to hashes for all of
+            `sources` and their (transitive) includes.
+        '''
+        found, todo = {}, list(map(str, sources))
+        while todo:
+            path = todo.pop()
+            name = self.name(path)
+            if name in found:  continue
+            found[name] = self.hash(path)
+            todo.extend(self._includes.get(path, ()))
+        return found
+
+def sources(paths, match=SOURCE_PATTERN, exclude=()):
+    ''' Return the files in `paths`, with directories searched recursively
+        for files whose names match `match` and that are not under any
+        of the `exclude` paths.
+    '''
+    match = re.compile(match)
+    exclude = [ Path(e).resolve() for e in exclude ]
+    def excluded(p):
+        p = p.resolve()
+        return any(p == e or e in p.parents for e in exclude)
+    found = []
+    for p in map(Path, paths):
+        if p.is_dir():
+            found += sorted( f for f in p.rglob('*') if f.is_file()
+                and match.search(f.name) and not excluded(f) )
+        elif not excluded(p):
+            found.append(p)
+    return found
+
+def load(dbfile=DBFILE):
+    try:
+        with open(dbfile) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return { 'version': 1, 'targets': {} }
+
+def save(db, dbfile=DBFILE):
+    Path(dbfile).parent.mkdir(parents=True, exist_ok=True)
+    tmp = Path(str(dbfile) + '.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(db, f, indent=1, sort_keys=True)
+        f.write('\n')
+    tmp.replace(dbfile)
+
+def targets(args, deps, version=None):
+    ''' Return a list of ``(target, closure, path)`` for the command line
+        `args`, where `path` is the path given for a file target, or the
+        group name. Each closure also records the assembler `version`.
+    '''
+    if args.group:
+        found = [(args.group, deps.closure(
+            sources(args.paths, args.match, args.exclude)), args.group)]
+    else:
+        found = [ (deps.name(p), deps.closure([p]), p) for p in args.paths ]
+    for _, closure, _ in found:
+        closure[VERSION_KEY] = version
+    return found
+
+def main(argv=None):
+    p = ArgumentParser(description='Dependency tracking for assembly builds.')
+    p.add_argument('command', choices=('stale', 'record'))
+    p.add_argument('paths', nargs='+')
+    p.add_argument('--group', help='target name for all PATHs together')
+    p.add_argument('--match', default=SOURCE_PATTERN,
+        help='regex for source file names in directories')
+    p.add_argument('--exclude', action='append', default=[])
+    p.add_argument('--db', default=DBFILE, help=f'default: {DBFILE}')
+    args = p.parse_args(argv)
+
+    db = load(args.db)
+    recorded = db['targets']
+    deps = Deps(Path.cwd())
+    version = asl_version()
+    if args.command == 'stale':
+        for target, closure, path in targets(args, deps, version):
+            if recorded.get(target) != closure:
+                print(path)
+    else:
+        for target, closure, _ in targets(args, deps, version):
+            recorded[target] = closure
+        save(db, args.db)
+
+if __name__ == '__main__':
+    main()
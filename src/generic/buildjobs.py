@@ -0,0 +1,335 @@
+''' Parallel build jobs for `Test`: assembly, binary output conversion
+    and the release tree.
+
+    The builds are expressed as a DAG of `Job`s (assemble a source to a
+    ``.p`` file → convert that to a ``.com``/``.CO``/``.wav``/etc. file →
+    copy that into the emulator or release directories) which `run()`
+    executes with up to one job per CPU, each job being a subprocess (or
+    a Python function for simple file copies). A job whose dependency
+    failed is skipped; after all jobs have finished, the output of each
+    failed job and a timing summary are printed. Usage from `Test`::
+
+        python -m src.generic.buildjobs build [-j N] [SOURCE...]
+        python -m src.generic.buildjobs release [-j N]
+
+    ``build`` assembles the given sources (paths relative to the project
+    directory) with ``t8dev asl asm`` and then does all of the binary
+    output conversions in `CONVERSIONS` and `build_jobs()`, skipping those
+    whose output is newer than their input. ``release`` builds the release
+    tree and zip file.
+'''
+
+from    argparse  import ArgumentParser
+from    concurrent.futures  import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from    fnmatch  import fnmatch
+from    pathlib  import Path
+from    time  import perf_counter, time
+import  os, shutil, subprocess, sys
+
+PROJDIR  = Path(os.environ.get('T8_PROJDIR', '.'))
+BUILDDIR = Path(os.environ.get('BUILDDIR', PROJDIR / '.build'))
+
+####################################################################
+#   Jobs and the scheduler
+
+class Job:
+    ''' A build job named `name` (which must be unique) that runs after all
+        the jobs named in `deps` have succeeded.
+
+        `action` is either a sequence of program and arguments, run in
+        directory `cwd` with standard output to file `stdout` if given,
+        or a function taking no arguments. If `inputs` and `outputs` (file
+        paths) are given, the job is skipped as up to date when all of the
+        outputs exist and are newer than all of the inputs and no job in
+        `deps` was run.
+    '''
+
+    def __init__(self, name, action, deps=(), *, cwd=None, stdout=None,
+            inputs=(), outputs=()):
+        self.name, self.action, self.deps = name, action, tuple(deps)
+        self.cwd, self.stdout = cwd, stdout
+        self.inputs, self.outputs = tuple(inputs), tuple(outputs)
+
+    def __repr__(self):
+        return f'Job({self.name!r})'
+
+    def uptodate(self):
+        if not self.outputs:  return False
+        try:
+            oldest = min(os.stat(p).st_mtime for p in self.outputs)
+        except FileNotFoundError:
+            return False
+        return all(os.stat(p).st_mtime <= oldest
+            for p in self.inputs if os.path.exists(p))
+
+    def __call__(self):
+        ' Run the job, returning a tuple of (success, output). '
+        if callable(self.action):
+            try:
+                self.action()
+                return True, ''
+            except Exception as ex:
+                return False, f'{type(ex).__name__}: {ex}\n'
+        try:
+            if self.stdout is None:
+                p = subprocess.run(self.action, cwd=self.cwd,
+                    stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+                return p.returncode == 0, p.stdout.decode(errors='replace')
+            with open(self.stdout, 'wb') as f:
+                p = subprocess.run(self.action, cwd=self.cwd, stdout=f,
+                    stderr=subprocess.PIPE)
+            return p.returncode == 0, p.stderr.decode(errors='replace')
+        except OSError as ex:
+            return False, f'{" ".join(map(str, self.action))}: {ex}\n'
+
+class Result:
+    ''' The result of a `Job`: `status` is ``ok``, ``failed``, ``skipped``
+        (a dependency failed) or ``uptodate``.
+    '''
+    def __init__(self, status, elapsed=0.0, output=''):
+        self.status, self.elapsed, self.output = status, elapsed, output
+
+def order(jobs):
+    ''' Check that the dependencies of `jobs` exist and have no cycles,
+        returning a `dict` of job names to their dependents.
+    '''
+    names = { j.name for j in jobs }
+    if len(names) != len(jobs):
+        raise ValueError('duplicate job names')
+    dependents = { j.name: [] for j in jobs }
+    for j in jobs:
+        for d in j.deps:
+            if d not in names:
+                raise ValueError(f'{j.name}: unknown dependency {d}')
+            dependents[d].append(j.name)
+    indegree = { j.name: len(j.deps) for j in jobs }
+    ready = [ n for n, d in indegree.items() if d == 0 ]
+    seen = 0
+    while ready:
+        seen += 1
+        for n in dependents[ready.pop()]:
+            indegree[n] -= 1
+            if indegree[n] == 0:  ready.append(n)
+    if seen != len(jobs):
+        raise ValueError('dependency cycle in jobs')
+    return dependents
+
+def run(jobs, workers=None):
+    ''' Run `jobs`, with up to `workers` (default: CPU count) at once,
+        returning a `dict` of job names to `Result`s.
+    '''
+    byname = { j.name: j for j in jobs }
+    dependents = order(jobs)
+    waiting = { j.name: len(j.deps) for j in jobs }
+    ran = set()             # jobs that were run (not up to date)
+    results = {}
+
+    def finish(name, result):
+        results[name] = result
+        if result.status in ('ok', 'uptodate'):
+            for d in dependents[name]:
+                waiting[d] -= 1
+                if waiting[d] == 0:  ready.append(d)
+        else:
+            todo = list(dependents[name])
+            while todo:
+                d = todo.pop()
+                if d not in results:
+                    results[d] = Result('skipped')
+                    todo.extend(dependents[d])
+
+    def timed(job):
+        start = perf_counter()
+        ok, output = job()
+        return Result('ok' if ok else 'failed', perf_counter() - start, output)
+
+    ready = [ n for n, c in waiting.items() if c == 0 ]
+    running = {}
+    with ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as ex:
+        while ready or running:
+            while ready:
+                name = ready.pop(0)
+                job = byname[name]
+                if not ran.intersection(job.deps) and job.uptodate():
+                    finish(name, Result('uptodate'))
+                    continue
+                ran.add(name)
+                running[ex.submit(timed, job)] = name
+            if running:
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for f in done:
+                    finish(running.pop(f), f.result())
+    return results
+
+def report(results, elapsed, file=None, slowest=5):
+    ''' Print the output of each failed job and a timing summary to
+        `file` (default `sys.stdout`), returning the number of jobs that
+        failed or were skipped.
+    '''
+    if file is None:  file = sys.stdout
+    bad = 0
+    for name, r in sorted(results.items()):
+        if r.status == 'failed':
+            bad += 1
+            print(f'----- FAILED: {name} ({r.elapsed:.1f}s)', file=file)
+            file.write(r.output)
+        elif r.status == 'skipped':
+            bad += 1
+            print(f'----- SKIPPED (dependency failed): {name}', file=file)
+    counts = {}
+    for r in results.values():
+        counts[r.status] = counts.get(r.status, 0) + 1
+    total = sum(r.elapsed for r in results.values())
+    print('jobs: ' + ', '.join(f'{n} {s}' for s, n in sorted(counts.items()))
+        + f'; {total:.1f}s of work in {elapsed:.1f}s'
+        + (f' ({total/elapsed:.1f}×)' if elapsed > 0 and total else ''),
+        file=file)
+    timed = sorted(results.items(), key=lambda i: -i[1].elapsed)
+    for name, r in timed[:slowest]:
+        if r.elapsed < 0.05:  break
+        print(f'  {r.elapsed:6.2f}s  {name}', file=file)
+    return bad
+
+####################################################################
+#   The jobs for this project
+
+#   Binary output conversions of .p files in $BUILDDIR/obj/exe/ as
+#   (output extension, command, .p file glob). The output file is the
+#   .p file with the new extension and, if the extension is all upper
+#   case, an upper-case file name.
+CONVERSIONS = (
+    ('com', 'p2bin -q',                        'cpm/*.p'),
+    ('bin', 'p2bin -q',                        'nec/pc8001/exprom1.p'),
+    ('CO',  'p2bin -q',                        'kc85/m100/cotest.p'),
+    ('CO',  'p2b kc85',                        'kc85/m100/hello.p'),
+    ('CO',  'p2b kc85',                        'kc85/m100/tmon.p'),
+    ('bin', 'p2bin -q',                        'm5/hello.p'),
+    ('bin', 'p2bin -q',                        'nec/tk85/portmon.p'),
+    #   Sharp MZ object files contain the tape header already, so directly
+    #   generate the .mzf file from it. This will change when we write a
+    #   conversion program that generates the tape headers and output from
+    #   the .p file.
+    ('mzf', 'p2bin -q',                        'sharp/*.p'),
+    ('wav', 'cmtconv -p jr200  -f HELLO',      'jr200/hello.p'),
+    ('wav', 'cmtconv -p mb6885 -f HELLO.B',    'mb6885/hello.p'),
+    ('bin', 'cmtconv -p mb6885 -f HELLO.B -o cas', 'mb6885/hello.p'),
+)
+
+def objpath(source):
+    ' The `.p` file path, relative to $BUILDDIR/obj/, for `source`. '
+    return str(Path(source).with_suffix('.p'))
+
+def asm_jobs(sources):
+    ' Return a `Job` for each source to assemble. '
+    return [ Job(f'asm {s}', ['t8dev', 'asl', 'asm', s], cwd=PROJDIR)
+        for s in sources ]
+
+def build_jobs(sources):
+    ''' Return the jobs to assemble `sources` (paths relative to
+        `PROJDIR`) and do all binary output conversions that use their
+        outputs or existing ``.p`` files.
+    '''
+    jobs = asm_jobs(sources)
+    exeobj = BUILDDIR / 'obj' / 'exe'
+    #   .p files relative to exeobj, with the asm job producing them (if any)
+    pfiles = { str(p.relative_to(exeobj)): None for p in exeobj.rglob('*.p') }
+    for s in sources:
+        if Path(s).parts[0] == 'exe':
+            pfiles[objpath(Path(*Path(s).parts[1:]))] = f'asm {s}'
+
+    def convert(ext, command, pglob):
+        for p in sorted( p for p in pfiles if fnmatch(p, pglob) ):
+            outname = Path(p).with_suffix('.' + ext).name
+            if ext == ext.upper():  outname = outname.upper()
+            out = str(Path(p).parent / outname)
+            yield Job(f'{command.split()[0]} {out}',
+                command.split() + [p, out],
+                [pfiles[p]] if pfiles[p] else [], cwd=exeobj,
+                inputs=[exeobj / p], outputs=[exeobj / out])
+
+    for conv in CONVERSIONS:
+        jobs += convert(*conv)
+
+    #   p2a2bin writes to stdout.
+    p = 'vcs/frobecho.p'
+    jobs.append(Job('p2a2bin vcs/frobecho.obj0',
+        ['p2a2bin', str(exeobj / p)], [pfiles[p]] if pfiles.get(p) else [],
+        stdout=exeobj / 'vcs/frobecho.obj0',
+        inputs=[exeobj / p], outputs=[exeobj / 'vcs/frobecho.obj0']))
+
+    #   Hack to make emulator use easier. VirtualT File » Load from HD
+    #   always starts in the emulator dir, regardless of where you last
+    #   left it.
+    virtualt = BUILDDIR / 'emulator' / 'virtualt'
+    co = [ j for j in jobs if j.name.endswith('.CO') ]
+    def copy_co():
+        virtualt.mkdir(parents=True, exist_ok=True)
+        for j in co:  shutil.copy(j.outputs[0], virtualt)
+    jobs.append(Job('copy emulator/virtualt/', copy_co, [j.name for j in co]))
+
+    #   This builds an Apple II disk image from an AS source file. Probably
+    #   this should be in smaller steps so we can extend the idea to
+    #   building output for other microcomputers where we may want, e.g.,
+    #   a raw file for an emulator, a tape image with that file, and a
+    #   disk image with that file that autoboots, all from the same build.
+    #   `t8dev a2dsk` assembles the source itself, so it must not run at
+    #   the same time as an ``asm`` job writing the same object files.
+    src = 'exe/a2/charset.a65'
+    jobs.append(Job(f'a2dsk {src}', ['t8dev', 'a2dsk', src],
+        [f'asm {src}'] if src in sources else [], cwd=PROJDIR))
+    return jobs
+
+#   Files for the release tree, as (source relative to PROJDIR, destination
+#   relative to the release tree).
+RELEASE_FILES = (
+    ('src/tmon/*.md',                       'tmon/'),
+    ('.build/obj/exe/cpm/tmonlo.com',       'tmon/cpm/TMONLO.COM'),
+    ('.build/obj/exe/kc85/m100/TMON.CO',    'tmon/m100/'),
+    ('exe/nec/pc8001/README.md',            'pc8001/'),
+    ('.build/obj/exe/nec/pc8001/exprom1.bin', 'pc8001/'),
+)
+
+def release_jobs():
+    ''' Return the jobs to copy `RELEASE_FILES` into a fresh release tree
+        and zip it.
+    '''
+    reldir = BUILDDIR / 'release' / 'unpacked'
+    shutil.rmtree(reldir, ignore_errors=True)
+    for old in (BUILDDIR / 'release').glob('*.zip'):  old.unlink()
+
+    def copy(src, dest):
+        def action():
+            files = sorted(PROJDIR.glob(src))
+            if not files:  raise FileNotFoundError(src)
+            target = reldir / dest
+            if dest.endswith('/'):
+                target.mkdir(parents=True, exist_ok=True)
+            else:
+                target.parent.mkdir(parents=True, exist_ok=True)
+            for f in files:  shutil.copy(f, target)
+        return action
+
+    jobs = [ Job(f'copy {src}', copy(src, dest))
+        for src, dest in RELEASE_FILES ]
+    jobs.append(Job('zip', ['zip', '-q', '-r',
+            f'../8bitdev-{int(time())}.zip', '.'],
+        [ j.name for j in jobs ], cwd=reldir))
+    return jobs
+
+def main(argv=None):
+    p = ArgumentParser(description='Run build jobs in parallel.')
+    p.add_argument('command', choices=('build', 'release'))
+    p.add_argument('sources', nargs='*', help='sources to assemble')
+    p.add_argument('-j', '--jobs', type=int, default=None,
+        help='maximum parallel jobs (default: number of CPUs)')
+    args = p.parse_args(argv)
+
+    jobs = build_jobs(args.sources) if args.command == 'build' \
+        else release_jobs()
+    start = perf_counter()
+    results = run(jobs, args.jobs)
+    bad = report(results, perf_counter() - start)
+    return 1 if bad else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,196 @@
+''' Batched calls of a routine for exhaustive sweeps over its inputs.
+
+    `call_many()` runs a routine once for each of a sequence of input
+    register sets and collects the output registers and flags into a
+    `Results`, which holds one compact `array` per register or flag.
+    A typical exhaustive test is then a single assertion::
+
+        res = call_many(m, S.qdigit, { 'a': range(0x100) })
+        assert [] == res.mismatches(R(a=n, N=0) for n in expected)
+
+    This avoids the per-call overhead of `GenericMachine.call()`
+    (building the `stopat`/`stopon` sets, `stepto()`'s checks on every
+    instruction, and generating a `Registers` object to examine the
+    results) and, when used instead of parametrization, that of pytest
+    fixture setup and teardown for each input.
+'''
+
+from    array  import array
+from    collections.abc  import Mapping
+from    operator  import attrgetter
+from    testmc.generic.machine  import GenericMachine
+
+__all__ = ['call_many', 'Results']
+
+CALL_DEFAULT_RETADDR = 0xFFFD   # same as `GenericMachine.call()`
+MAXSTEPS = GenericMachine.MAXSTEPS
+
+class RegAccess:
+    ''' Fast access to the registers and flags of machine `m`.
+
+        This reads and writes the attributes of the machine's `regsobj`
+        directly, handling flags that are stored only in a status
+        register (e.g., py65's ``p``) as bits of that register.
+    '''
+
+    def __init__(self, m):
+        R = m.Registers
+        self.obj = obj = m._regsobj()
+        self.regnames = tuple(r.name for r in R.registers)
+        self.flagnames = tuple(b.name for b in R.srbits if b.name)
+        srname = R()._srname()
+        if srname and hasattr(obj, srname):
+            self.srname = srname
+            top = len(R.srbits) - 1
+            self.flagbits = { b.name: 1 << (top - i)
+                for i, b in enumerate(R.srbits) if b.name }
+        else:
+            self.srname = None
+            self.flagbits = {}
+        self.names = self.regnames + self.flagnames
+
+    def getter(self, names):
+        ''' Return a function that returns a tuple of the current values
+            of the registers and flags in `names`.
+        '''
+        obj = self.obj
+        if not self.srname or not set(names) & set(self.flagnames):
+            get = attrgetter(*names)
+            if len(names) == 1:  return lambda: (get(obj),)
+            return lambda: get(obj)
+        srname, flagbits = self.srname, self.flagbits
+        getters = tuple(
+            (lambda bit: lambda: int(bool(getattr(obj, srname) & bit)))
+                (flagbits[n])
+            if n in flagbits else (lambda n: lambda: getattr(obj, n))(n)
+            for n in names)
+        return lambda: tuple(g() for g in getters)
+
+    def set(self, name, value):
+        bit = self.flagbits.get(name)
+        if bit is None:
+            setattr(self.obj, name, int(value))
+        else:
+            sr = getattr(self.obj, self.srname)
+            setattr(self.obj, self.srname, sr | bit if value else sr & ~bit)
+
+class Results:
+    ''' The outputs of `call_many()`.
+
+        Each register or flag in `names` is available as an attribute or
+        item holding an `array` with the value for each input, in input
+        order: ``res.a[i]`` or ``res['a'][i]``. `inputs` is the list of
+        input register sets (`Registers` or `dict`) that were used.
+    '''
+
+    def __init__(self, m, names, inputs):
+        self.Registers = m.Registers
+        self.names = names
+        self.inputs = inputs
+        flags = set(RegAccess(m).flagnames)
+        self.columns = { n: array('B' if n in flags else 'H') for n in names }
+
+    def __len__(self):          return len(self.inputs)
+    def __getitem__(self, name):  return self.columns[name]
+
+    def __getattr__(self, name):
+        try:
+            return self.__dict__['columns'][name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def regs(self, i):
+        ' Return the outputs for input `i` as a `Registers`. '
+        return self.Registers(**{ n: self.columns[n][i] for n in self.names })
+
+    def mismatches(self, expected):
+        ''' Compare `expected`, a sequence of `Registers` in the same order
+            as the inputs, against the outputs, ignoring any registers and
+            flags that are `None` in the expected value (as `Registers`
+            comparison does). Returns a list of ``(input, expected,
+            actual)`` for each input where they differ, thus an empty list
+            if all match.
+        '''
+        columns = self.columns
+        bad = []
+        for i, ex in enumerate(expected):
+            for name, value in ex.valued().items():
+                if columns[name][i] != value:
+                    bad.append((self.inputs[i], ex, self.regs(i)))
+                    break
+        return bad
+
+def rows(inputs):
+    ''' Convert `inputs` to a list of register sets. If `inputs` is a
+        mapping of register names to sequences of values (which may be
+        e.g. NumPy arrays), it's converted to a list of dicts of those
+        values with the shortest sequence determining the length.
+    '''
+    if not isinstance(inputs, Mapping):
+        return list(inputs)
+    names = tuple(inputs)
+    return [ dict(zip(names, map(int, values)))
+             for values in zip(*inputs.values()) ]
+
+def call_many(m, addr, inputs, outputs=None, *,
+        retaddr=CALL_DEFAULT_RETADDR, stopat=None, stopon=None,
+        maxsteps=MAXSTEPS):
+    ''' Call the routine at `addr` on `m` for each of `inputs`, returning
+        a `Results` with the values of the `outputs` registers and flags
+        (default: all of them) after each call.
+
+        `inputs` is a sequence of `Registers` or `dict`s of register and
+        flag values, or a mapping of register/flag names to sequences of
+        values. (See `rows()`.) The stack pointer is reset to its initial
+        value before each call, so that calls stopped by `stopat` do not
+        leave the stack growing; other registers not given in an input
+        are left as they were after the previous call. Memory is not
+        reset between calls.
+
+        The `retaddr`, `stopat`, `stopon` and `maxsteps` parameters are
+        the same as for `GenericMachine.call()` and apply to each call
+        individually. `Timeout` and `Abort` exceptions include the index
+        and value of the input that caused them.
+    '''
+    inputs = rows(inputs)
+    ra = RegAccess(m)
+    if outputs is None:  outputs = ra.names
+    outputs = tuple(outputs)
+    res = Results(m, outputs, inputs)
+
+    stopat = set() if stopat is None else set(stopat)
+    if stopon is None:  stopon = m._ABORT_opcodes
+    stopon = set(stopon)
+
+    setregs, set1 = m.setregs, ra.set
+    getpc, getsp, step, byte = m._getpc, m._getsp, m._step, m.byte
+    getout = ra.getter(outputs)
+    appends = tuple(res.columns[n].append for n in outputs)
+
+    sp = getsp()
+    for i, regs in enumerate(inputs):
+        set1('sp', sp)
+        if isinstance(regs, Mapping):
+            for name, value in regs.items():  set1(name, value)
+        else:
+            setregs(regs)
+        set1('pc', addr)
+        initsp = getsp()
+        m.pushretaddr(retaddr)
+        remain = maxsteps
+        while True:
+            pc = getpc()
+            if pc == retaddr and getsp() == initsp:  break
+            if pc in stopat:  break
+            if remain <= 0:
+                raise m.Timeout('input {} {}: timeout after {} opcodes: {}'
+                    .format(i, regs, maxsteps, m.regs))
+            if stopon and byte(pc) in stopon:
+                raise m.Abort('input {} {}: abort on opcode=${:02X}: {}'
+                    .format(i, regs, byte(pc), m.regs))
+            step()
+            remain -= 1
+        for append, value in zip(appends, getout()):
+            append(value)
+
+    return res
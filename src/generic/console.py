@@ -0,0 +1,199 @@
+''' Streaming console I/O for the unit test BIOS.
+
+    The `loadbios` fixture connects the BIOS console to an input stream
+    with a ``read(1)`` method and an output stream with a ``write()``
+    method; by default these are `MBytesIO`, which take all the input up
+    front and keep every byte written. For long interactions, such as
+    uploading kilobytes of Intel hex through the monitor's prompt loop,
+    pass these instead to keep memory use and time per char constant::
+
+        inp, out = loadbios(input=StreamInput(records()),
+                            output=StreamOutput(expect=responses()))
+
+    - `StreamInput` reads lazily from `bytes`, a binary file, or any
+      iterable (e.g., a generator) of `bytes`, `str` or `int` chunks.
+    - `StreamOutput` keeps only the last `keep` bytes written (for
+      `written()` and error messages) and, if given expected output,
+      checks each byte as it's written, raising `OutputMismatch` from
+      the simulated write at the first difference.
+'''
+
+from    collections  import deque
+
+__all__ = ['StreamInput', 'StreamOutput', 'OutputMismatch']
+
+def chunks(source):
+    ''' Return an iterator over `source` as `bytes` chunks. `source` may be
+        `bytes`, a file (anything with a ``read()`` method) or an iterable
+        of `bytes`, `str` (encoded as ISO-8859-1) or `int` chunks.
+    '''
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return iter((bytes(source),))
+    read = getattr(source, 'read', None)
+    if callable(read):
+        return iter(lambda: read(0x1000), b'')
+    return map(tobytes, source)
+
+def tobytes(chunk):
+    if isinstance(chunk, int):
+        return bytes((chunk,))
+    if isinstance(chunk, str):
+        return chunk.encode('ISO-8859-1')
+    return bytes(chunk)
+
+class StreamInput:
+    ''' A console input stream that reads from `source` (see `chunks()`)
+        only as the simulated program consumes input.
+
+        `nread` is the number of bytes read so far.
+    '''
+
+    def __init__(self, source=b''):
+        self._chunks = chunks(source)
+        self._buf = b''
+        self._pos = 0
+        self.nread = 0
+
+    def _fill(self):
+        ' Make the current chunk non-empty, returning `False` at EOF. '
+        while self._pos >= len(self._buf):
+            self._buf = next(self._chunks, None)
+            self._pos = 0
+            if self._buf is None:
+                self._buf = b''
+                return False
+        return True
+
+    def read(self, size=-1):
+        ''' Return up to `size` bytes (all remaining input if `size` is
+            negative), or ``b''`` at the end of input.
+        '''
+        if size == 1:                   # fast path for the BIOS
+            if not self._fill():
+                return b''
+            self._pos += 1
+            self.nread += 1
+            return self._buf[self._pos-1:self._pos]
+        out = bytearray()
+        while size < 0 or len(out) < size:
+            if not self._fill():
+                break
+            n = len(self._buf) - self._pos
+            if size >= 0:  n = min(n, size - len(out))
+            out += self._buf[self._pos:self._pos+n]
+            self._pos += n
+        self.nread += len(out)
+        return bytes(out)
+
+    def append(self, source):
+        ' Add further input from `source` after that already queued. '
+        rest = self._chunks
+        def more():
+            yield from rest
+            yield from chunks(source)
+        self._chunks = more()
+
+class OutputMismatch(AssertionError):
+    ' The output written differs from the expected output. '
+
+class StreamOutput:
+    ''' A console output stream that keeps only the last `keep` bytes
+        written, optionally checking them against expected output (see
+        `expect()`) as they are written.
+
+        `total` is the number of bytes written in all.
+    '''
+
+    CONTEXT = 40        # bytes of context shown in `OutputMismatch`
+
+    def __init__(self, keep=0x1000, expect=None):
+        self.keep = keep
+        self.total = 0
+        self.matching = False           # set by `expect()`
+        self._buf = bytearray()
+        self._expected = deque()        # iterators of expected chunks
+        self._exp = b''                 # current expected chunk
+        self._exppos = 0
+        if expect is not None:
+            self.expect(expect)
+
+    def write(self, b):
+        buf = self._buf
+        buf += b
+        if self.matching:
+            self._check(b)
+        if len(buf) > 2 * self.keep:
+            del buf[:len(buf) - self.keep]      # not buf[:-keep]: keep may be 0
+        self.total += len(b)
+        return len(b)
+
+    def flush(self):
+        pass
+
+    def written(self):
+        ' Return the last (up to) `keep` bytes written. '
+        buf = self._buf
+        return bytes(buf[max(0, len(buf) - self.keep):])
+
+    def clear(self):
+        ' Discard the kept output (but not the expected output). '
+        self._buf.clear()
+
+    ################################################################
+    #   Incremental matching
+
+    def expect(self, source):
+        ''' Add `source` (see `chunks()`) to the output expected after any
+            expected output not yet written. Once this has been called,
+            any output beyond the expected output is also a mismatch.
+        '''
+        self.matching = True
+        self._expected.append(chunks(source))
+
+    def _nextexp(self):
+        ''' Make the current expected chunk non-empty, returning `False`
+            if there is no more expected output.
+        '''
+        while self._exppos >= len(self._exp):
+            if not self._expected:
+                return False
+            self._exp = next(self._expected[0], None)
+            self._exppos = 0
+            if self._exp is None:
+                self._expected.popleft()
+                self._exp = b''
+        return True
+
+    def _check(self, b):
+        for i, byte in enumerate(b):
+            if not self._nextexp():
+                self._mismatch(i, len(b), None)
+            if byte != self._exp[self._exppos]:
+                self._mismatch(i, len(b), self._exp[self._exppos:])
+            self._exppos += 1
+
+    def _mismatch(self, i, n, expected):
+        ''' Raise `OutputMismatch` for byte `i` of the `n` just written,
+            which should have been `expected`.
+        '''
+        end = len(self._buf) - n + i + 1
+        got = bytes(self._buf[max(0, end - self.CONTEXT):end])
+        if expected is None:
+            msg = 'output after end of expected output'
+        else:
+            msg = f'expected {expected[:self.CONTEXT]!r}'
+        raise OutputMismatch(f'output offset {self.total + i}:'
+            f' {msg}, got …{got!r}')
+
+    def pending(self, limit=None):
+        ''' Return expected output not yet written, consuming it. With
+            `limit`, return no more than `limit` bytes (and consume only
+            those). This is ``b''`` when all expected output was written.
+        '''
+        out = bytearray()
+        while (limit is None or len(out) < limit) and self._nextexp():
+            n = len(self._exp) - self._exppos
+            if limit is not None:  n = min(n, limit - len(out))
+            out += self._exp[self._exppos:self._exppos+n]
+            self._exppos += n
+        return bytes(out)
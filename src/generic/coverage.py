@@ -0,0 +1,146 @@
+''' Coverage of assembly source lines by the simulated code under test.
+
+    With ``./Test --simcoverage=FILE`` the `m` fixture uses `attach()` on
+    every machine it creates with a ``test_rig``. This replaces the
+    machine's `_step()` with one that marks the address of
+    each instruction executed in a 64K map for that rig (one byte per
+    address, for the cheapest possible marking; it's sent between
+    processes compressed). The maps from all pytest-xdist workers are
+    merged by the controller at the end of the session.
+
+    The assembler's source line information for each rig (stored in the
+    `rigcache` entry) then maps the executed addresses back to source
+    lines. A line that generated code in any rig is *covered* if any
+    instruction assembled from it was executed by any test. Data lines
+    (``db``, ``dw``, ``ds``, etc.) are not counted.
+
+    The terminal summary gives, for each source file, the numbers of
+    covered and uncovered lines and the ranges of uncovered lines; the
+    full per-line results are saved as JSON in `FILE`.
+'''
+
+from    itertools  import groupby
+from    t8dev  import path
+import  json, re, zlib
+
+__all__ = ['Coverage', 'attach', 'session', 'enable', 'DATA_RE']
+
+#   The `Coverage` that the `m` fixture attaches to new machines,
+#   or `None` if coverage is not enabled.
+session = None
+
+def enable():
+    ' Enable session coverage, returning the session `Coverage`. '
+    global session
+    if session is None:
+        session = Coverage()
+    return session
+
+#   Source lines that assemble data rather than instructions: an optional
+#   label (starting in column 1) followed by a data pseudo-op or macro.
+DATA_RE = re.compile(
+    r'^(?:[^\s;]+)?\s+\.?(?:db|dw|dd|ds|dc(?:\.\w)?|dfb|dfs|fcb|fcc|fcs'
+    r'|fdb|rmb|byt|byte|word|zds|pb|pw|binclude)\b', re.IGNORECASE)
+
+def attach(m, hits):
+    ''' Replace `m._step()` with one that sets ``hits[pc]`` to 1 for
+        each instruction executed.
+    '''
+    step, getpc = m._step, m._getpc
+    def covered_step():
+        hits[getpc()] = 1
+        step()
+    m._step = covered_step
+
+class Coverage:
+    ''' Executed-address maps for rigs, and the source line coverage
+        derived from them.
+
+        `rigs` maps the name of each rig (its ``.pt`` file) to its
+        `rigcache` key and its map of executed addresses.
+    '''
+
+    def __init__(self):
+        self.rigs = {}
+
+    def __bool__(self):
+        return bool(self.rigs)
+
+    def hits(self, name, key):
+        ' The executed-address map for rig `name` with `rigcache` `key`. '
+        rig = self.rigs.get(name)
+        if rig is None or rig[0] != key:
+            rig = self.rigs[name] = (key, bytearray(0x10000))
+        return rig[1]
+
+    def records(self):
+        ' The maps, compressed, for `merge()` into another `Coverage`. '
+        return { name: (key, zlib.compress(bytes(hits)))
+                 for name, (key, hits) in self.rigs.items() }
+
+    def merge(self, records):
+        ' Add in `records()` from another `Coverage`. '
+        for name, (key, data) in records.items():
+            hits = self.hits(name, key)
+            other = zlib.decompress(data)
+            hits[:] = (int.from_bytes(hits, 'big')
+                | int.from_bytes(other, 'big')).to_bytes(len(hits), 'big')
+
+    def lines(self, lineinfo, source=None):
+        ''' Return ``{ file: { line: covered } }`` for all source lines
+            that generated code in any rig.
+
+            `lineinfo(key)` returns the ``(file, line, addr)`` entries for
+            the rig with `rigcache` key `key`. `source(file)` returns the
+            text lines of `file` (or `None`), and is used to skip data
+            lines; the default is `read_source()`.
+        '''
+        if source is None:  source = read_source
+        files = {}
+        for key, hits in self.rigs.values():
+            for file, line, addr in lineinfo(key):
+                lines = files.setdefault(file, {})
+                lines[line] = lines.get(line, False) or bool(hits[addr])
+        for file, lines in files.items():
+            text = source(file)
+            if text is None:  continue
+            for n in list(lines):
+                if 0 < n <= len(text) and DATA_RE.match(text[n-1]):
+                    del lines[n]
+        return { f: l for f, l in sorted(files.items()) if l }
+
+    def report(self, files):
+        ' A text table of the coverage in `files` from `lines()`. '
+        out = [f'{"file":<32} {"lines":>6} {"cover":>6}  uncovered']
+        for file, lines in files.items():
+            covered = sum(lines.values())
+            missed = [ n for n, c in sorted(lines.items()) if not c ]
+            out.append(f'{file:<32} {len(lines):6d}'
+                f' {covered / len(lines):6.0%}  {ranges(missed)}')
+        return '\n'.join(out)
+
+    def save(self, file, files):
+        ' Save `files` from `lines()` as JSON to `file`. '
+        with open(file, 'w') as f:
+            json.dump({ name: {
+                    'covered':   sorted(n for n, c in lines.items() if c),
+                    'uncovered': sorted(n for n, c in lines.items() if not c),
+                } for name, lines in files.items() }, f, indent=1)
+            f.write('\n')
+
+def read_source(file):
+    ''' The lines of `file` (relative to the project directory), or `None`
+        if it cannot be read.
+    '''
+    try:
+        return path.proj(file).read_text(encoding='utf-8').splitlines()
+    except (OSError, UnicodeDecodeError):
+        return None
+
+def ranges(numbers):
+    ' Format sorted `numbers` as a compact list of ranges, e.g. ``3-5,9``. '
+    out = []
+    for _, g in groupby(enumerate(numbers), lambda p: p[1] - p[0]):
+        g = [ n for _, n in g ]
+        out.append(str(g[0]) if len(g) == 1 else f'{g[0]}-{g[-1]}')
+    return ','.join(out)
@@ -0,0 +1,375 @@
+''' Fast execution of simulated code by translating it to Python.
+
+    The testmc simulators decode and dispatch every instruction through
+    several layers of Python function calls, and `GenericMachine.call()`
+    adds further per-instruction checks on top of that. This is fine for
+    most unit tests, but routines that loop over large amounts of memory
+    (e.g., checksums of most of the address space) take millions of steps
+    and tens of seconds at that speed.
+
+    `FastExec` instead translates each basic block (a run of instructions
+    ending with a control transfer) into straight-line Python operating on
+    local variables. The blocks reachable from an entry point through
+    jumps, calls and branches are compiled together into a `Region`: a
+    single function that dispatches between its blocks in a loop, keeping
+    the registers in local variables until control leaves the region.
+    Regions are cached by entry address. `fastcall()` is a drop-in
+    replacement for `GenericMachine.call()` that uses a per-machine
+    `FastExec`.
+
+    Results are exactly the same as from the interpreter:
+    - Instructions the CPU-specific `Translator` does not handle (and any
+      instruction at a `stopat` address or with a `stopon` opcode) are not
+      translated but executed or handled by the interpreter.
+    - Before a cached region is entered its code bytes are compared with
+      current memory, and it's re-translated if they differ, so changes
+      made outside it (e.g., by test code or the interpreter) are always
+      seen.
+    - Translated code that writes to memory containing translated code
+      leaves the region immediately after that instruction, so that the
+      change is seen. (Self-modifying code is thus slower, but correct.)
+    - Reads and writes of addresses with I/O functions (`IOMem.setio()`)
+      go through the `IOMem` as usual.
+    - The step count used for `maxsteps` is the same, and blocks too long
+      to fit in the remaining steps are executed with the interpreter, so
+      `Timeout` is raised at exactly the same point.
+
+    The exception is that if an I/O function raises an exception (e.g.,
+    `EOFError` on end of input) registers will be left as they were at
+    entry to the region rather than the instruction doing the I/O.
+
+    Tracing, ``nstop`` and profiling (a `_step()` replaced on the machine
+    instance, e.g. by `src.generic.profiler.Profiler`) are not supported;
+    `fastcall()` uses the standard `call()` in these cases.
+'''
+
+from    collections.abc  import Container
+import  re
+
+from    testmc.generic.machine  import GenericMachine
+
+__all__ = ['FastExec', 'fastcall', 'Translator', 'Insn']
+
+CALL_DEFAULT_RETADDR = 0xFFFD   # same as `GenericMachine.call()`
+MAXSTEPS = GenericMachine.MAXSTEPS
+
+####################################################################
+#   Translation
+
+class Insn:
+    ''' The translation of a single instruction of `length` bytes into
+        Python source `lines` using the translator's register variables
+        and the memory access functions described in `Translator`.
+
+        If `transfer` is true the instruction ends the block and `lines`
+        must set ``npc`` to the address of the next instruction to
+        execute; `targets` are the addresses to which it may transfer
+        control that are known at translation time. Otherwise execution
+        continues at the following address.
+    '''
+    def __init__(self, length, lines, transfer=False, targets=()):
+        self.length = length
+        self.lines = lines
+        self.transfer = transfer
+        self.targets = targets
+
+class Translator:
+    ''' Superclass for CPU-specific instruction translators.
+
+        Subclasses define `registers`, the names of the machine's register
+        and flag attributes (which must be plain attributes on the machine
+        object; split registers must be translated to operations on their
+        wide register) and `translate()`.
+
+        The generated code loads into local variables of the same name the
+        registers its instructions use, and stores back those they assign.
+        Within instruction lines:
+        - ``RD(e)`` is replaced by code reading the memory byte at address
+          `e`, which must be a variable name or a number.
+        - ``WR(e, v)`` is replaced by code writing `v` to address `e`;
+          this must be a statement on a line by itself.
+        - ``PARITY[b]`` is `True` if byte `b` has even parity.
+        - Temporaries must not use register names; ``npc`` and names
+          starting with ``__`` are reserved.
+    '''
+
+    registers = ()
+
+    def translate(self, mem, pc):
+        ''' Return an `Insn` for the instruction at `pc` in `mem`
+            (a `memoryview`), or `None` if it should be executed by the
+            interpreter.
+        '''
+        raise NotImplementedError()
+
+PARITY = tuple(bin(b).count('1') % 2 == 0 for b in range(0x100))
+
+ASSIGN = re.compile(r'\b(\w+)\s*(?:[-+|&^]|<<|>>)?=(?!=)')
+IDENT  = re.compile(r'\b[A-Za-z_]\w*\b')
+RD     = re.compile(r'RD\(')
+WR     = re.compile(r'^(\s*)WR\((.*)\)\s*$')
+
+def _args(s):
+    ' Split the text in `WR(…)` at the top-level comma. '
+    depth = 0
+    for i, c in enumerate(s):
+        if c in '([':   depth += 1
+        elif c in ')]': depth -= 1
+        elif c == ',' and depth == 0:
+            return s[:i].strip(), s[i+1:].strip()
+    raise ValueError(f'WR() needs two arguments: {s!r}')
+
+def _expand_reads(line):
+    ''' Replace each ``RD(e)`` in `line` with an inline read that uses the
+        raw memory unless the address has an I/O function.
+    '''
+    while True:
+        match = RD.search(line)
+        if not match:  return line
+        start = match.end(); depth = 1; i = start
+        while depth:
+            depth += {'(': 1, ')': -1}.get(line[i], 0); i += 1
+        e = line[start:i-1]
+        if not IDENT.fullmatch(e) and not e.isdigit():
+            #   Avoid evaluating an expression three times.
+            raise ValueError(f'RD() argument must be a name: {line!r}')
+        line = f'{line[:match.start()]}(__mv[{e}] if not __rio[{e}]' \
+            f' else __mem[{e}]){line[i:]}'
+
+def _block(translator, mv, pc, stops, stopon, rio):
+    ''' Return the list of `(addr, Insn)` for the basic block starting at
+        `pc`, or `None` if the first instruction isn't translatable.
+    '''
+    insns = []
+    addr = pc
+    while len(insns) < FastExec.MAXBLOCK:
+        if insns and addr in stops:  break
+        if mv[addr] in stopon:  break
+        insn = translator.translate(mv, addr)
+        if insn is None:  break
+        if addr + insn.length > len(mv):  break     # no wraparound
+        if any(rio[addr:addr+insn.length]):  break  # code in I/O space?
+        insns.append((addr, insn))
+        addr += insn.length
+        if insn.transfer:  break
+    return insns or None
+
+class Region:
+    ''' Translated code for the blocks reachable from `entry` through
+        static control transfers (up to `FastExec.MAXREGION` blocks).
+
+        `fn(m, pc, remain)` runs the code starting at `pc` until control
+        leaves the region or the next block would take the step count past
+        `remain`, and returns the next PC and number of steps executed.
+        `code` is a list of `(start, end, bytes)` of the code translated.
+    '''
+    __slots__ = ('entry', 'code', 'fn', 'source')
+
+    def valid(self, mv):
+        ' Return whether the translated code is unchanged in `mv`. '
+        for start, end, code in self.code:
+            if mv[start:end] != code:  return False
+        return True
+
+def _region(translator, mv, entry, stops, stopon, rio, namespace):
+    ''' Translate a `Region` starting at `entry`, or return `None` if the
+        first instruction isn't translatable.
+    '''
+    blocks = {}; todo = [entry]
+    while todo and len(blocks) < FastExec.MAXREGION:
+        pc = todo.pop(0)
+        if pc in blocks or pc in stops:  continue
+        insns = _block(translator, mv, pc, stops, stopon, rio)
+        if insns is None:
+            if pc == entry:  return None
+            continue
+        blocks[pc] = insns
+        last, insn = insns[-1]
+        todo.extend(insn.targets if insn.transfer
+            else ((last + insn.length) & 0xFFFF,))
+
+    registers = set(translator.registers)
+    body = []; used = set(); assigned = set(); code = []
+    for i, (start, insns) in enumerate(blocks.items()):
+        body.append(f"{'if' if i == 0 else 'elif'} npc == {start}:")
+        body.append(f'    if __n + {len(insns)} > __remain: break')
+        for k, (addr, insn) in enumerate(insns, 1):
+            writes = False
+            for line in insn.lines:
+                used.update(n for n in IDENT.findall(line) if n in registers)
+                assigned.update(
+                    n for n in ASSIGN.findall(line) if n in registers)
+                wmatch = WR.match(line)
+                if wmatch:
+                    writes = True
+                    indent, args = wmatch.groups()
+                    e, v = _args(args)
+                    body.append(
+                        f'    {indent}if __wsp[{e}]: __hit |= __store({e}, {v})')
+                    body.append(f'    {indent}else: __mv[{e}] = {v}')
+                else:
+                    body.append('    ' + _expand_reads(line))
+            if writes and insn.transfer:
+                #   Leave the region if we wrote to translated code,
+                #   continuing at the npc the transfer has set.
+                body.append(f'    if __hit: __n += {k}; break')
+            elif writes:
+                #   Leave the region if we wrote to translated code.
+                next = (addr + insn.length) & 0xFFFF
+                body.append(f'    if __hit: npc = {next}; __n += {k}; break')
+        if not insn.transfer:
+            body.append(f'    npc = {(addr + insn.length) & 0xFFFF}')
+        body.append(f'    __n += {len(insns)}')
+        end = addr + insn.length
+        code.append((start, end, bytes(mv[start:end])))
+    body.append('else: break')
+
+    src = ['def _region(__m, npc, __remain):']
+    src += [ f'    {r} = __m.{r}' for r in translator.registers if r in used ]
+    src += ['    __hit = False', '    __n = 0', '    while True:']
+    src += [ '        ' + line for line in body ]
+    src += [ f'    __m.{r} = {r}' for r in translator.registers if r in assigned ]
+    src.append('    return npc, __n')
+    src = '\n'.join(src) + '\n'
+
+    ns = dict(namespace)
+    exec(compile(src, f'<region ${entry:04X}>', 'exec'), ns)
+    r = Region()
+    r.entry, r.code, r.fn, r.source = entry, code, ns['_region'], src
+    return r
+
+####################################################################
+#   Execution
+
+class FastExec:
+    ''' Fast execution engine for machine `m` using CPU-specific
+        `translator`. See the module documentation for details.
+
+        `regions` caches the translated `Region`s by entry address; this
+        is cleared when the machine's memory object, the set of stop
+        addresses or opcodes, or the set of I/O addresses changes.
+        `translated` and `interpreted` count the steps executed each way.
+    '''
+
+    MAXBLOCK  = 64          # max. instructions per block
+    MAXREGION = 64          # max. blocks per region
+
+    def __init__(self, m, translator):
+        self.m = m
+        self.translator = translator
+        self.regions = {}
+        self.mem = self.stops = self.stopon = self.ioaddrs = None
+        self.translated = self.interpreted = 0
+
+    def _prepare(self, stops, stopon):
+        mem = self.m.get_memory_seq()
+        ioaddrs = frozenset(getattr(mem, 'iofs', ()))
+        if mem is self.mem and (stops, stopon, ioaddrs) \
+                == (self.stops, self.stopon, self.ioaddrs):
+            return
+        self.mem, self.stops, self.stopon, self.ioaddrs \
+            = mem, stops, stopon, ioaddrs
+        self.regions = {}
+        self.mv = mv = memoryview(mem)
+        self.rio = rio = bytearray(len(mem))    # reads needing `mem`
+        self.wsp = wsp = bytearray(len(mem))    # writes needing `__store()`
+        self.code = code = bytearray(len(mem))  # translated code bytes
+        for a in ioaddrs:  rio[a] = wsp[a] = 1
+
+        def store(addr, value):
+            ''' Write through `mem` and return whether the write hit
+                translated code.
+            '''
+            mem[addr] = value
+            return code[addr]
+
+        self.namespace = dict(__mv=mv, __mem=mem, __rio=rio, __wsp=wsp,
+            __store=store, PARITY=PARITY)
+
+    def region(self, pc):
+        ' Return a valid translated `Region` at `pc`, or `None`. '
+        r = self.regions.get(pc)
+        if r is not None and r.valid(self.mv):
+            return r
+        r = _region(self.translator, self.mv, pc, self.stops, self.stopon,
+            self.rio, self.namespace)
+        self.regions[pc] = r
+        if r is not None:
+            for start, end, _ in r.code:
+                self.wsp[start:end] = self.code[start:end] \
+                    = b'\x01' * (end - start)
+        return r
+
+    def call(self, addr, regs=None, *, retaddr=CALL_DEFAULT_RETADDR,
+            stopat=None, stopon=None, maxsteps=MAXSTEPS):
+        ' As `GenericMachine.call()`. '
+        m = self.m
+        if regs is None:  regs = m.Registers()
+        m.setregs(regs)
+        if addr is not None:
+            m.setregs(m.Registers(pc=addr))
+
+        stops = frozenset(() if stopat is None else stopat) | {retaddr}
+        if stopon is None:  stopon = m._ABORT_opcodes
+        if not isinstance(stopon, Container):  stopon = (stopon,)
+        stopon = frozenset(stopon)
+        self._prepare(stops, stopon)
+
+        m.pushretaddr(retaddr)
+        remain = maxsteps
+        pc = m.pc
+        while True:
+            if pc in stops:
+                m.pc = pc
+                return
+            if remain <= 0:
+                m.pc = pc
+                m._raiseTimeout(maxsteps)
+            r = self.region(pc)
+            if r is not None:
+                pc, n = r.fn(m, pc, remain)
+                remain -= n
+                self.translated += n
+                if n:  continue
+            #   Not translatable, or too long for remaining steps.
+            m.pc = pc
+            if m.byte(pc) in stopon:
+                raise m.Abort('Abort on opcode=${:02X}: {}'
+                    .format(m.byte(pc), m.regs))
+            m._step()
+            pc = m.pc
+            remain -= 1
+            self.interpreted += 1
+
+#   Translators for each machine type, by `Registers.machname`.
+TRANSLATORS = {}
+
+def translator(m):
+    ' Return the `Translator` for machine `m`, or `None` if none. '
+    name = m.Registers.machname
+    if name not in TRANSLATORS:
+        if name == 'i8080':
+            from src.generic.fastexec_i8080 import I8080Translator
+            TRANSLATORS[name] = I8080Translator()
+        elif name == '6800':
+            from src.generic.fastexec_mc6800 import MC6800Translator
+            TRANSLATORS[name] = MC6800Translator()
+        else:
+            TRANSLATORS[name] = None
+    return TRANSLATORS[name]
+
+def fastcall(m, addr, regs=None, *, retaddr=CALL_DEFAULT_RETADDR,
+        stopat=None, stopon=None, nstop=1, maxsteps=MAXSTEPS, trace=False):
+    ''' As `m.call()`, but using a `FastExec` kept on `m` if there is a
+        translator for its CPU, `nstop` and `trace` are not used and
+        `m._step()` has not been replaced.
+    '''
+    t = translator(m)
+    if t is None or nstop != 1 or trace or '_step' in m.__dict__:
+        return m.call(addr, regs, retaddr=retaddr, stopat=stopat,
+            stopon=stopon, nstop=nstop, maxsteps=maxsteps, trace=trace)
+    fx = m.__dict__.get('_fastexec')
+    if fx is None:
+        fx = m._fastexec = FastExec(m, t)
+    return fx.call(addr, regs, retaddr=retaddr, stopat=stopat,
+        stopon=stopon, maxsteps=maxsteps)
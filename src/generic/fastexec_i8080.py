@@ -0,0 +1,192 @@
+''' `FastExec` translator for the `testmc.i8080` simulator.
+
+    The generated code follows `testmc.i8080.opimpl` exactly, including
+    its flag settings (e.g., the original 8080 half-carry on ``ANA``) and
+    `bool` flag values. ``DAA``, ``PUSH/POP PSW``, ``EI``/``DI``, ``HLT``
+    and invalid opcodes are left to the interpreter.
+'''
+
+from    testmc.i8080.opcodes  import OPCODES
+from    src.generic.fastexec  import Translator, Insn
+
+__all__ = ['I8080Translator']
+
+#   Register operand encoding in opcode bits 0-2 and 3-5.
+REG8  = ('b', 'c', 'd', 'e', 'h', 'l', 'm', 'a')
+#   Register pair encoding in opcode bits 4-5.
+REG16 = ('bc', 'de', 'hl', 'sp')
+#   Condition encoding in opcode bits 3-5: NZ Z NC C PO PE P M.
+COND  = ('not Z', 'Z', 'not C', 'C', 'not P', 'P', 'not S', 'S')
+#   RST targets, taken from the simulator's mnemonics (e.g., ``RST28``)
+#   so that we always jump to the same place it does.
+RST   = { op: int(OPCODES[op][0][3:], 16) for op in range(0xC7, 0x100, 8) }
+
+def get8(r):
+    ''' Return `(lines, expr)` giving the value of 8-bit register `r`
+        (``m`` is memory at HL).
+    '''
+    if r == 'a':    return [], 'a'
+    if r == 'm':    return ['_v = RD(hl)'], '_v'
+    pair = {'b':'bc', 'c':'bc', 'd':'de', 'e':'de', 'h':'hl', 'l':'hl'}[r]
+    if r in 'bdh':  return [], f'({pair} >> 8)'
+    return [], f'({pair} & 0xFF)'
+
+def set8(r, expr):
+    ' Return lines setting 8-bit register `r` to `expr`. '
+    if r == 'a':    return [f'a = {expr}']
+    if r == 'm':    return [f'WR(hl, {expr})']
+    pair = {'b':'bc', 'c':'bc', 'd':'de', 'e':'de', 'h':'hl', 'l':'hl'}[r]
+    if r in 'bdh':  return [f'{pair} = (({expr}) << 8) | ({pair} & 0xFF)']
+    return [f'{pair} = ({pair} & 0xFF00) | ({expr})']
+
+def szp(v):
+    ' Lines setting the sign, zero and parity flags from `v`. '
+    return [f'S = {v} > 0x7F', f'Z = {v} == 0', f'P = PARITY[{v}]']
+
+def alu(op, x):
+    ''' Lines for ALU operation number `op` (ADD ADC SUB SBC ANA XRA ORA
+        CMP) of the accumulator with value expression `x`.
+    '''
+    if op in (0, 1):                                    # ADD, ADC
+        c = ' + C' if op == 1 else ''
+        return [f'_x = {x}', f'_s = a + _x{c}',
+                f'H = (a & 0xF) + (_x & 0xF){c} > 0xF',
+                'C = _s > 0xFF', 'a = _s & 0xFF'] + szp('a')
+    if op in (2, 3, 7):                                 # SUB, SBC, CMP
+        c = ' - C' if op == 3 else ''
+        hc = ' + C' if op == 3 else ''
+        dst = '_d' if op == 7 else 'a'
+        return [f'_x = {x}', f'_s = a - _x{c}',
+                f'H = (_x & 0x0F){hc} > (a & 0x0F)',
+                'C = _s < 0', f'{dst} = _s & 0xFF'] + szp(dst)
+    if op == 4:                                         # ANA
+        return [f'_x = {x}', 'H = ((a | _x) & 0x8) != 0', 'a = a & _x',
+                'C = False'] + szp('a')
+    operator = '^' if op == 5 else '|'                  # XRA, ORA
+    return [f'a = a {operator} {x}', 'H = False', 'C = False'] + szp('a')
+
+def push(expr):
+    ' Lines pushing 16-bit value `expr` (evaluated first) on the stack. '
+    return [f'_w = {expr}',
+        'sp = (sp - 1) & 0xFFFF', 'WR(sp, _w >> 8)',
+        'sp = (sp - 1) & 0xFFFF', 'WR(sp, _w & 0xFF)']
+
+def pop(dst):
+    ' Lines popping a 16-bit value into `dst`. '
+    return ['_lo = RD(sp)', 'sp = (sp + 1) & 0xFFFF',
+        '_hi = RD(sp)', 'sp = (sp + 1) & 0xFFFF', f'{dst} = (_hi << 8) + _lo']
+
+def indent(lines):
+    return [ '    ' + l for l in lines ]
+
+class I8080Translator(Translator):
+
+    registers = ('a', 'bc', 'de', 'hl', 'sp', 'S', 'Z', 'H', 'P', 'C')
+
+    def translate(self, mem, pc):
+        op = mem[pc]
+        if pc + 3 > len(mem):
+            return None                 # leave possible wraparound to interp.
+        n = mem[pc+1]
+        nn = mem[pc+1] | (mem[pc+2] << 8)
+        next1, next2, next3 = pc + 1, pc + 2, (pc + 3) & 0xFFFF
+        ddd, sss = (op >> 3) & 7, op & 7
+        rp = REG16[(op >> 4) & 3]
+
+        if 0x40 <= op <= 0x7F:                              # MOV
+            if op == 0x76:  return None                     #   HLT
+            dst, src = REG8[ddd], REG8[sss]
+            if dst == src:  return Insn(1, [])
+            lines, x = get8(src)
+            return Insn(1, lines + set8(dst, x))
+        if 0x80 <= op <= 0xBF:                              # ALU r
+            lines, x = get8(REG8[sss])
+            return Insn(1, lines + alu(ddd, x))
+        if op & 0xC7 == 0xC6:                               # ALU immediate
+            return Insn(2, alu(ddd, str(n)))
+
+        if op < 0x40:
+            low = op & 0x0F
+            if op & 0x07 == 0x04:                           # INR
+                r = REG8[ddd]; lines, x = get8(r)
+                return Insn(1, lines + [f'_r = ({x} + 1) & 0xFF']
+                    + set8(r, '_r') + szp('_r') + ['H = (_r & 0xF) == 0x0'])
+            if op & 0x07 == 0x05:                           # DCR
+                r = REG8[ddd]; lines, x = get8(r)
+                return Insn(1, lines + [f'_r = ({x} - 1) & 0xFF']
+                    + set8(r, '_r') + szp('_r') + ['H = (_r & 0xF) != 0xF'])
+            if op & 0x07 == 0x06:                           # MVI
+                return Insn(2, set8(REG8[ddd], str(n)))
+            if low == 0x01:                                 # LXI
+                return Insn(3, [f'{rp} = {nn}'])
+            if low == 0x03:                                 # INX
+                return Insn(1, [f'{rp} = ({rp} + 1) & 0xFFFF'])
+            if low == 0x0B:                                 # DCX
+                return Insn(1, [f'{rp} = ({rp} - 1) & 0xFFFF'])
+            if low == 0x09:                                 # DAD
+                return Insn(1, [f'_s = hl + {rp}', 'C = _s > 0xFFFF',
+                    'hl = _s & 0xFFFF'])
+            if op == 0x00:  return Insn(1, [])              # NOP
+            if op == 0x02:  return Insn(1, ['WR(bc, a)'])   # STAX B
+            if op == 0x12:  return Insn(1, ['WR(de, a)'])   # STAX D
+            if op == 0x0A:  return Insn(1, ['a = RD(bc)'])  # LDAX B
+            if op == 0x1A:  return Insn(1, ['a = RD(de)'])  # LDAX D
+            if op == 0x32:  return Insn(3, [f'WR({nn}, a)'])    # STA
+            if op == 0x3A:  return Insn(3, [f'a = RD({nn})'])   # LDA
+            if op == 0x22:                                  # SHLD
+                if nn == 0xFFFF:  return None
+                return Insn(3, [f'WR({nn}, hl & 0xFF)', f'WR({nn+1}, hl >> 8)'])
+            if op == 0x2A:                                  # LHLD
+                if nn == 0xFFFF:  return None
+                return Insn(3, [f'hl = RD({nn}) + 0x100 * RD({nn+1})'])
+            if op == 0x07:                                  # RLC
+                return Insn(1, ['_c = (a & 0x80) != 0',
+                    'a = ((a << 1) & 0xFF) | _c', 'C = _c'])
+            if op == 0x17:                                  # RAL
+                return Insn(1, ['_c = (a & 0x80) != 0',
+                    'a = ((a << 1) & 0xFF) | C', 'C = _c'])
+            if op == 0x0F:                                  # RRC
+                return Insn(1, ['_c = (a & 0x01) != 0',
+                    'a = (a >> 1) | (0x80 if _c else 0)', 'C = _c'])
+            if op == 0x1F:                                  # RAR
+                return Insn(1, ['_c = (a & 0x01) != 0',
+                    'a = (a >> 1) | (0x80 if C else 0)', 'C = _c'])
+            if op == 0x2F:  return Insn(1, ['a = a ^ 0xFF'])    # CMA
+            if op == 0x37:  return Insn(1, ['C = True'])        # STC
+            if op == 0x3F:  return Insn(1, ['C = not C'])       # CMC
+            return None                                     # DAA, invalid
+
+        #   $C0-$FF
+        cond = COND[ddd]
+        if op == 0xC3:                                      # JMP
+            return Insn(3, [f'npc = {nn}'], True, (nn,))
+        if op & 0xC7 == 0xC2:                               # Jcc
+            return Insn(3, [f'npc = {nn} if {cond} else {next3}'],
+                True, (nn, next3))
+        if op == 0xCD:                                      # CALL
+            return Insn(3, push(str(next3)) + [f'npc = {nn}'], True, (nn,))
+        if op & 0xC7 == 0xC4:                               # Ccc
+            return Insn(3, [f'if {cond}:'] + indent(push(str(next3))
+                + [f'npc = {nn}']) + ['else:', f'    npc = {next3}'],
+                True, (nn, next3))
+        if op == 0xC9:                                      # RET
+            return Insn(1, pop('npc'), transfer=True)
+        if op & 0xC7 == 0xC0:                               # Rcc
+            return Insn(1, [f'if {cond}:'] + indent(pop('npc'))
+                + ['else:', f'    npc = {next1}'], True, (next1,))
+        if op & 0xC7 == 0xC7:                               # RST
+            return Insn(1, push(str(next1)) + [f'npc = {RST[op]}'],
+                True, (RST[op],))
+        if op in (0xC5, 0xD5, 0xE5):                        # PUSH
+            return Insn(1, push(rp))
+        if op in (0xC1, 0xD1, 0xE1):                        # POP
+            return Insn(1, pop(rp))
+        if op == 0xE9:                                      # PCHL
+            return Insn(1, ['npc = hl'], transfer=True)
+        if op == 0xF9:  return Insn(1, ['sp = hl'])         # SPHL
+        if op == 0xEB:                                      # XCHG
+            return Insn(1, ['_w = de', 'de = hl', 'hl = _w'])
+        if op == 0xE3:                                      # XTHL
+            return Insn(1, ['_s1 = sp + 1', '_w = RD(sp) + 0x100 * RD(_s1)',
+                'WR(sp, hl & 0xFF)', 'WR(_s1, hl >> 8)', 'hl = _w'])
+        return None         # PUSH/POP PSW, EI, DI, IN, OUT, invalid
@@ -0,0 +1,259 @@
+''' `FastExec` translator for the `testmc.mc6800` simulator.
+
+    The generated code follows `testmc.mc6800.opimpl` exactly, including
+    the types of the flag values it sets (`bool` from most operations but
+    `int` from e.g. ``CLC`` and ``COM``). ``RTI``, ``SWI`` and invalid or
+    unimplemented opcodes are left to the interpreter.
+'''
+
+from    testmc.mc6800.opcodes  import OPCODES
+from    src.generic.fastexec  import Translator, Insn
+
+__all__ = ['MC6800Translator']
+
+#   Branch conditions, by opcode.
+BRANCH = {
+    0x20: 'True',           0x22: 'not C and not Z',    0x23: 'C or Z',
+    0x24: 'not C',          0x25: 'C',
+    0x26: 'not Z',          0x27: 'Z',
+    0x28: 'not V',          0x29: 'V',
+    0x2A: 'not N',          0x2B: 'N',
+    0x2C: 'not (N ^ V)',    0x2D: 'N ^ V',
+    0x2E: 'not Z and not (N ^ V)',                      0x2F: 'Z or (N ^ V)',
+}
+
+def nz(v, signbit=7):
+    ' Lines setting the N and Z flags from `v`. '
+    return [f'N = ({v} & {1 << signbit}) != 0', f'Z = {v} == 0']
+
+def nzv(v, signbit=7):
+    ' Lines for `opimpl.logicNZV()`. '
+    return ['V = False'] + nz(v, signbit)
+
+def add(r, x, carry=''):
+    ''' Lines adding `x` (and, if `carry` is ``' + C'``, the carry) to
+        register `r` with the flags set as `opimpl.add()`.
+    '''
+    return [f'_x = {x}', f'_s = {r} + _x{carry}', f'_r = _s & 0xFF',
+        f'H = ({r} & 0xF) + (_x & 0xF){carry} > 0xF',
+        f'V = (({r} ^ _r) & (_x ^ _r) & 0x80) != 0',
+        'C = _s > 0xFF', f'{r} = _r'] + nz(r)
+
+def sub(r, x, borrow='', store=True):
+    ''' Lines subtracting `x` (and, if `borrow` is ``' - C'``, the carry)
+        from register `r` with the flags set as `opimpl.sub()`, storing
+        the result in `r` only if `store` is set.
+    '''
+    return [f'_x = {x}', f'_s = {r} - _x{borrow}', f'_r = _s & 0xFF',
+        f'V = (({r} ^ _x) & ({r} ^ _r) & 0x80) != 0', 'C = _s < 0'] \
+        + ([f'{r} = _r'] + nz(r) if store else nz('_r'))
+
+def shift(op, v):
+    ''' Lines for the shift or rotate in the low nybble of `op` of `v`,
+        leaving the result in ``_r``, with flags as `opimpl.shiftflags()`.
+    '''
+    lines = {
+        0x4: ['_c = (_v & 1) != 0', '_r = _v >> 1'],
+        0x6: ['_c = (_v & 1) != 0', '_r = (_v >> 1) | (C << 7)'],
+        0x7: ['_c = (_v & 1) != 0', '_r = (_v >> 1) | (_v & 0x80)'],
+        0x8: ['_c = (_v & 0x80) != 0', '_r = (_v << 1) & 0xFF'],
+        0x9: ['_c = (_v & 0x80) != 0', '_r = (_v << 1) & 0xFF | C'],
+    }[op & 0xF]
+    return [f'_v = {v}'] + lines + ['Z = _r == 0', 'N = (_r & 0x80) != 0',
+        'C = _c', 'V = N ^ C']
+
+def unary(op, v):
+    ''' Lines for the single-operand read-modify-write instruction in the
+        low nybble of `op` operating on `v`, leaving the result in ``_r``,
+        or `None` if it's not such an instruction.
+    '''
+    low = op & 0xF
+    if low == 0x0:                                      # NEG
+        return [f'_v = {v}', 'V = _v == 0x80', 'C = _v != 0x00',
+            '_r = ((_v ^ 0xFF) + 1) & 0xFF'] + nz('_r')
+    if low == 0x3:                                      # COM
+        return ['V = 0', 'C = 1', f'_r = {v} ^ 0xFF'] + nz('_r')
+    if low in (0x4, 0x6, 0x7, 0x8, 0x9):                # shifts, rotates
+        return shift(op, v)
+    if low == 0xA:                                      # DEC
+        return [f'_v = {v}', 'V = _v == 0x80', '_r = (_v - 1) & 0xFF'] \
+            + nz('_r')
+    if low == 0xC:                                      # INC
+        return [f'_v = {v}', 'V = _v == 0x7F', '_r = (_v + 1) & 0xFF'] \
+            + nz('_r')
+    return None
+
+def push(v):
+    ' Lines for `opimpl.pushbyte()`. '
+    return [f'WR(sp, {v})', 'sp = (sp - 1) & 0xFFFF']
+
+def pushword(v):
+    ' Lines for `opimpl.pushword()`. '
+    return push(f'{v} & 0xFF') + push(f'{v} >> 8')
+
+def pop(dst):
+    ' Lines for `opimpl.popbyte()` into `dst`. '
+    return ['sp = (sp + 1) & 0xFFFF', f'{dst} = RD(sp)']
+
+class MC6800Translator(Translator):
+
+    registers = ('a', 'b', 'x', 'sp', 'H', 'I', 'N', 'Z', 'V', 'C')
+
+    def translate(self, mem, pc):
+        op = mem[pc]
+        mnemonic = OPCODES.get(op, (None, None))[0]
+        if mnemonic is None or pc + 3 > len(mem):
+            return None
+        n = mem[pc+1]
+        nn = (mem[pc+1] << 8) | mem[pc+2]
+        next1, next2, next3 = pc + 1, pc + 2, (pc + 3) & 0xFFFF
+
+        #   Inherent (no operand)
+        if op < 0x20 or 0x30 <= op < 0x60:
+            lines = self.inherent(op)
+            if lines is None:
+                return None
+            if op == 0x39:                                  # RTS
+                return Insn(1, lines, transfer=True)
+            return Insn(1, lines)
+
+        #   Relative branches and BSR
+        if 0x20 <= op < 0x30 or op == 0x8D:
+            target = (next2 + n - (0x100 if n & 0x80 else 0)) & 0xFFFF
+            if op == 0x8D:                                  # BSR
+                return Insn(2, pushword(str(next2)) + [f'npc = {target}'],
+                    True, (target,))
+            cond = BRANCH[op]
+            if cond == 'True':                              # BRA
+                return Insn(2, [f'npc = {target}'], True, (target,))
+            return Insn(2, [f'npc = {target} if {cond} else {next2}'],
+                True, (target, next2))
+
+        #   Operand addressing: `ea` is the effective address expression
+        #   and `ea1` that of the following byte.
+        mode = mnemonic[-1]
+        if op in (0x8C, 0x8E, 0xCE, 0x7E, 0xBD):  # 16-bit immediate, JMP/JSR
+            mode, length, pre = '#16', 3, []
+        elif mode == 'x':
+            length, ea = 2, '_ea'
+            pre = [f'_ea = (x + {n}) & 0xFFFF']
+            ea1, pre1 = '_ea1', ['_ea1 = (_ea + 1) & 0xFFFF']
+        elif mode == 'z':
+            length, ea, pre = 2, str(n), []
+            ea1, pre1 = str((n + 1) & 0xFFFF), []
+        elif mode == 'm':
+            length, ea, pre = 3, str(nn), []
+            ea1, pre1 = str((nn + 1) & 0xFFFF), []
+        else:
+            mode, length, pre = '#', 2, []
+        next = (pc + length) & 0xFFFF
+
+        #   Jumps
+        if op == 0x7E:                                      # JMP
+            return Insn(3, [f'npc = {nn}'], True, (nn,))
+        if op == 0x6E:                                      # JMPx
+            return Insn(2, pre + ['npc = _ea'], transfer=True)
+        if op == 0xBD:                                      # JSR
+            return Insn(3, pushword(str(next)) + [f'npc = {nn}'], True, (nn,))
+        if op == 0xAD:                                      # JSRx
+            return Insn(2, pre + pushword(str(next)) + ['npc = _ea'],
+                transfer=True)
+
+        #   16-bit loads, stores and compares
+        if op in (0x8E, 0xCE):                              # LDS/LDX #
+            r = 'sp' if op == 0x8E else 'x'
+            return Insn(3, [f'{r} = {nn}', 'V = False',
+                f'N = {bool(nn & 0x8000)}', f'Z = {nn == 0}'])
+        if op == 0x8C:                                      # CPX #
+            return Insn(3, self.cpx(str(nn >> 8), str(nn & 0xFF)))
+        low = op & 0xF
+        if op >= 0x90 and low in (0xE, 0xF, 0xC):
+            r = 'sp' if op < 0xC0 else 'x'
+            rd = pre + pre1
+            if low == 0xE:                                  # LDS, LDX
+                return Insn(length, rd + [f'{r} = (RD({ea}) << 8) | RD({ea1})']
+                    + nzv(r, 15))
+            if low == 0xF:                                  # STS, STX
+                return Insn(length, rd + [f'WR({ea}, {r} >> 8)',
+                    f'WR({ea1}, {r} & 0xFF)'] + nz(r, 15) + ['V = 0'])
+            return Insn(length,                             # CPX
+                rd + ['_h = RD({})'.format(ea), '_l = RD({})'.format(ea1)]
+                + self.cpx('_h', '_l'))
+
+        #   Single-operand memory instructions $60-$7F
+        if 0x60 <= op < 0x80:
+            if low == 0xD:                                  # TST
+                return Insn(length, pre + ['C = 0', f'_v = RD({ea})']
+                    + nzv('_v'))
+            if low == 0xF:                                  # CLR
+                return Insn(length, pre + nzv('0') + ['C = 0', f'WR({ea}, 0)'])
+            lines = unary(op, f'RD({ea})')
+            if lines is None:
+                return None
+            return Insn(length, pre + lines + [f'WR({ea}, _r)'])
+
+        #   Two-operand accumulator instructions $80-$FF
+        r = 'a' if op < 0xC0 else 'b'
+        if mode == '#':
+            v = str(n)
+        else:
+            pre = pre + [f'_m = RD({ea})'] if low != 0x7 else pre
+            v = '_m'
+        if low == 0x0:  lines = sub(r, v)                           # SUB
+        elif low == 0x1:  lines = sub(r, v, store=False)            # CMP
+        elif low == 0x2:  lines = sub(r, v, ' - C')                 # SBC
+        elif low == 0x4:  lines = [f'{r} = {r} & {v}'] + nzv(r)     # AND
+        elif low == 0x5:  lines = [f'_r = {r} & {v}'] + nzv('_r')   # BIT
+        elif low == 0x6:  lines = [f'{r} = {v}'] + nzv(r)           # LDA
+        elif low == 0x7:  lines = nzv(r) + [f'WR({ea}, {r})']       # STA
+        elif low == 0x8:  lines = [f'{r} = {r} ^ {v}'] + nzv(r)     # EOR
+        elif low == 0x9:  lines = add(r, v, ' + C')                 # ADC
+        elif low == 0xA:  lines = [f'{r} = {r} | {v}'] + nzv(r)     # ORA
+        elif low == 0xB:  lines = add(r, v)                         # ADD
+        else:
+            return None
+        return Insn(length, pre + lines)
+
+    def inherent(self, op):
+        ' Return the lines for inherent-mode instruction `op`, or `None`. '
+        if 0x40 <= op < 0x60:
+            r = 'a' if op < 0x50 else 'b'
+            low = op & 0xF
+            if low == 0xD:                                  # TST
+                return ['C = 0'] + nzv(r)
+            if low == 0xF:                                  # CLR
+                return [f'{r} = 0'] + nzv(r) + ['C = 0']
+            lines = unary(op, r)
+            return None if lines is None else lines + [f'{r} = _r']
+        return {
+            0x01: [],                                               # NOP
+            0x06: [ f'{f} = (a & {1 << i}) != 0'                    # TAP
+                    for i, f in reversed(tuple(enumerate('CVZNIH'))) ],
+            0x07: ['a = 0b11000000 | (H << 5) | (I << 4) | (N << 3)'  # TPA
+                    ' | (Z << 2) | (V << 1) | (C << 0) | 0'],
+            0x08: ['x = (x + 1) & 0xFFFF', 'Z = x == 0'],           # INX
+            0x09: ['x = (x - 1) & 0xFFFF', 'Z = x == 0'],           # DEX
+            0x0A: ['V = 0'],  0x0B: ['V = 1'],                      # CLV SEV
+            0x0C: ['C = 0'],  0x0D: ['C = 1'],                      # CLC SEC
+            0x0E: ['I = 0'],  0x0F: ['I = 1'],                      # CLI SEI
+            0x10: sub('a', 'b'),                                    # SBA
+            0x11: sub('a', 'b', store=False),                       # CBA
+            0x16: ['b = a'] + nzv('b'),                             # TAB
+            0x17: ['a = b'] + nzv('a'),                             # TBA
+            0x1B: add('a', 'b'),                                    # ABA
+            0x30: ['x = (sp + 1) & 0xFFFF'],                        # TSX
+            0x31: ['sp = (sp + 1) & 0xFFFF'],                       # INS
+            0x32: pop('a'),  0x33: pop('b'),                        # PULA/B
+            0x34: ['sp = (sp - 1) & 0xFFFF'],                       # DES
+            0x35: ['sp = (x - 1) & 0xFFFF'],                        # TXS
+            0x36: push('a'),  0x37: push('b'),                      # PSHA/B
+            0x39: pop('_hi') + pop('_lo') + ['npc = (_hi << 8) + _lo'], # RTS
+        }.get(op)                           # RTI, SWI, invalid: interpreter
+
+    def cpx(self, h, l):
+        ''' Lines for `opimpl.cpxarg()` comparing X with bytes `h` and `l`
+            (which must be names or numbers).
+        '''
+        return ['_xh = x >> 8', f'_r = (_xh - {h}) & 0xFF',
+            f'V = ((_xh ^ {h}) & (_xh ^ _r) & 0x80) != 0',
+            'N = (_r & 0x80) != 0', f'Z = (x & 0xFF) == {l} and _r == 0']
@@ -0,0 +1,228 @@
+''' Fast-load cassette tape images for `src/mc68/fastload.a68`.
+
+    The JR-200 and MB-6885 ROM tape routines are slow, so larger programs
+    are loaded with a small bootstrap loader (built around
+    `src/mc68/fastload.a68` and itself saved at the stock speed with
+    ``cmtconv``) that reads the rest of the program in this faster format:
+
+    - Each bit is one full cycle of a square wave, high half first: a 0
+      is a cycle at `HZ` (3000 Hz by default) and a 1 a cycle at half
+      that. The loader times only the low half of each cycle; it
+      processes the previous bit during the high half.
+    - The leader is `LEADER` 0 bits followed by a single 1 (sync) bit.
+    - Blocks of up to `BLOCKSIZE` data bytes follow, each a big-endian
+      address, a length byte, the data and a checksum byte making the sum
+      of all the bytes of the block zero (mod 256). Bytes are sent LSB
+      first. The last block has length zero and the program's entry
+      point as its address.
+    - `TRAILER` 0 bits end the low half of the last bit.
+
+    At 3000 Hz this averages 2000 bits/s. The samples are generated and
+    written to the WAV file as they are needed, so memory use does not
+    depend on the length of the program. Usage from the command line::
+
+        python -m src.generic.fastload [-r RATE] [--hz HZ] FILE.p OUT.wav
+
+    `decode()` reads the half-cycle lengths of a tape (e.g., from
+    `read_wav()`) back to blocks, which is useful for checking recordings.
+'''
+
+from    argparse  import ArgumentParser
+from    itertools  import repeat
+import  sys, wave
+
+__all__ = ['HZ', 'RATE', 'BLOCKSIZE', 'LEADER', 'TRAILER',
+    'checksum', 'block', 'blocks', 'bits', 'halfcycles', 'samples',
+    'write_wav', 'write', 'read_wav', 'decode', 'DecodeError']
+
+HZ          = 3000          # frequency of a 0 bit; a 1 bit is half this
+RATE        = 48000         # default WAV sample rate
+BLOCKSIZE   = 255           # maximum data bytes per block
+LEADER      = 3000          # 0 bits before the sync bit (1 s at 3000 Hz)
+TRAILER     = 16            # 0 bits after the last block
+HIGH, LOW   = 0xE0, 0x20    # 8-bit unsigned PCM sample values
+
+####################################################################
+#   Encoding
+
+def checksum(data):
+    ' The byte that makes the sum of `data` and itself zero (mod 256). '
+    return -sum(data) & 0xFF
+
+def block(addr, data):
+    ' The tape block for `data` (at most 255 bytes) to be loaded at `addr`. '
+    head = bytes((addr >> 8, addr & 0xFF, len(data))) + bytes(data)
+    return head + bytes((checksum(head),))
+
+def blocks(records, entry, blocksize=BLOCKSIZE):
+    ''' Generate the tape blocks for `records`, a sequence of ``(addr,
+        data)`` pairs, followed by the end block for entry point `entry`.
+    '''
+    for addr, data in records:
+        for off in range(0, len(data), blocksize):
+            yield block(addr + off, data[off:off+blocksize])
+    yield block(entry, b'')
+
+def bits(blocks, leader=LEADER, trailer=TRAILER):
+    ' Generate the bits of the tape for `blocks`, with leader and trailer. '
+    yield from repeat(0, leader)
+    yield 1
+    for b in blocks:
+        for byte in b:
+            for i in range(8):
+                yield byte >> i & 1
+    yield from repeat(0, trailer)
+
+def halfcycles(bits, rate=RATE, hz=HZ):
+    ''' Generate the lengths in samples at `rate` of the high and low
+        halves of the cycle for each of `bits`. Fractional samples are
+        carried forward, so the average frequency is exact at any rate.
+    '''
+    half = rate / (2 * hz)
+    t, done = 0.0, 0
+    for bit in bits:
+        for _ in range(2):
+            t += half * (2 if bit else 1)
+            n = round(t) - done
+            done += n
+            yield n
+
+def samples(bits, rate=RATE, hz=HZ, chunksize=0x10000):
+    ''' Generate the 8-bit unsigned PCM samples for `bits` as `bytes`
+        of about `chunksize` samples each.
+    '''
+    levels = (bytes((HIGH,)), bytes((LOW,)))
+    chunk = bytearray()
+    for i, n in enumerate(halfcycles(bits, rate, hz)):
+        chunk += levels[i & 1] * n
+        if len(chunk) >= chunksize:
+            yield bytes(chunk)
+            chunk.clear()
+    if chunk:
+        yield bytes(chunk)
+
+def write_wav(path, chunks, rate=RATE):
+    ''' Write 8-bit mono PCM `chunks` to WAV file `path` as they are
+        generated, returning the total number of samples.
+    '''
+    total = 0
+    with wave.open(str(path), 'wb') as w:
+        w.setnchannels(1)
+        w.setsampwidth(1)
+        w.setframerate(rate)
+        for chunk in chunks:
+            w.writeframesraw(chunk)     # header is updated on close
+            total += len(chunk)
+    return total
+
+def write(path, records, entry, rate=RATE, hz=HZ, leader=LEADER):
+    ''' Write a WAV file `path` of a fast-load tape of `records` (``(addr,
+        data)`` pairs) with entry point `entry`, returning the number
+        of samples written.
+    '''
+    return write_wav(path,
+        samples(bits(blocks(records, entry), leader), rate, hz), rate)
+
+####################################################################
+#   Decoding
+
+class DecodeError(ValueError):
+    ' The tape could not be decoded. '
+
+def read_wav(path):
+    ''' Read WAV file `path`, returning its sample rate and a generator
+        of the lengths in samples of the (alternating) high and low halves
+        of its cycles, starting with the first high half. Only the first
+        channel is used.
+    '''
+    w = wave.open(str(path), 'rb')
+    rate, width, nch = w.getframerate(), w.getsampwidth(), w.getnchannels()
+    def halves():
+        with w:
+            level, n = None, 0
+            while True:
+                frames = w.readframes(0x10000)
+                if not frames:  break
+                for i in range(0, len(frames), width * nch):
+                    if width == 1:
+                        high = frames[i] >= 0x80
+                    else:
+                        high = frames[i+width-1] < 0x80    # signed LSB-first
+                    if level is None:
+                        if not high:  continue      # wait for first high
+                        level = True
+                    if high == level:
+                        n += 1
+                    else:
+                        yield n
+                        level, n = high, 1
+            if n:  yield n
+    return rate, halves()
+
+def decode(halves, rate=RATE, hz=HZ):
+    ''' Decode a tape from the lengths in samples at `rate` of the
+        alternating high and low halves of its cycles, as the loader does
+        (timing only the low halves). Return a list of ``(addr, data)``
+        records (contiguous blocks merged) and the entry point, raising
+        `DecodeError` on a bad checksum or missing data.
+    '''
+    threshold = 1.5 * rate / (2 * hz)
+    halves = iter(halves)
+    tapebits = ( low > threshold for _high, low in zip(halves, halves) )
+    def byte():
+        value = 0
+        for i in range(8):
+            bit = next(tapebits, None)
+            if bit is None:
+                raise DecodeError('tape ends within a block')
+            value |= bit << i
+        return value
+
+    zeros = 0
+    for bit in tapebits:
+        if bit and zeros >= 32:  break
+        zeros = 0 if bit else zeros + 1
+    else:
+        raise DecodeError('no leader found')
+
+    records = []
+    while True:
+        head = [ byte() for _ in range(3) ]
+        addr, length = head[0] << 8 | head[1], head[2]
+        data = bytes( byte() for _ in range(length) )
+        if (sum(head) + sum(data) + byte()) & 0xFF:
+            raise DecodeError(f'bad checksum in block at ${addr:04X}')
+        if length == 0:
+            return [ (a, bytes(d)) for a, d in records ], addr
+        if records and records[-1][0] + len(records[-1][1]) == addr:
+            records[-1][1].extend(data)         # contiguous with last block
+        else:
+            records.append((addr, bytearray(data)))
+
+####################################################################
+#   Command line
+
+def main(argv=None):
+    from binary.tool.asl  import parse_obj_fromfile
+    p = ArgumentParser(description='Write a fast-load tape WAV file'
+        ' from an AS .p file.')
+    p.add_argument('-r', '--rate', type=int, default=RATE,
+        help=f'sample rate (default {RATE})')
+    p.add_argument('--hz', type=int, default=HZ,
+        help=f'frequency of a 0 bit (default {HZ}); must match the loader')
+    p.add_argument('--leader', type=int, default=LEADER,
+        help=f'number of leader bits (default {LEADER})')
+    p.add_argument('pfile')
+    p.add_argument('output')
+    args = p.parse_args(argv)
+
+    image = parse_obj_fromfile(args.pfile)
+    records = sorted( (addr, bytes(data)) for addr, data in image if data )
+    entry = image.entrypoint
+    if entry is None:  entry = records[0][0]
+    n = write(args.output, records, entry, args.rate, args.hz, args.leader)
+    print(f'{args.output}: {sum(len(d) for _, d in records)} bytes,'
+        f' entry ${entry:04X}, {n / args.rate:.1f}s')
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+''' 8bitdev pytest fixtures and hooks.
+
+    These extend or replace the standard `testmc.pytest` fixtures, and
+    are brought into ``conftest.py`` after those with::
+
+        from src.generic.fixtures import *
+'''
+
+import  pytest, re
+from    t8dev  import path
+from    src.generic  import bench, coverage, profiler, rigcache, schedule, \
+                            trace
+from    src.generic.snapshot  import Snapshots
+from    src.generic.substitute  import Substitutes
+
+__all__ = [
+    'm', 'machine_snapshots', 'substitute',
+    'pytest_addoption', 'pytest_configure',
+    'pytest_xdist_make_scheduler', 'pytest_runtest_logreport',
+    'pytest_runtest_makereport',
+    'pytest_sessionfinish', 'pytest_testnodedown', 'pytest_terminal_summary',
+    ]
+
+def pytest_addoption(parser):
+    parser.addoption('--simprofile', metavar='FILE', help='profile'
+        ' simulated code by symbol, reporting in the summary and saving'
+        ' JSON to FILE; see src.generic.profiler')
+    parser.addoption('--simcoverage', metavar='FILE', help='record the'
+        ' source lines executed by simulated code, reporting in the'
+        ' summary and saving JSON to FILE; see src.generic.coverage')
+    parser.addoption('--bench-update', action='store_true', help='save'
+        ' benchmark results as the new baselines; see src.generic.bench')
+    parser.addoption('--rigsched', action='store_true', help='schedule'
+        ' xdist workers by test_rig and recorded test durations; see'
+        ' src.generic.schedule')
+    parser.addoption('--simtrace', metavar='STEPS', type=int, nargs='?',
+        const=0x10000, help='record the last STEPS (default 65536)'
+        ' simulated instructions, dumping them for failed tests under'
+        ' .build/trace/; see src.generic.trace')
+
+def pytest_configure(config):
+    config.addinivalue_line('markers', 'snapshot(setup=True):'
+        ' reset a machine shared by the module to a snapshot instead of'
+        ' creating a new one; see src.generic.snapshot.Snapshots')
+    if config.getoption('simprofile'):
+        profiler.enable()
+    if config.getoption('simcoverage'):
+        coverage.enable()
+    global durations, simtrace
+    simtrace = config.getoption('simtrace')
+    if not hasattr(config, 'workerinput'):
+        durations = schedule.Durations.load(config)
+
+@pytest.fixture
+def m(request):
+    ''' A simulated machine with the object file loaded.
+
+        This is the same as `testmc.pytest.fixtures.m()` except that:
+        - The module's ``test_rig`` is fetched from `rigcache.cache`
+          (assembling it if necessary) rather than read from the ``.p``
+          and ``.map`` files under `path.ptobj()` for every test.
+        - If the module sets ``snapshot_setup``, or the test is marked
+          with ``@pytest.mark.snapshot(setup)``, one machine is shared by
+          all tests in the module and each test gets it reset to the
+          snapshot for that setup. (See `Snapshots` for the values of
+          `setup`; the marker overrides the module setting.) Use this only
+          where tests do not depend on anything other than memory,
+          registers, symbols and I/O bindings being reset.
+    '''
+    marker = request.node.get_closest_marker('snapshot')
+    if marker is not None:
+        setup = marker.args[0] if marker.args else True
+    else:
+        setup = getattr(request.module, 'snapshot_setup', None)
+    if setup:
+        m = request.getfixturevalue('machine_snapshots').machine(setup)
+    else:
+        m = newmachine(request.module)
+    tracer = getattr(m, 'tracer', None)
+    if tracer is not None:  tracer.clear()
+    return m
+
+@pytest.fixture(scope='module')
+def machine_snapshots(request):
+    ' The `Snapshots` of the machine shared by tests in a module. '
+    return Snapshots(lambda: newmachine(request.module))
+
+@pytest.fixture
+def substitute(m):
+    ''' A `Substitutes` for `m`, detached when the test finishes. Bind
+        Python functions to routines with ``substitute.bind(symbol, f)``;
+        see `src.generic.substitute`.
+    '''
+    with Substitutes(m) as subs:
+        yield subs
+
+def newmachine(module):
+    ''' Return a new instance of `module.Machine` with the module's
+        ``object_files`` and ``test_rig`` loaded.
+    '''
+    Machine = getattr(module, 'Machine')
+    m = Machine()
+
+    if hasattr(module, 'object_files'):
+        objfiles = getattr(module, 'object_files')
+        if isinstance(objfiles, str):   # because forgetting the comma is such
+            objfiles = (objfiles,)      # an easy mistake for devs to make
+        for f in objfiles:
+            m.load(path.obj(f), mergestyle='prefnew', setPC=False)
+
+    if hasattr(module, 'test_rig'):
+        relmodpath = path.relproj(module.__file__)
+        image, symtab = rigcache.cache.get(module.test_rig, relmodpath)
+        m.load_memimage(image, setPC=True)
+        m.symtab.merge(symtab, style='prefnew')
+        if coverage.session is not None:
+            coverage.attach(m, coverage.session.hits(relmodpath,
+                rigcache.cache.key(module.test_rig)))
+
+    if profiler.session is not None:
+        profiler.Profiler(m, profiler.session)
+    if simtrace:
+        trace.Tracer(m, simtrace)
+    return m
+
+####################################################################
+#   Tracing
+
+simtrace = None         # ring buffer size if ``--simtrace``
+
+@pytest.hookimpl(hookwrapper=True)
+def pytest_runtest_makereport(item, call):
+    ' With ``--simtrace``, dump the trace of the machine of a failed test. '
+    outcome = yield
+    report = outcome.get_result()
+    tracer = getattr(getattr(item, 'funcargs', {}).get('m'), 'tracer', None)
+    if tracer is None or not report.failed or not tracer.steps:
+        return
+    file = path.build('trace',
+        re.sub(r'[^\w.-]+', '_', item.nodeid) + '.trace')
+    file.parent.mkdir(parents=True, exist_ok=True)
+    tracer.dump(file)
+    report.sections.append(('simtrace',
+        f'last {min(tracer.steps, tracer.size)} of {tracer.steps} steps:'
+        f' python -m src.generic.trace {path.pretty(file)}'))
+
+####################################################################
+#   Scheduling
+
+durations = None        # `schedule.Durations` of this session (controller)
+scheduler = None        # `schedule.RigScheduling` if ``--rigsched``
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_xdist_make_scheduler(config, log):
+    global scheduler
+    if config.getoption('rigsched'):
+        scheduler = schedule.RigScheduling(config, log, durations.times)
+        return scheduler
+
+def pytest_runtest_logreport(report):
+    if durations is not None:
+        durations.record(report)
+
+####################################################################
+#   Session statistics
+#
+#   Under pytest-xdist each worker sends its counts (and simulator profile)
+#   back to the controller in `workeroutput`, and the controller adds them
+#   to its own (empty) counts, so the summary covers the whole session.
+
+def pytest_sessionfinish(session):
+    workeroutput = getattr(session.config, 'workeroutput', None)
+    if workeroutput is not None:
+        workeroutput['rigcache'] = rigcache.cache.stats()
+        if profiler.session is not None:
+            workeroutput['simprofile'] = profiler.session.records()
+        workeroutput['bench'] = bench.results
+        if coverage.session is not None:
+            workeroutput['simcoverage'] = coverage.session.records()
+    elif durations is not None:
+        durations.save(session.config)
+
+@pytest.hookimpl(optionalhook=True)
+def pytest_testnodedown(node, error):
+    stats = getattr(node, 'workeroutput', {}).get('rigcache')
+    if stats:  rigcache.cache.addstats(stats)
+    records = getattr(node, 'workeroutput', {}).get('simprofile')
+    if records and profiler.session is not None:
+        profiler.session.merge(records)
+    bench.merge(getattr(node, 'workeroutput', {}).get('bench', {}))
+    records = getattr(node, 'workeroutput', {}).get('simcoverage')
+    if records and coverage.session is not None:
+        coverage.session.merge(records)
+
+def pytest_terminal_summary(terminalreporter):
+    config = terminalreporter.config
+    if hasattr(config, 'workeroutput'):
+        return                          # the controller reports for us
+    c = rigcache.cache
+    if c.hits or c.misses:
+        terminalreporter.write_line(c.summary())
+    if scheduler is not None and scheduler.estimate is not None:
+        terminalreporter.write_line(scheduler.summary())
+    if profiler.session is not None:
+        path = config.getoption('simprofile')
+        profiler.session.save(path)
+        terminalreporter.write_sep('-', f'simulator profile (saved in {path})')
+        terminalreporter.write_line(profiler.session.report(limit=40))
+    if coverage.session is not None:
+        file = config.getoption('simcoverage')
+        files = coverage.session.lines(rigcache.cache.lineinfo)
+        coverage.session.save(file, files)
+        terminalreporter.write_sep('-',
+            f'simulator code coverage (saved in {file})')
+        terminalreporter.write_line(coverage.session.report(files))
+    if bench.results:
+        if config.getoption('bench_update'):
+            baseline = bench.load_baseline()
+            for routine, cpus in bench.results.items():
+                baseline['routines'].setdefault(routine, {}).update(cpus)
+            bench.save_baseline(baseline)
+            title = f'benchmarks (baselines saved in {bench.BASELINE_FILE})'
+        else:
+            title = 'benchmarks'
+        terminalreporter.write_sep('-', title)
+        terminalreporter.write_line(bench.table(bench.results))
@@ -0,0 +1,514 @@
+''' Differential fuzzing of routines implemented for several CPUs.
+
+    Each `Target` is a routine with a Python reference model and one or
+    more `Port`s: the test rig, machine type and calling convention of an
+    implementation on a particular CPU (or a variant, such as a table-
+    driven version). `fuzz()` generates inputs, runs them through every
+    port and the reference model, and returns a `Disagreement` for each
+    input on which any port's result differs from the reference, with
+    the input first shrunk by `minimize()` to the simplest one that still
+    shows the problem. From the command line::
+
+        python -m src.generic.fuzz [-n CASES] [-j JOBS] [TARGET ...]
+        python -m src.generic.fuzz -i INPUT TARGET  # check one input
+
+    Inputs are half uniformly random and half "edge-biased," chosen from
+    (or adjacent to) values that are likely to reveal bugs: range limits,
+    characters on either side of the digits and letters, powers of two and
+    ten, and so on. A target whose inputs are few enough (e.g., all 256
+    characters for `qdigit`) is instead run exhaustively.
+
+    For throughput, the cases are run in batches spread over a process
+    pool; each worker process loads each port's rig into a machine once
+    and reuses it for all its batches, running batches with `call_many()`
+    or `fastcall()` rather than `GenericMachine.call()`. Batches are
+    generated in the workers from a seed, the target name and the batch
+    number, so a run with the same seed and number of cases always uses
+    the same inputs regardless of the number of workers.
+'''
+
+from    argparse  import ArgumentParser
+from    ast  import literal_eval
+from    binascii  import crc_hqx
+from    collections  import namedtuple
+from    concurrent.futures  import ProcessPoolExecutor
+from    importlib  import import_module
+from    io  import BytesIO
+from    shlex  import quote
+from    time  import perf_counter
+import  random, sys
+
+from    src.generic  import rigcache
+from    src.generic.callmany  import call_many
+from    src.generic.fastexec  import fastcall
+from    src.generic.qdigit  import qdigit_good
+from    src.generic.snapshot  import loadbios
+
+__all__ = ['Target', 'Port', 'Disagreement', 'TARGETS',
+    'edgeints', 'edgebytes', 'shrinkint', 'shrinkbytes',
+    'check', 'minimize', 'fuzz']
+
+BATCHSIZE = 500
+
+####################################################################
+#   Targets
+
+class Port:
+    ''' An implementation of a `Target` routine on CPU `cpu` (the name of
+        the `testmc` module for its `Machine`, e.g. ``'mc6800'``), assembled
+        from `rig`.
+
+        `run(ctx, inputs)` returns the list of results for a list of
+        `inputs`, where `ctx` is the machine or, if `setup` is given, the
+        value `setup(m)` returned when the machine was loaded.
+    '''
+
+    #   Loaded machines in this process, by ``(cpu, rig, setup)``.
+    machines = {}
+
+    def __init__(self, name, cpu, rig, run, setup=None):
+        self.name, self.cpu, self.rig = name, cpu, rig
+        self.run, self.setup = run, setup
+
+    def __repr__(self):
+        return f'Port({self.name!r})'
+
+    def context(self):
+        ' The machine (or `setup()` result) for this port, loading it once. '
+        key = (self.cpu, self.rig, self.setup)
+        ctx = self.machines.get(key)
+        if ctx is None:
+            m = import_module('testmc.' + self.cpu).Machine()
+            image, symtab = rigcache.cache.get(self.rig, 'src/generic/fuzz.py')
+            m.load_memimage(image, setPC=True)
+            m.symtab.merge(symtab, style='prefnew')
+            ctx = m if self.setup is None else self.setup(m)
+            self.machines[key] = ctx
+        return ctx
+
+    def outputs(self, inputs):
+        ''' Return the results of this port for `inputs`. An exception from
+            the code (e.g., a `Timeout`) is given as the result for the
+            input that raised it, as a string.
+        '''
+        ctx = self.context()
+        try:
+            return self.run(ctx, inputs)
+        except Exception as ex:
+            #   The machine may be in any state; start again with a fresh one.
+            self.machines.pop((self.cpu, self.rig, self.setup), None)
+            if len(inputs) == 1:
+                return [f'{type(ex).__name__}: {ex}']
+            return [ self.outputs([x])[0] for x in inputs ]
+
+class Target:
+    ''' A routine to be fuzzed.
+
+        `reference(input)` gives the expected result for an input, to be
+        compared with the `Port.outputs()` of each of `ports`.
+        `generate(r)` returns a random input using `random.Random` `r`.
+        `shrink(input)` yields inputs simpler than `input` (see
+        `minimize()`). If `domain`, a sequence of every possible input,
+        is given, it's used instead of `generate` when it's no larger
+        than the number of cases to be run.
+    '''
+
+    def __init__(self, name, reference, generate, shrink, ports, domain=None):
+        self.name, self.reference, self.ports = name, reference, ports
+        self.generate, self.shrink, self.domain = generate, shrink, domain
+
+    def __repr__(self):
+        return f'Target({self.name!r})'
+
+TARGETS = {}
+
+def target(*args, **kwargs):
+    ' Create a `Target` and add it to `TARGETS`. '
+    t = Target(*args, **kwargs)
+    TARGETS[t.name] = t
+    return t
+
+####################################################################
+#   Input generation and shrinking
+
+def edgeints(edges, bits=16):
+    ''' Return a generator of `bits`-bit ints for `Target`, half uniformly
+        random and half one of `edges` or adjacent to it.
+    '''
+    top = (1 << bits) - 1
+    def generate(r):
+        if r.random() < 0.5:
+            return r.randrange(top + 1)
+        return max(0, min(top, r.choice(edges) + r.choice((-1, 0, 0, 1))))
+    return generate
+
+def edgebytes(alphabet, lengths, maxlen, minlen=0):
+    ''' Return a generator of `bytes` for `Target`. Half have a length
+        from `lengths` and half are uniformly `minlen` to `maxlen` long;
+        each byte is equally likely to be from `alphabet` or random.
+    '''
+    def generate(r):
+        n = r.choice(lengths) if r.random() < 0.5 \
+            else r.randint(minlen, maxlen)
+        return bytes( r.choice(alphabet) if r.random() < 0.5
+            else r.randrange(0x100) for _ in range(n) )
+    return generate
+
+def shrinkint(x):
+    ' Yield the ints simpler (smaller, with fewer bits set) than `x`. '
+    seen = set()
+    for c in (0, x >> 1, x - 1,
+            *( x & ~(1 << i) for i in range(x.bit_length()) if x >> i & 1 )):
+        if 0 <= c < x and c not in seen:
+            seen.add(c)
+            yield c
+
+def shrinkbytes(minlen=0):
+    ''' Return a shrinker for `bytes` of at least `minlen` length, yielding
+        first shorter inputs (with halves, quarters, etc. removed) and then
+        those with a byte replaced by a simpler one (see `shrinkint()`).
+    '''
+    def shrink(b):
+        n = len(b)
+        k = n // 2
+        while k:
+            if n - k >= minlen:
+                for i in range(0, n - k + 1, k):
+                    yield b[:i] + b[i+k:]
+            k //= 2
+        for i, c in enumerate(b):
+            for s in shrinkint(c):
+                yield b[:i] + bytes((s,)) + b[i+1:]
+    return shrink
+
+####################################################################
+#   qdigit
+
+def qdigit_reference(c):
+    ' The value of digit `c`, or `None` on error. '
+    return QDIGIT.get(c)
+
+QDIGIT = dict(qdigit_good())
+
+def qdigit_run(errflag):
+    ''' Return a `Port` ``run`` function for ``qdigit`` with the given
+        error flag, which is set on error and clear on success.
+    '''
+    def run(m, inputs):
+        res = call_many(m, m.symtab.qdigit, { 'a': inputs }, ('a', errflag))
+        return [ None if err else a
+            for a, err in zip(res['a'], res[errflag]) ]
+    return run
+
+QHEX_RIG = {
+    'mos65': '''
+            cpu 6502
+            org $1000
+            include src/mos65/qhex.a65
+''',
+    'mc6800': '''
+            cpu 6800
+            org $1000
+            include src/mc68/qhex.a68
+
+qhex_out    equ $21     ; WORD output of qhex*
+''',
+    'i8080': '''
+            cpu 8080
+            include  src/i8080/std.i80
+            org $1000
+            include src/i8080/qhex.i80
+''',
+}
+
+target('qdigit', qdigit_reference,
+    edgeints([0x00, 0x2F, 0x3A, 0x40, 0x5B, 0x5F, 0x60, 0x7B, 0x7F, 0x80,
+              0xAF, 0xBA, 0xDA, 0xFA, 0xFF], bits=8),
+    shrinkint,
+    [ Port('6502', 'mos65',  QHEX_RIG['mos65'],  qdigit_run('N')),
+      Port('6800', 'mc6800', QHEX_RIG['mc6800'], qdigit_run('N')),
+      Port('8080', 'i8080',  QHEX_RIG['i8080'],  qdigit_run('C')), ],
+    domain=range(0x100))
+
+####################################################################
+#   qhexword
+
+HEXDIGITS = b'0123456789ABCDEFabcdef'
+
+def qhexword_reference(s):
+    ''' The result of parsing a hex word from the start of `s` (which is
+        followed by a $00 terminator): success, the value (0 on failure)
+        and the number of chars consumed.
+    '''
+    n = 0
+    while n < min(4, len(s)) and s[n] in HEXDIGITS:  n += 1
+    return (n > 0, int(s[:n], 16) if n else 0, n)
+
+QHEXWORD_BUF = 0x220
+
+def qhexword_run(m, inputs):
+    S, R = m.symtab, m.Registers
+    outs = []
+    for s in inputs:
+        m.deposit(QHEXWORD_BUF, s + b'\x00')
+        m.depword(S.qhex_out, 0x9999)
+        fastcall(m, S.qhexword, R(x=QHEXWORD_BUF), maxsteps=10000)
+        outs.append((bool(m.Z), m.word(S.qhex_out), m.x - QHEXWORD_BUF))
+    return outs
+
+target('qhexword', qhexword_reference,
+    edgebytes(HEXDIGITS + b'\x00/:@GZ`gz\x7F\x80\xB0\xB9\xC1\xC6\xE1\xE6\xFF',
+        lengths=(0, 1, 3, 4, 5), maxlen=8),
+    shrinkbytes(),
+    [ Port('6800', 'mc6800', QHEX_RIG['mc6800'], qhexword_run), ])
+
+####################################################################
+#   prdec_u16
+
+def prdec_reference(n):
+    return str(n).encode('ASCII')
+
+def prdec_setup(m):
+    ' Connect the BIOS console output to a `BytesIO` kept with `m`. '
+    _, out = loadbios(m, output=BytesIO())
+    return m, out
+
+def prdec_run(regs):
+    ''' Return a `Port` ``run`` function for ``prdec_u16``, where
+        `regs(m, n)` sets up the registers and memory for printing `n`.
+    '''
+    def run(ctx, inputs):
+        m, out = ctx
+        outs = []
+        for n in inputs:
+            out.seek(0)
+            out.truncate()
+            fastcall(m, m.symtab.prdec_u16, regs(m, n), maxsteps=10000)
+            outs.append(out.getvalue())
+        return outs
+    return run
+
+def prdec_regs_6800(m, n):
+    m.depword(0x7000, n)
+    return m.Registers(x=0x7000)
+
+target('prdec_u16', prdec_reference,
+    edgeints([0, 9, 10, 99, 100, 999, 1000, 9999, 10000, 0x7FFF, 0x8000,
+              0xFF, 0x100, 0xFFF, 0x1000, 0xFFFF]),
+    shrinkint,
+    [ Port('6800', 'mc6800', '''
+            cpu 6800
+            include src/mc68/std.a68
+            include testmc/mc6800/tmc/biosdef.a68
+
+            org $1000
+            include src/mc68/pr/dec.a68
+
+_a          equ $30
+_x          equ $32
+''', prdec_run(prdec_regs_6800), prdec_setup),
+      Port('8080', 'i8080', '''
+            cpu  8080
+            include src/i8080/std.i80
+            include testmc/i8080/tmc/biosdef.i80
+
+            org  $400
+            include src/i8080/pr/dec.i80
+            include src/i8080/pr/hex.i80
+''', prdec_run(lambda m, n: m.Registers(hl=n)), prdec_setup), ],
+    domain=range(0x10000))
+
+####################################################################
+#   cksum_crc_16_ccitt
+
+CRC_DATA = 0x1000       # below the code of the table-driven variants
+CRC_SP   = 0xE000       # above the data, below the code
+
+def crc_reference(data):
+    ' The CRC of `data` and the address after it at `CRC_DATA`. '
+    return (crc_hqx(data, 0xFFFF), CRC_DATA + len(data))
+
+def crc_run_6800(m, inputs):
+    S, R = m.symtab, m.Registers
+    outs = []
+    for data in inputs:
+        m.deposit(CRC_DATA, data)
+        m.depword(S.cksum_crc_16_ccitt_start, CRC_DATA)
+        m.depword(S.cksum_crc_16_ccitt_len, len(data))
+        fastcall(m, S.cksum_crc_16_ccitt, R(sp=CRC_SP), maxsteps=1000000)
+        outs.append((m.word(S.cksum_crc_16_ccitt_cksum),
+                     m.word(S.cksum_crc_16_ccitt_start)))
+    return outs
+
+def crc_run_8080(m, inputs):
+    S, R = m.symtab, m.Registers
+    outs = []
+    for data in inputs:
+        m.deposit(CRC_DATA, data)
+        fastcall(m, S.cksum_crc_16_ccitt,
+            R(de=CRC_DATA, bc=len(data), sp=CRC_SP), maxsteps=1000000)
+        outs.append((m.hl, m.de))
+    return outs
+
+def crc_rig(cpu, table):
+    ''' The rig for the bit-at-a-time or, if `table` is true, table-driven
+        variant of the CRC routine on `cpu`.
+    '''
+    src = { 'mc6800': ('6800', 'src/mc68/std.a68',
+                       'src/mc68/checksum/crc_16_ccitt.a68'),
+            'i8080':  ('8080', 'src/i8080/std.i80',
+                       'src/i8080/checksum/crc_16_ccitt.i80'), }
+    cpuname, std, crc = src[cpu]
+    rig = f'''
+            cpu {cpuname}
+            include  {std}
+{"CRC_16_CCITT_TABLE  equ 1" if table else ""}
+            org {"$F000" if table else "$80"}
+            include {crc}
+'''
+    if cpu == 'mc6800':
+        rig += '''
+            org $100
+cksum_crc_16_ccitt_cksum    ds 2
+cksum_crc_16_ccitt_start    ds 2
+cksum_crc_16_ccitt_len      ds 2
+cksum_crc_16_ccitt_tptr     ds 2
+'''
+    return rig
+
+target('crc_16_ccitt', crc_reference,
+    edgebytes(b'\x00\x01\x7F\x80\xFE\xFF\x10\x21',
+        lengths=(1, 2, 0xFF, 0x100, 0x101), maxlen=0x300, minlen=1),
+    shrinkbytes(minlen=1),
+    [ Port('6800', 'mc6800', crc_rig('mc6800', False), crc_run_6800),
+      Port('6800-table', 'mc6800', crc_rig('mc6800', True), crc_run_6800),
+      Port('8080', 'i8080', crc_rig('i8080', False), crc_run_8080),
+      Port('8080-table', 'i8080', crc_rig('i8080', True), crc_run_8080), ])
+
+####################################################################
+#   Fuzzing
+
+class Disagreement(namedtuple('Disagreement',
+        'target input expected actual')):
+    ''' An `input` to `target` (the name) for which the `actual` results
+        of some ports, a `dict` by port name, differ from the `expected`
+        result from the reference model.
+    '''
+
+    def __str__(self):
+        return '\n'.join([
+            f'{self.target}: input {self.input!r}: expected {self.expected!r}',
+            *( f'    {port}: {result!r}'
+                for port, result in self.actual.items() ),
+            f'    reproduce: python -m src.generic.fuzz'
+                f' -i {quote(repr(self.input))} {self.target}', ])
+
+def check(target, inputs):
+    ''' Run `inputs` through every port of `target` and return a list of
+        `Disagreement`s with the reference model, in input order.
+    '''
+    actual = [ (p.name, p.outputs(inputs)) for p in target.ports ]
+    bad = []
+    for i, x in enumerate(inputs):
+        expected = target.reference(x)
+        diff = { name: outs[i]
+            for name, outs in actual if outs[i] != expected }
+        if diff:
+            bad.append(Disagreement(target.name, x, expected, diff))
+    return bad
+
+def minimize(target, d):
+    ''' Given `Disagreement` `d`, return the `Disagreement` for the simplest
+        input to which it can be shrunk, by repeatedly taking the first
+        input from `target.shrink()` on which any port still disagrees.
+    '''
+    while True:
+        for x in target.shrink(d.input):
+            bad = check(target, [x])
+            if bad:
+                d = bad[0]
+                break
+        else:
+            return d
+
+def batch(name, seed, start, stop):
+    ''' Run cases `start` to `stop` of target `name`: these are taken from
+        its domain if `seed` is `None`, and otherwise generated using a
+        `random.Random` seeded from `seed`, `name` and `start`.
+    '''
+    t = TARGETS[name]
+    if seed is None:
+        inputs = list(t.domain[start:stop])
+    else:
+        r = random.Random(f'{seed}:{name}:{start}')
+        inputs = [ t.generate(r) for _ in range(stop - start) ]
+    return check(t, inputs)
+
+def fuzz(name, cases, seed=0, jobs=None, batchsize=BATCHSIZE, maxreports=10):
+    ''' Run `cases` inputs through target `name` using `jobs` worker
+        processes (default: one per CPU; 1 runs in this process) and return
+        the number of inputs run and a list of minimized `Disagreement`s
+        (at most `maxreports`, each for a different minimized input).
+    '''
+    t = TARGETS[name]
+    if t.domain is not None and len(t.domain) <= cases:
+        seed, cases = None, len(t.domain)
+    starts = range(0, cases, batchsize)
+    args = ( [name] * len(starts), [seed] * len(starts), starts,
+             [ min(s + batchsize, cases) for s in starts ] )
+    if jobs == 1:
+        results = map(batch, *args)
+    else:
+        pool = ProcessPoolExecutor(jobs)
+        results = pool.map(batch, *args)
+
+    found = {}
+    try:
+        for bad in results:
+            for d in bad:
+                d = minimize(t, d)
+                found.setdefault(repr(d.input), d)
+                if len(found) >= maxreports:  break
+            if len(found) >= maxreports:  break
+    finally:
+        if jobs != 1:  pool.shutdown(cancel_futures=True)
+    return cases, list(found.values())
+
+def main(argv=None):
+    p = ArgumentParser(description='Differential fuzzing of routines'
+        ' implemented for several CPUs against a reference model.')
+    p.add_argument('-n', '--cases', type=int, default=100000,
+        help='number of inputs per target (default: %(default)s)')
+    p.add_argument('-j', '--jobs', type=int,
+        help='number of worker processes (default: one per CPU)')
+    p.add_argument('-s', '--seed', type=int, default=0,
+        help='random seed (default: %(default)s)')
+    p.add_argument('-i', '--input', type=literal_eval,
+        help='check only this input (a Python literal) on one target')
+    p.add_argument('targets', nargs='*', metavar='target',
+        help=f'default: all ({", ".join(TARGETS)})')
+    args = p.parse_args(argv)
+
+    for name in args.targets:
+        if name not in TARGETS:
+            p.error(f'unknown target: {name}')
+    if args.input is not None:
+        if len(args.targets) != 1:
+            p.error('--input requires exactly one target')
+        bad = check(TARGETS[args.targets[0]], [args.input])
+        for d in bad:  print(d)
+        return 1 if bad else 0
+
+    failed = False
+    for name in args.targets or TARGETS:
+        start = perf_counter()
+        n, bad = fuzz(name, args.cases, args.seed, args.jobs)
+        secs = perf_counter() - start
+        print(f'{name}: {n} inputs, {len(bad)} disagreements,'
+            f' {secs:.1f} s ({n / secs:.0f}/s)', flush=True)
+        for d in bad:  print(d)
+        failed = failed or bool(bad)
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
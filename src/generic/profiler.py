@@ -0,0 +1,314 @@
+''' Per-symbol instruction and cycle profiling of simulated code.
+
+    A `Profiler` attached to a machine replaces its `_step()` with one
+    that attributes each instruction executed, and its CPU cycles, to the
+    nearest symbol at or below the program counter. Local symbols, e.g.
+    ``prompt.read`` or ``cmd_cksum.exec``, are attributed separately from
+    their parent. For each symbol a `Profile` records:
+
+    - ``calls``: the number of times it was entered by a call instruction
+      (``CALL``/``RST``, ``JSR``/``BSR``) or as the routine called by
+      `GenericMachine.call()` or `call_many()`.
+    - ``insns`` and ``cycles``: the exclusive totals, i.e., those for the
+      instructions within the symbol itself.
+    - ``incl_insns`` and ``incl_cycles``: the inclusive totals for all
+      calls to the symbol, including those of the routines it calls.
+      (Recursive calls are counted once, for the outermost call.)
+
+    Cycle counts come from the simulator where it has them (py65) and
+    otherwise from the instruction timing tables here (8080 states; 6800
+    cycles, which the 6800 simulator does not count itself).
+
+    Any symbol may be taken as the start of a routine, so an ``equ``
+    constant whose value is an address within code will split it.
+
+    To profile a whole test session run ``./Test --simprofile=FILE``; the
+    `m` fixture then attaches a `Profiler` to every machine it creates,
+    and when the session finishes the merged profile (from all
+    pytest-xdist workers) is printed in the terminal summary and saved as
+    JSON in `FILE`. To profile code in a single test::
+
+        with Profiler(m) as p:
+            m.call(S.bi_x10)
+        print(p.profile.report())
+'''
+
+from    itertools  import chain
+import  json
+
+__all__ = ['Profile', 'Profiler', 'session', 'enable']
+
+#   The `Profile` that the `m` fixture attaches to new machines,
+#   or `None` if session profiling is not enabled.
+session = None
+
+def enable():
+    ' Enable session profiling, returning the session `Profile`. '
+    global session
+    if session is None:
+        session = Profile()
+    return session
+
+####################################################################
+#   Instruction timing
+
+#   8080 states for each opcode. Conditional calls and returns
+#   take the second value in `I8080_TAKEN` when the condition is met.
+I8080_CYCLES = [4] * 0x100
+for op in range(0x40, 0x80):    I8080_CYCLES[op] = 5            # MOV r,r
+for op in chain(range(0x46, 0x80, 8), range(0x70, 0x78)):
+                                I8080_CYCLES[op] = 7            # MOV r,M/M,r
+for op in range(0x86, 0xC0, 8): I8080_CYCLES[op] = 7            # ALU M
+for op in range(0x00, 0x40, 8):
+    I8080_CYCLES[op+4] = I8080_CYCLES[op+5] = 5                 # INR, DCR
+    I8080_CYCLES[op+6] = 7                                      # MVI
+for op in range(0x01, 0x40, 0x10):
+    I8080_CYCLES[op] = 10; I8080_CYCLES[op+8] = 10              # LXI, DAD
+    I8080_CYCLES[op+2] = I8080_CYCLES[op+10] = 5                # INX, DCX
+for op in range(0xC0, 0x100, 8):
+    I8080_CYCLES[op]   = 5                                      # Rcc
+    I8080_CYCLES[op+2] = 10                                     # Jcc
+    I8080_CYCLES[op+4] = 11                                     # Ccc
+    I8080_CYCLES[op+6] = 7                                      # ALU #
+    I8080_CYCLES[op+7] = 11                                     # RST
+for op in range(0xC1, 0x100, 0x10):
+    I8080_CYCLES[op] = 10; I8080_CYCLES[op+4] = 11              # POP, PUSH
+I8080_CYCLES[0x76] = 7                                          # HLT
+for op, n in {
+        0x02: 7,  0x12: 7,  0x0A: 7,  0x1A: 7,      # STAX, LDAX
+        0x22: 16, 0x2A: 16, 0x32: 13, 0x3A: 13,     # SHLD, LHLD, STA, LDA
+        0x34: 10, 0x35: 10, 0x36: 10,               # INR M, DCR M, MVI M
+        0xC3: 10, 0xCB: 10,                         # JMP
+        0xC9: 10, 0xD9: 10,                         # RET
+        0xCD: 17, 0xDD: 17, 0xED: 17, 0xFD: 17,     # CALL
+        0xD3: 10, 0xDB: 10,                         # OUT, IN
+        0xE3: 18, 0xE9: 5,  0xF9: 5,  0xEB: 4,      # XTHL, PCHL, SPHL, XCHG
+        }.items():
+    I8080_CYCLES[op] = n
+I8080_TAKEN = list(I8080_CYCLES)
+for op in range(0xC0, 0x100, 8):
+    I8080_TAKEN[op] = 11; I8080_TAKEN[op+4] = 17
+
+#   6800 cycles for each opcode (invalid opcodes are zero).
+MC6800_CYCLES = [0] * 0x100
+for op, n in {
+        0x01: 2, 0x06: 2, 0x07: 2, 0x08: 4, 0x09: 4, 0x0A: 2, 0x0B: 2,
+        0x0C: 2, 0x0D: 2, 0x0E: 2, 0x0F: 2, 0x10: 2, 0x11: 2, 0x16: 2,
+        0x17: 2, 0x19: 2, 0x1B: 2,
+        0x30: 4, 0x31: 4, 0x32: 4, 0x33: 4, 0x34: 4, 0x35: 4, 0x36: 4,
+        0x37: 4, 0x39: 5, 0x3B: 10, 0x3E: 9, 0x3F: 12,
+        }.items():
+    MC6800_CYCLES[op] = n
+for op in range(0x20, 0x30):    MC6800_CYCLES[op] = 4           # Bcc
+for op in range(0x40, 0x60):    MC6800_CYCLES[op] = 2           # accumulator
+for op in range(0x60, 0x70):    MC6800_CYCLES[op] = 7           # indexed
+for op in range(0x70, 0x80):    MC6800_CYCLES[op] = 6           # extended
+for base in (0x80, 0xC0):       # immediate, direct, indexed, extended
+    for mode, n in enumerate((2, 3, 5, 4)):
+        for low in range(0x10):
+            MC6800_CYCLES[base + mode*0x10 + low] = n
+        MC6800_CYCLES[base + mode*0x10 + 0x7] = n + 1           # STA
+        MC6800_CYCLES[base + mode*0x10 + 0xC] = n + 1           # CPX
+        MC6800_CYCLES[base + mode*0x10 + 0xE] = n + 1           # LDS, LDX
+        MC6800_CYCLES[base + mode*0x10 + 0xF] = n + 2           # STS, STX
+MC6800_CYCLES[0x6E] = 4; MC6800_CYCLES[0x7E] = 3                # JMP
+MC6800_CYCLES[0x8D] = 8                                         # BSR
+MC6800_CYCLES[0xAD] = 8; MC6800_CYCLES[0xBD] = 9                # JSR
+
+#   Per CPU (by `Registers.machname`): call and return opcodes,
+#   and cycle tables (`None` for simulators that count cycles).
+CPUS = {
+    'i8080': (
+        frozenset(chain((0xCD, 0xDD, 0xED, 0xFD), range(0xC4, 0x100, 8),
+            range(0xC7, 0x100, 8))),
+        frozenset(chain((0xC9, 0xD9), range(0xC0, 0x100, 8))),
+        I8080_CYCLES, I8080_TAKEN),
+    '6800': (
+        frozenset((0x8D, 0xAD, 0xBD, 0x3F)),
+        frozenset((0x39, 0x3B)),
+        MC6800_CYCLES, MC6800_CYCLES),
+    '6502': (
+        frozenset((0x20, 0x00)),
+        frozenset((0x60, 0x40)),
+        None, None),
+}
+
+####################################################################
+#   Profile data
+
+FIELDS = ('calls', 'insns', 'cycles', 'incl_insns', 'incl_cycles')
+
+class Profile:
+    ''' Profile counts for each symbol, keyed by ``(cpu, symbol)`` where
+        `cpu` is the machine's `Registers.machname`. Each value is a list
+        of the counts in `FIELDS` order.
+    '''
+
+    def __init__(self):
+        self.stats = {}
+
+    def __bool__(self):
+        return bool(self.stats)
+
+    def counts(self, cpu, symbol):
+        ' Return the counts for `symbol` as a `dict`. '
+        return dict(zip(FIELDS, self.stats.get((cpu, symbol), [0]*5)))
+
+    def records(self):
+        ' Return the profile as a list of `dict`s, suitable for JSON. '
+        return [ dict(cpu=cpu, symbol=symbol, **dict(zip(FIELDS, counts)))
+            for (cpu, symbol), counts in sorted(self.stats.items()) ]
+
+    def merge(self, records):
+        ' Add the counts from `records()` of another profile. '
+        for r in records:
+            counts = self.stats.setdefault((r['cpu'], r['symbol']), [0]*5)
+            for i, field in enumerate(FIELDS):
+                counts[i] += r[field]
+
+    def save(self, path):
+        with open(path, 'w') as f:
+            json.dump({ 'version': 1, 'routines': self.records() }, f,
+                indent=1)
+            f.write('\n')
+
+    def report(self, limit=None):
+        ''' Return a text report of the symbols with the greatest exclusive
+            cycle counts for each CPU, up to `limit` symbols per CPU.
+        '''
+        lines = []
+        for cpu in sorted(set(cpu for cpu, _ in self.stats)):
+            rows = sorted(
+                ((sym, c) for (cp, sym), c in self.stats.items() if cp == cpu),
+                key=lambda r: (-r[1][2], r[0]))
+            total = sum(c[2] for _, c in rows) or 1
+            lines.append(f'{cpu:32}   calls      insns     cycles    %'
+                '   incl.insns incl.cycles')
+            for sym, (calls, insns, cycles, iinsns, icycles) \
+                    in rows[:limit]:
+                lines.append(f'  {sym:30} {calls:7} {insns:10} {cycles:10}'
+                    f' {100*cycles/total:4.1f} {iinsns:12} {icycles:11}')
+            if limit is not None and len(rows) > limit:
+                lines.append(f'  ({len(rows) - limit} more)')
+        return '\n'.join(lines)
+
+####################################################################
+#   Profiling a machine
+
+class Profiler:
+    ''' Profile execution on machine `m`, adding the counts to `profile`
+        (default: a new `Profile`).
+
+        The profiler is attached to `m` on creation and may be detached
+        with `detach()`; it may also be used as a context manager, which
+        detaches on exit. The symbols are read from ``m.symtab`` when
+        attached; call `refresh()` if they later change.
+    '''
+
+    def __init__(self, m, profile=None):
+        self.m = m
+        self.cpu = cpu = m.Registers.machname
+        if cpu not in CPUS:
+            raise ValueError(f'No profiling support for CPU {cpu}')
+        self.profile = Profile() if profile is None else profile
+        self.frames = []        # (symbol, sp, insns, cycles) of active calls
+        self.insns = self.cycles = 0
+        self.refresh()
+        self.attach()
+
+    def __enter__(self):    return self
+    def __exit__(self, *exc_info):  self.detach()
+
+    def refresh(self):
+        ''' Build the table of the symbol at or below each address from
+            the integer-valued symbols in ``m.symtab``. Where several
+            symbols have the same value, non-local symbols are preferred
+            over local ones, then the alphabetically first.
+        '''
+        size = len(self.m.get_memory_seq())
+        starts = {}
+        for name, value in self.m.symtab:
+            if not isinstance(value, int) or not 0 <= value < size:
+                continue
+            cur = starts.get(value)
+            if cur is None or ('.' in cur, cur) > ('.' in name, name):
+                starts[value] = name
+        self.symbols = symbols = [None] * size
+        name = '(none)'
+        for addr in range(size):
+            name = starts.get(addr, name)
+            symbols[addr] = name
+
+    def attach(self):
+        m = self.m
+        self._saved = { name: m.__dict__[name]
+            for name in ('_step', 'pushretaddr') if name in m.__dict__ }
+        step = self._step = m._step
+        pushretaddr = self._pushretaddr = m.pushretaddr
+        calls, returns, table, taken = CPUS[self.cpu]
+        getpc, getsp, byte = m._getpc, m._getsp, m.byte
+        mpu = getattr(m, 'mpu', None)
+        stats, symbols, frames = self.profile.stats, self.symbols, self.frames
+        cpu = self.cpu
+
+        def enter(symbol, sp):
+            counts = stats.get((cpu, symbol))
+            if counts is None:
+                counts = stats[(cpu, symbol)] = [0, 0, 0, 0, 0]
+            counts[0] += 1
+            frames.append((symbol, sp, self.insns, self.cycles))
+
+        def profiled_step():
+            pc = getpc(); sp = getsp(); op = byte(pc)
+            if table is None:  c0 = mpu.processorCycles
+            if not frames:  enter(symbols[pc], sp)
+            step()
+            newsp = getsp()
+            if table is None:
+                n = mpu.processorCycles - c0
+            else:
+                n = taken[op] if newsp != sp else table[op]
+            self.insns += 1; self.cycles += n
+            key = (cpu, symbols[pc])
+            counts = stats.get(key)
+            if counts is None:  counts = stats[key] = [0, 0, 0, 0, 0]
+            counts[1] += 1; counts[2] += n
+            if newsp != sp:
+                if op in calls and newsp < sp:
+                    enter(symbols[getpc()], newsp)
+                elif op in returns:
+                    while frames and frames[-1][1] < newsp:
+                        self._leave()
+
+        def profiled_pushretaddr(addr):
+            self.flush()
+            pushretaddr(addr)
+
+        m._step = profiled_step
+        m.pushretaddr = profiled_pushretaddr
+
+    def _leave(self):
+        ' Pop the innermost call frame, adding its inclusive counts. '
+        symbol, _, insns, cycles = self.frames.pop()
+        if any(f[0] == symbol for f in self.frames):
+            return                      # recursive call; outermost counts
+        counts = self.profile.stats[(self.cpu, symbol)]
+        counts[3] += self.insns - insns
+        counts[4] += self.cycles - cycles
+
+    def flush(self):
+        ''' End all active calls. This is done automatically at the start
+            of each `GenericMachine.call()`, as the stack is then reset.
+        '''
+        while self.frames:
+            self._leave()
+
+    def detach(self):
+        ''' Restore the machine's `_step()` and `pushretaddr()` to what they
+            were before this was attached (which may be another profiler).
+        '''
+        self.flush()
+        m = self.m
+        for name in ('_step', 'pushretaddr'):
+            m.__dict__.pop(name, None)
+        m.__dict__.update(self._saved)
@@ -0,0 +1,339 @@
+''' Content-addressed cache of assembled ``test_rig`` code.
+
+    Every test using the `m` fixture needs the object image and symbol
+    table for its module's ``test_rig``. Rather than re-reading (or
+    re-building) these for every test in every pytest-xdist worker, we
+    keep a cache under ``.build/rigcache/`` of the already-parsed results,
+    keyed by a hash of:
+    - the assembler version (from its banner),
+    - the text of the ``test_rig`` itself, and
+    - the path and contents of every file it includes, directly or
+      indirectly, as resolved through the assembler include path.
+
+    Any change to any of these produces a new key, so a cache entry is
+    never stale and never needs to be invalidated. (Old entries may be
+    removed at any time; ``./Test -c`` does so along with the rest of
+    ``.build/``.)
+
+    Entries are written to a temporary file and atomically renamed into
+    place, so any number of processes may read and fill the cache at the
+    same time: a reader sees either no entry or a complete one, and two
+    writers filling the same entry write the same data.
+'''
+
+from    functools  import lru_cache
+from    hashlib  import sha256
+from    pathlib  import Path
+from    tempfile  import mkdtemp, NamedTemporaryFile
+import  os, pickle, re, shutil, subprocess
+
+from    binary.memimage  import MemImage
+from    binary.symtab  import SymTab
+from    binary.tool  import asl
+from    t8dev  import path
+
+__all__ = ['RigCache', 'RigAssemblyError', 'includes', 'include_tree',
+    'asl_version', 'rig_key', 'parse_lineinfo', 'cache']
+
+#   Bump this when the format of the stored entries changes.
+FORMAT = 2
+
+class RigAssemblyError(RuntimeError):
+    ' The assembler failed on a ``test_rig``. '
+
+####################################################################
+#   Dependency scanning
+
+#   `include` and `binclude`, optionally labeled, filename optionally
+#   quoted, ending at whitespace or the start of a comment.
+INCLUDE_RE = re.compile(
+    r'^(?:[A-Za-z_][\w.]*:?)?\s+b?include\s+"?([^"\s;]+)"?',
+    re.IGNORECASE | re.MULTILINE)
+
+def includes(text):
+    ' Return, in order, the filenames of all ``include``s in source `text`. '
+    return [ m.group(1) for m in INCLUDE_RE.finditer(text) ]
+
+def include_path():
+    ''' The directories searched for included files, in the same order
+        that `t8dev.cli.t8dev.asl.runasl()` gives them to the assembler.
+    '''
+    return (path.proj(), path.t8include())
+
+def include_tree(text, searchpath=None):
+    ''' Return a `dict` of the resolved `Path` of every file included,
+        directly or indirectly, by source `text`, keyed by the name used
+        in the ``include`` statement.
+
+        Files are resolved against `searchpath` (default: `include_path()`).
+        A file that cannot be found is entered with value `None` so that
+        it still contributes to the key; the assembler will report the
+        error when it tries to build the rig.
+    '''
+    if searchpath is None:  searchpath = include_path()
+    found = {}
+    pending = includes(text)
+    while pending:
+        name = pending.pop(0)
+        if name in found:  continue
+        for dir in searchpath:
+            p = Path(dir, name)
+            if p.is_file():
+                found[name] = p
+                if p.suffix not in ('.bin', '.dat', '.rom'):
+                    pending += includes(p.read_text(encoding='utf-8'))
+                break
+        else:
+            found[name] = None
+    return found
+
+####################################################################
+#   Assembler and cache keys
+
+def asltool():
+    ''' Return the ``asl`` that `t8dev.run.tool()` would use: the
+        project-local one if available, otherwise the one in $PATH.
+    '''
+    toolbin = path.tool('bin', 'asl')
+    return str(toolbin) if os.access(str(toolbin), os.X_OK) else 'asl'
+
+@lru_cache(maxsize=None)
+def asl_version():
+    ''' Return the banner line giving the version of `asltool()`,
+        or `None` if it can't be run.
+    '''
+    try:
+        proc = subprocess.run((asltool(),),
+            stdin=subprocess.DEVNULL, capture_output=True)
+    except FileNotFoundError:
+        return None
+    for line in proc.stdout.decode('ISO-8859-1').splitlines():
+        if 'assembler' in line.lower():
+            return line.strip()
+    return None
+
+def rig_key(test_rig, searchpath=None, version=None):
+    ''' Return the cache key (a hex SHA-256 digest) for `test_rig`.
+
+        `version` defaults to `asl_version()`.
+    '''
+    if version is None:  version = asl_version()
+    h = sha256()
+    def add(*items):
+        for i in items:
+            if isinstance(i, str):  i = i.encode('utf-8')
+            h.update(len(i).to_bytes(4, 'big'))
+            h.update(i)
+    add(f'rigcache {FORMAT}', str(version), test_rig)
+    for name, p in sorted(include_tree(test_rig, searchpath).items()):
+        add(name, b'' if p is None else p.read_bytes())
+    return h.hexdigest()
+
+def runasl(srcfile, sourcecode, name):
+    ''' Write `sourcecode` to `srcfile` and assemble it there, raising
+        `RigAssemblyError` (with the assembler output) if it fails.
+
+        This uses the same options as `t8dev.cli.t8dev.asl.runasl()`, but
+        does not depend on the ``t8dev`` command-line state, since we may
+        be running under plain ``pytest``.
+    '''
+    with open(srcfile, 'w', newline='\n') as f:
+        f.write('    page 0\n')                         # Disable pagination
+        f.write(sourcecode)
+    toolbin = asltool()
+    opts = ('-codepage', 'utf-8', '-qxx', '-U',
+        '-i', str(path.proj()), '-i', str(path.t8include()))
+    try:
+        proc = subprocess.run(
+            (toolbin, *opts, srcfile.name, '-L', '-s', '-g'),
+            cwd=srcfile.parent, stdin=subprocess.DEVNULL,
+            stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    except FileNotFoundError:
+        raise RigAssemblyError(f'{name}: assembler {toolbin} not found') \
+            from None
+    if proc.returncode != 0:
+        raise RigAssemblyError(f'{name}: assembly FAILED'
+            f' (exit={proc.returncode})\n'
+            + proc.stdout.decode('utf-8', errors='replace'))
+
+def parse_lineinfo(stream, segment='CODE'):
+    ''' Return a list of ``(file, line, addr)`` for each source line that
+        generated code in `segment`, from the ``Segment`` blocks of the
+        AS ``.map`` file open on `stream`. Each block is a ``Segment``
+        line followed by, for each source file, a ``File`` line and lines
+        of ``LINE:ADDR`` (ADDR in hex) entries, and ends at a blank line.
+    '''
+    entries, file, inseg = [], None, False
+    for line in stream:
+        line = line.strip()
+        if not line:
+            inseg = False
+        elif line.startswith('Segment '):
+            inseg = line[len('Segment '):].strip() == segment
+        elif not inseg:
+            pass
+        elif line.startswith('File '):
+            file = line[len('File '):].strip()
+        else:
+            for entry in line.split():
+                n, addr = entry.split(':')
+                entries.append((file, int(n), int(addr, 16)))
+    return entries
+
+def relproj(file):
+    ' `file` made relative to the project directory, if under it. '
+    p = Path(file)
+    if p.is_absolute():
+        try:                p = p.relative_to(path.proj())
+        except ValueError:  pass
+    return str(p)
+
+def rig_offset(name, test_rig):
+    ''' The number of lines before `test_rig` in the file `name` (relative
+        to the project directory) if it appears there verbatim, else 0.
+    '''
+    try:
+        text = path.proj(name).read_text(encoding='utf-8')
+    except (OSError, UnicodeDecodeError, NameError):
+        return 0
+    i = text.find(test_rig)
+    return 0 if i < 0 else text.count('\n', 0, i)
+
+####################################################################
+#   Cache
+
+class RigCache:
+    ''' A cache of assembled test rigs in directory `dir` (default
+        ``.build/rigcache/``). Use `get()` to fetch the `MemImage` and
+        `SymTab` for a ``test_rig``, assembling and caching it if necessary.
+
+        `hits` and `misses` count the results of the `get()` calls made
+        through this object. `lineinfo()` gives the source line of the
+        code at each address, for `src.generic.coverage`.
+    '''
+
+    def __init__(self, dir=None):
+        self._dir = None if dir is None else Path(dir)
+        self.hits = self.misses = 0
+        self._keys = {}             # test_rig text → key, for this process
+        self._loaded = {}           # key → (memimage, symtab)
+        self._lines = {}            # key → [(file, line, addr), ...]
+
+    @property
+    def dir(self):
+        #   Not set in __init__() so that this module can be imported
+        #   without $T8_PROJDIR being set.
+        if self._dir is None:  self._dir = path.build('rigcache')
+        return self._dir
+
+    def key(self, test_rig):
+        key = self._keys.get(test_rig)
+        if key is None:
+            key = self._keys[test_rig] = rig_key(test_rig)
+        return key
+
+    def entry(self, key):
+        ' Return the path of the cache entry for `key`. '
+        return self.dir.joinpath(key[:2], key + '.pickle')
+
+    def get(self, test_rig, name='testrig'):
+        ''' Return ``(memimage, symtab)`` for `test_rig`. On a cache miss
+            this assembles it using `name` (usually the ``.pt`` file's
+            path) as the base name for the generated source.
+        '''
+        key = self.key(test_rig)
+        found = self._loaded.get(key) or self.load(key)
+        if found is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+            image, symtab, *lines = self.assemble(test_rig, name)
+            found = image, symtab
+            self._lines[key] = lines = lines[0] if lines else []
+            self.store(key, image, symtab, lines)
+        self._loaded[key] = found
+        return found
+
+    def lineinfo(self, key):
+        ''' Return the ``(file, line, addr)`` source line information (see
+            `parse_lineinfo()`) for the rig with `key`, or an empty list if
+            it's not in the cache.
+        '''
+        if key not in self._lines:  self.load(key)
+        return self._lines.get(key, [])
+
+    def load(self, key):
+        ' Return the cached ``(memimage, symtab)`` for `key`, or `None`. '
+        try:
+            with open(self.entry(key), 'rb') as f:
+                entry = pickle.load(f)
+        except (FileNotFoundError, EOFError, pickle.UnpicklingError):
+            return None
+        if entry[0] != FORMAT:  return None
+        _, records, entrypoint, symbols, lines = entry
+
+        image = MemImage()
+        for addr, data in records:  image.addrec(addr, data)
+        image.entrypoint = entrypoint
+        self._lines[key] = lines
+        return image, SymTab([ SymTab.Symbol(*s) for s in symbols ])
+
+    def store(self, key, image, symtab, lines=()):
+        ''' Atomically write the cache entry for `key`. The data are stored
+            as plain tuples so that unpickling them does not depend on the
+            details of the `MemImage` and `SymTab` classes.
+        '''
+        entry = self.entry(key)
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        records = [ (addr, bytes(data)) for addr, data in image ]
+        symbols = [ (s.name, s.value, s.section)
+                    for s in symtab.symbols.values() ]
+        with NamedTemporaryFile(dir=entry.parent, prefix=entry.stem + '.',
+                suffix='.tmp', delete=False) as f:
+            pickle.dump((FORMAT, records, image.entrypoint, symbols,
+                list(lines)), f)
+        os.replace(f.name, entry)
+
+    def assemble(self, test_rig, name):
+        ''' Assemble `test_rig` in a private temporary directory (so that
+            concurrent assemblies of the same rig don't collide) and return
+            the parsed ``(memimage, symtab, lines)``.
+
+            In `lines` (see `parse_lineinfo()`), files are relative to the
+            project directory where possible, and lines of the ``test_rig``
+            itself are given as those of file `name` (see `rig_offset()`).
+        '''
+        self.dir.mkdir(parents=True, exist_ok=True)
+        objdir = Path(mkdtemp(dir=self.dir, prefix='asm.'))
+        try:
+            stem = objdir.joinpath(Path(name).stem)
+            runasl(stem.with_suffix('.asm'), test_rig, name)
+            image = asl.parse_obj_fromfile(str(stem) + '.p')
+            symtab = asl.parse_symtab_fromfile(str(stem) + '.map')
+            with open(str(stem) + '.map', encoding='utf-8') as f:
+                lines = parse_lineinfo(f)
+        finally:
+            shutil.rmtree(objdir, ignore_errors=True)
+        offset = rig_offset(name, test_rig) - 1     # runasl() adds a line
+        rigfile = stem.with_suffix('.asm').name
+        return image, symtab, [
+            (str(name), line + offset, addr) if Path(file).name == rigfile
+            else (relproj(file), line, addr)
+            for file, line, addr in lines ]
+
+    ################################################################
+    #   Statistics reporting
+
+    def stats(self):
+        return { 'hits': self.hits, 'misses': self.misses }
+
+    def addstats(self, stats):
+        ' Add in `stats()` from another `RigCache`, e.g., in another worker. '
+        self.hits   += stats.get('hits', 0)
+        self.misses += stats.get('misses', 0)
+
+    def summary(self):
+        return f'rigcache: {self.hits} hits, {self.misses} misses'
+
+#   The cache shared by all tests in this process.
+cache = RigCache()
@@ -0,0 +1,259 @@
+''' Duration-aware scheduling of tests onto pytest-xdist workers.
+
+    Tests that share a ``test_rig`` (i.e., are in the same module) are
+    cheaper to run together on one worker: the rig is loaded, and the
+    module's shared machine (see `src.generic.snapshot`) set up, once per
+    worker rather than once in each of several. With ``--rigsched`` the
+    tests are scheduled as follows:
+
+    - The tests of each module form a group, which is a single work unit
+      unless it's long enough that it would set the finish time, in which
+      case it's split into several contiguous units, each loading the rig.
+    - Units are handed out longest first (LPT scheduling), which keeps
+      the long ones off the end of the run.
+
+    The times are those recorded for each test in previous runs in the
+    pytest cache (``.build/pytest/cache``) under `CACHE_KEY`, updated by
+    every run (with or without ``--rigsched``). The setup phase is
+    recorded separately so that the cost of loading the rig (the setup
+    time beyond the group's minimum) is counted once for each unit.
+    Tests with no recorded time are estimated from the others in their
+    group, or all tests.
+
+    The terminal summary compares the estimated finish time of the
+    schedule with that of ``--dist worksteal`` for the same tests.
+'''
+
+from    collections  import deque
+from    heapq  import heapify, heapreplace
+from    math  import ceil
+from    statistics  import median
+import  time
+
+from    xdist.scheduler  import LoadScopeScheduling
+
+__all__ = ['CACHE_KEY', 'rig_group', 'Durations', 'Costs', 'plan', 'split',
+    'finish_units', 'finish_worksteal', 'RigScheduling']
+
+CACHE_KEY = '8bitdev/durations'
+DEFAULT_DURATION = 0.05     # seconds, when nothing at all is recorded
+
+def rig_group(nodeid):
+    ''' The name of the group of tests sharing a rig with test `nodeid`:
+        its module. (Tests imported from a shared file, such as
+        ``src/tmon/test.py``, run with the rig of the importing module.)
+    '''
+    return nodeid.split('::', 1)[0]
+
+class Durations:
+    ''' Per-test times, ``{ nodeid: [setup, call+teardown] }``, loaded
+        from and saved to the pytest cache.
+    '''
+
+    def __init__(self, recorded=None):
+        self.times = dict(recorded or {})
+        self.new = {}
+
+    @classmethod
+    def load(cls, config):
+        cache = getattr(config, 'cache', None)
+        return cls(cache.get(CACHE_KEY, {}) if cache else {})
+
+    def record(self, report):
+        ' Add the duration of a `TestReport` phase. '
+        t = self.new.setdefault(report.nodeid, [0.0, 0.0])
+        t[report.when != 'setup'] += report.duration
+
+    def save(self, config):
+        ' Save the times, updated with those recorded in this session. '
+        cache = getattr(config, 'cache', None)
+        if cache is None or not self.new:  return
+        self.times.update(self.new)
+        cache.set(CACHE_KEY, { k: [round(s, 4), round(r, 4)]
+            for k, (s, r) in self.times.items() })
+        self.new = {}
+
+class Costs:
+    ''' The estimated cost (in seconds) of each of `nodeids`, and the rig
+        loading cost of each of their groups, from `times`.
+    '''
+
+    def __init__(self, nodeids, times):
+        groups = {}
+        for n in nodeids:
+            groups.setdefault(rig_group(n), []).append(n)
+        known = [ r + s for s, r in times.values() ]
+        default = median(known) if known else DEFAULT_DURATION
+
+        self.groups, self.rigcost, self.cost, self.unknown = groups, {}, {}, 0
+        for g, ids in groups.items():
+            setups = [ times[n][0] for n in ids if n in times ]
+            base = min(setups, default=0)
+            self.rigcost[g] = max(setups, default=0) - base
+            gknown = [ times[n][1] + base for n in ids if n in times ]
+            gdefault = median(gknown) if gknown else default
+            for n in ids:
+                if n in times:
+                    self.cost[n] = times[n][1] + base
+                else:
+                    self.cost[n] = gdefault; self.unknown += 1
+
+    def unit(self, nodeids):
+        ' The cost of running `nodeids`, all of one group, as one unit. '
+        return self.rigcost[rig_group(nodeids[0])] \
+            + sum(self.cost[n] for n in nodeids)
+
+def plan(costs, nworkers):
+    ''' Return a list of ``(name, [nodeid, ...])`` work units for the tests
+        in `costs`, longest first.
+
+        Splitting a group shortens the critical path but adds a rig load,
+        so this tries splitting groups longer than the total divided by
+        each of 1 to twice `nworkers`, and returns the plan with the
+        earliest estimated finish (the least split if several are equal).
+    '''
+    total = sum( costs.unit(ids) for ids in costs.groups.values() )
+    best, bestfinish = None, None
+    for parts in range(1, 2 * max(nworkers, 1) + 1):
+        units = split(costs, total / parts)
+        finish = finish_units(units, costs, nworkers)
+        if best is None or finish < bestfinish - 1e-9:
+            best, bestfinish = units, finish
+    return best
+
+def split(costs, limit):
+    ''' Return the work units for `costs`, longest first, with each group
+        that takes longer than `limit` split into enough contiguous units
+        that each takes about `limit` or less, if possible.
+    '''
+    units = []
+    for g, ids in costs.groups.items():
+        tests = sum( costs.cost[n] for n in ids )
+        room = limit - costs.rigcost[g]
+        k = len(ids) if room <= 0 else ceil(tests / room - 1e-9)
+        k = min(len(ids), max(1, k))
+        if k == 1:
+            units.append((g, ids)); continue
+        share = tests / k
+        chunks, chunk, acc = [], [], 0.0
+        for n in ids:
+            chunk.append(n); acc += costs.cost[n]
+            if acc >= share * (len(chunks) + 1) - 1e-9 \
+                    and len(chunks) < k - 1:
+                chunks.append(chunk); chunk = []
+        if chunk:  chunks.append(chunk)
+        units += [ (f'{g}#{i}', c) for i, c in enumerate(chunks, 1) ]
+    units.sort(key=lambda u: costs.unit(u[1]), reverse=True)
+    return units
+
+def finish_units(units, costs, nworkers):
+    ''' The finish time of `units` (from `plan()`) handed out in order to
+        whichever of `nworkers` is free first.
+    '''
+    workers = [0.0] * max(nworkers, 1)
+    heapify(workers)
+    for _, ids in units:
+        heapreplace(workers, workers[0] + costs.unit(ids))
+    return max(workers)
+
+def finish_worksteal(nodeids, costs, nworkers):
+    ''' The finish time of `nodeids` under xdist's ``worksteal``: each
+        worker starts with an equal contiguous slice of the tests and when
+        idle takes the last half of the largest remaining queue. A worker
+        pays a group's rig cost whenever it moves to that group from
+        another (pytest tears down module-scoped fixtures on leaving it).
+    '''
+    n = max(nworkers, 1)
+    size = len(nodeids)
+    queues = [ deque(nodeids[i*size//n:(i+1)*size//n]) for i in range(n) ]
+    clock, last, done = [0.0] * n, [None] * n, [False] * n
+    while not all(done):
+        w = min( (i for i in range(n) if not done[i]), key=clock.__getitem__ )
+        if not queues[w]:
+            victim = max(range(n), key=lambda i: len(queues[i]))
+            k = len(queues[victim]) // 2
+            if k == 0:
+                done[w] = True; continue
+            stolen = [ queues[victim].pop() for _ in range(k) ]
+            queues[w].extend(reversed(stolen))
+        test = queues[w].popleft()
+        g = rig_group(test)
+        if g != last[w]:
+            clock[w] += costs.rigcost[g]; last[w] = g
+        clock[w] += costs.cost[test]
+    return max(clock)
+
+class RigScheduling(LoadScopeScheduling):
+    ''' An xdist scheduler handing out the work units from `plan()`, in
+        that order, using `Durations` `times`.
+
+        After scheduling, `estimate` is a `dict` with the estimated finish
+        time of this schedule and of ``worksteal``, and the numbers of
+        units, groups and tests with no recorded time.
+    '''
+
+    def __init__(self, config, log=None, times=None):
+        super().__init__(config, log)
+        self.times = times if times is not None \
+            else Durations.load(config).times
+        self.unitof = {}
+        self.estimate = None
+        self.started = None
+
+    def _split_scope(self, nodeid):
+        return self.unitof.get(nodeid) or rig_group(nodeid)
+
+    def schedule(self):
+        assert self.collection_is_completed
+        if self.collection is not None:
+            for node in self.nodes:
+                self._reschedule(node)
+            return
+        if not self._check_nodes_have_same_collection():
+            self.log('**Different tests collected, aborting run**')
+            return
+        self.collection = list(next(iter(self.registered_collections.values())))
+        if not self.collection:
+            return
+
+        nworkers = len(self.nodes)
+        costs = Costs(self.collection, self.times)
+        units = plan(costs, nworkers)
+        for name, ids in units:
+            self.workqueue[name] = dict.fromkeys(ids, False)
+            self.unitof.update(dict.fromkeys(ids, name))
+        self.estimate = {
+            'rigsched':     finish_units(units, costs, nworkers),
+            'worksteal':    finish_worksteal(self.collection, costs, nworkers),
+            'workers':      nworkers,
+            'units':        len(units),
+            'groups':       len(costs.groups),
+            'unknown':      costs.unknown,
+        }
+        self.started = time.monotonic()
+
+        for _ in range(len(self.nodes) - len(self.workqueue)):
+            node, _ = self.assigned_work.popitem()
+            node.shutdown()
+        for node in self.nodes:
+            self._assign_work_unit(node)
+        for node in self.nodes:
+            self._reschedule(node)
+        if not self.workqueue:
+            for node in self.nodes:
+                node.shutdown()
+
+    def summary(self):
+        ' A one-line summary of the schedule and its estimated benefit. '
+        e = self.estimate
+        if e is None:  return None
+        rs, ws = e['rigsched'], e['worksteal']
+        change = f'{(rs - ws) / ws:+.0%}' if ws else 'n/a'
+        line = (f"rigsched: {e['units']} units from {e['groups']} rigs on"
+            f" {e['workers']} workers; estimated finish {rs:.1f}s"
+            f' vs. worksteal {ws:.1f}s ({change})')
+        if self.started is not None:
+            line += f'; actual {time.monotonic() - self.started:.1f}s'
+        if e['unknown']:
+            line += f"; {e['unknown']} tests not yet timed"
+        return line
@@ -0,0 +1,100 @@
+''' Generate hashed string lookup tables for ``src/i8080/shlookup.i80``.
+
+    `source()` returns the assembler source for a table and its index,
+    given the entries as ``(value, string)`` pairs. This can be used
+    directly in a ``test_rig``, or from the command line to write a file
+    to be included in a program::
+
+        python -m src.generic.shlookup LABEL FILE > table.i80
+
+    where each line of `FILE` is a value (``$hex`` or decimal) and a
+    string separated by whitespace.
+
+    The number of buckets is the smallest power of two not less than the
+    number of entries (at most 256), and the hash seed is the one that
+    gives the fewest entries in the largest bucket (and then the fewest
+    comparisons over all entries), so that lookup time stays about the
+    same as the table grows.
+'''
+
+from    argparse  import ArgumentParser
+import  sys
+
+__all__ = ['shash', 'choose', 'source']
+
+def shash(s, seed):
+    ' The `shlookup0` hash of `bytes` `s` with `seed`. '
+    h = seed
+    for c in s:
+        h = (((h << 2 | h >> 6) & 0xFF) + c & 0xFF) ^ seed
+    return h
+
+def choose(strings, nbuckets=None):
+    ''' Return ``(seed, nbuckets)`` for a table of `strings` (`bytes`).
+        `nbuckets`, if given, must be a power of two up to 256.
+    '''
+    if nbuckets is None:
+        nbuckets = 1
+        while nbuckets < min(len(strings), 0x100):
+            nbuckets *= 2
+    if nbuckets & (nbuckets - 1) or not 0 < nbuckets <= 0x100:
+        raise ValueError(f'bad number of buckets: {nbuckets}')
+    def cost(seed):
+        loads = [0] * nbuckets
+        for s in strings:
+            loads[shash(s, seed) & nbuckets - 1] += 1
+        return max(loads), sum( n * (n + 1) for n in loads )
+    return min(range(0x100), key=cost), nbuckets
+
+def source(label, entries, nbuckets=None):
+    ''' Return the assembler source for a `shlookup0` table at `label`
+        of `entries`, ``(value, string)`` pairs where each `string` is
+        `bytes` or `str` of printable ASCII other than ``'`` and ``\\``.
+    '''
+    entries = [ (v, s.encode() if isinstance(s, str) else bytes(s))
+        for v, s in entries ]
+    for _, s in entries:
+        if len(s) > 254 or any( c < 0x20 or c > 0x7E or c in b"'\\"
+                for c in s ):
+            raise ValueError(f'bad string for table: {s!r}')
+    seed, nbuckets = choose([ s for _, s in entries ], nbuckets)
+    buckets = [ [] for _ in range(nbuckets) ]
+    for v, s in entries:
+        buckets[shash(s, seed) & nbuckets - 1].append((v, s))
+
+    names = [ f'.b{i}' if b else '.empty' for i, b in enumerate(buckets) ]
+    lines = [f'{label:<11} db   ${seed:02X}, ${nbuckets - 1:02X}'
+        '     ; hash seed, bucket mask']
+    for i in range(0, nbuckets, 8):
+        lines.append(f'{"":11} dw   ' + ', '.join(names[i:i+8]))
+    for name, bucket in zip(names, buckets):
+        if not bucket:  continue
+        for i, (v, s) in enumerate(bucket):
+            lines.append(f'{name if i == 0 else "":<11} slentry ${v:04X},'
+                f" '{s.decode()}'")
+        lines.append(f'{"":11} slentry_end')
+    if '.empty' in names:
+        lines.append(f'{".empty":<11} slentry_end')
+    return '\n'.join(lines) + '\n'
+
+def main(argv=None):
+    p = ArgumentParser(description='Generate a hashed string lookup table'
+        ' for shlookup.i80.')
+    p.add_argument('-b', '--buckets', type=int,
+        help='number of buckets (power of two; default: number of entries)')
+    p.add_argument('label')
+    p.add_argument('file')
+    args = p.parse_args(argv)
+
+    entries = []
+    with open(args.file) as f:
+        for line in f:
+            fields = line.split(maxsplit=1)
+            if not fields:  continue
+            value, s = fields[0], fields[1].strip() if fields[1:] else ''
+            value = int(value[1:], 16) if value[0] == '$' else int(value, 0)
+            entries.append((value, s))
+    sys.stdout.write(source(args.label, entries, args.buckets))
+
+if __name__ == '__main__':
+    sys.exit(main())
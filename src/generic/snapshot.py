@@ -0,0 +1,124 @@
+''' Machine snapshots for cheap reset of state between tests.
+
+    A `Snapshot` records a machine's memory, registers and other scalar
+    CPU state (e.g., py65's cycle counters), symbol table and I/O function
+    bindings. `Snapshot.restore()` puts the machine back into that state,
+    copying back only the memory pages that differ from the snapshot; a
+    typical test touches only a few of the 256 pages of a 64K machine.
+
+    `Snapshots` holds the snapshots for one machine shared by all the tests
+    in a module. The `m` fixture uses this when the module sets
+    ``snapshot_setup`` or a test is marked with ``pytest.mark.snapshot``,
+    so that loading the test rig and running any setup routine is done
+    once per module instead of once per test. See `src.generic.fixtures`.
+'''
+
+from    numbers  import Integral
+from    t8dev  import path
+
+__all__ = ['Snapshot', 'Snapshots', 'loadbios']
+
+PAGESIZE  = 0x100
+BLOCKSIZE = 0x1000     # first-pass comparison size
+
+class Snapshot:
+    ''' The state of machine `m` at the time of instantiation. '''
+
+    def __init__(self, m):
+        self.mem = bytes(memoryview(m.get_memory_seq()))
+        self.state = [ (o, self._scalars(o)) for o in self._stateobjs(m) ]
+        self.symbols = dict(m.symtab.symbols)
+        self.iofs = dict(getattr(m.get_memory_seq(), 'iofs', {}))
+
+    @staticmethod
+    def _stateobjs(m):
+        ''' The objects holding the CPU state: the machine itself and, if
+            it's a wrapper around another simulator (as `testmc.mos65`
+            wraps py65), the wrapped simulator.
+        '''
+        return (m,) if getattr(m, 'mpu', None) is None else (m, m.mpu)
+
+    @staticmethod
+    def _scalars(o):
+        ' Registers, flags, cycle counters, etc. of `o`. '
+        return { k: v for k, v in vars(o).items()
+                 if isinstance(v, Integral) }   # includes `bool`
+
+    def _diffs(self, mv, start, end, size):
+        ' Yield the `size` chunks of `mv` in `start`…`end` that differ. '
+        snap = self.mem
+        for s in range(start, end, size):
+            if bytes(mv[s:s+size]) != snap[s:s+size]:
+                yield s, s+size
+
+    def restore(self, m):
+        ''' Restore `m` to the state in this snapshot. Returns the number
+            of memory pages that had to be copied back.
+        '''
+        mem = m.get_memory_seq()
+        dirty = 0
+        if mem != self.mem:
+            mv = memoryview(mem)        # bypasses any I/O functions
+            for start, end in self._diffs(mv, 0, len(self.mem), BLOCKSIZE):
+                for start, end in self._diffs(mv, start, end, PAGESIZE):
+                    mv[start:end] = self.mem[start:end]
+                    dirty += 1
+        for o, scalars in self.state:
+            vars(o).update(scalars)
+        m.symtab.symbols = dict(self.symbols)
+        if hasattr(mem, 'iofs'):
+            mem.iofs.clear(); mem.iofs.update(self.iofs)
+        return dirty
+
+class Snapshots:
+    ''' A machine created by `newmachine()` and snapshots of it after
+        various setups. `machine(setup)` returns that machine reset to
+        the snapshot for `setup`, which is one of:
+        - `True`: the state as returned by `newmachine()`.
+        - A `str` naming a routine to be called with the BIOS loaded; if
+          there is also a ``NAME.end`` symbol, execution stops there
+          instead. (This handles routines such as tmon's ``init`` that
+          continue on to other code rather than returning.)
+
+        A snapshot is taken the first time a setup is requested; later
+        requests simply restore it.
+    '''
+
+    def __init__(self, newmachine):
+        self.newmachine = newmachine
+        self.m = None
+        self.taken = {}
+
+    def machine(self, setup=True):
+        snap = self.taken.get(setup)
+        if snap is not None:
+            snap.restore(self.m)
+            return self.m
+
+        if self.m is None:
+            self.m = self.newmachine()
+            self.taken[True] = Snapshot(self.m)
+        else:
+            self.taken[True].restore(self.m)
+        if setup is not True:
+            self.run_setup(setup)
+            self.taken[setup] = Snapshot(self.m)
+        return self.m
+
+    def run_setup(self, name):
+        m = self.m; S = m.symtab
+        iofs = dict(m.get_memory_seq().iofs)
+        loadbios(m)
+        end = S.symbols.get(name + '.end')
+        m.call(S[name], stopat=[] if end is None else [end.value])
+        #   Drop the setup's I/O streams so that tests can set their own.
+        mem = m.get_memory_seq()
+        mem.iofs.clear(); mem.iofs.update(iofs)
+
+def loadbios(m, input=None, output=None):
+    ''' Load the unit test BIOS into `m` and connect its console to the
+        given streams, as the `loadbios` fixture does.
+    '''
+    bioscode = path.obj('testmc/', m.biosname(), 'tmc/bioscode.p')
+    m.load(bioscode, mergestyle='prefcur', setPC=False)
+    return m.setiostreams(m.symtab.charinport, input, output)
@@ -0,0 +1,173 @@
+''' Substitution of Python functions for simulated routines.
+
+    Tests often stub out routines they do not care about by depositing a
+    return instruction at their entry point, e.g. ``m.deposit(S.prchar,
+    I.RET)``. `Substitutes` generalises this: a Python function bound to
+    a routine's address is run in place of the routine whenever execution
+    reaches that address, and the machine then returns to the caller as
+    if the routine had executed a return instruction. The function is
+    given the machine, so it can read and change registers and memory::
+
+        def prhex(m):
+            for c in b'%02X' % m.regs.a:  prchar_byte(m, c)
+
+        with Substitutes(m) as subs:
+            subs.bind('prchar', prchar)         # BIOS output from Python
+            subs.bind('prhex', prhex)
+            subs.bind('errbeep')                # no-op, like depositing RET
+            m.call(S.Cexamine)
+
+    A function may return a `Registers` (or a `dict` of register and flag
+    values), whose non-`None` values are set before the return; anything
+    else it returns is ignored. The PC and SP are always those of the
+    return.
+
+    This cuts the number of simulated instructions in output-heavy tests
+    (printing a character through the BIOS is a dozen or so instructions,
+    and a decimal print routine several hundred) and lets tests check a
+    routine's effect without depending on the routines it calls.
+
+    To check a substitute against the real code, run the real code for
+    some calls with `Substitutes.real()`, or compare both directly with
+    `Substitutes.crosscheck()`.
+
+    The `substitute` fixture (in `src.generic.fixtures`) gives a test a
+    `Substitutes` on its `m` that is detached when the test finishes, as
+    needed when `m` is shared by the tests in a module (`snapshot_setup`).
+    `fastcall()` does not translate code while substitutes are attached.
+'''
+
+from    contextlib  import contextmanager
+from    collections.abc  import Mapping
+from    src.generic.snapshot  import Snapshot
+
+__all__ = ['Substitutes', 'noop', 'prchar', 'prchar_byte']
+
+#   The mask for the stack pointer register of each CPU, by `machname`.
+SPMASK = { 'i8080': 0xFFFF, '6800': 0xFFFF, '6502': 0xFF }
+
+def noop(m):
+    ' A substitute that does nothing but return. '
+
+def prchar_byte(m, byte):
+    ''' Write `byte` to the BIOS console output, as the BIOS ``prchar``
+        does, through whatever stream is bound to ``charoutport``.
+    '''
+    m.get_memory_seq()[m.symtab.charoutport] = byte
+
+def prchar(m):
+    ''' A substitute for the BIOS ``prchar``, printing the character in A.
+        As with the BIOS routine, all registers are preserved.
+    '''
+    prchar_byte(m, m._regsobj().a)
+
+class Substitutes:
+    ''' Python substitutes for routines in machine `m`.
+
+        This replaces `m._step()` when attached (on creation) until
+        `detach()` is called; it may also be used as a context manager,
+        which detaches on exit. Unlike a deposited return instruction,
+        this leaves the code in memory untouched.
+
+        `calls` counts, by address, the times each substitute was run.
+    '''
+
+    def __init__(self, m):
+        self.m = m
+        self.spmask = SPMASK[m.Registers.machname]
+        self.bound = {}         # address ⇒ function
+        self.calls = {}         # address ⇒ count
+        self.attach()
+
+    def __enter__(self):    return self
+    def __exit__(self, *exc_info):  self.detach()
+
+    def attach(self):
+        m = self.m
+        self._saved = m.__dict__.get('_step')
+        step = m._step
+        getpc, bound = m._getpc, self.bound
+        def substituted_step():
+            f = bound.get(getpc())
+            if f is None:   step()
+            else:           self._run(f)
+        m._step = substituted_step
+
+    def detach(self):
+        ' Restore the `_step()` that `m` had before attaching. '
+        m = self.m
+        if self._saved is None:  m.__dict__.pop('_step', None)
+        else:                    m._step = self._saved
+
+    def _addr(self, routine):
+        ' The address of `routine`, a symbol name or address. '
+        if isinstance(routine, str):
+            return self.m.symtab[routine]
+        return routine
+
+    def bind(self, routine, f=noop):
+        ''' Run `f(m)` in place of `routine`, a symbol name or address,
+            returning `f`. `f` defaults to `noop()`.
+        '''
+        addr = self._addr(routine)
+        self.bound[addr] = f
+        self.calls.setdefault(addr, 0)
+        return f
+
+    def unbind(self, routine):
+        ' Run the real code of `routine` again. '
+        self.bound.pop(self._addr(routine), None)
+
+    def count(self, routine):
+        ' The number of times the substitute for `routine` was run. '
+        return self.calls.get(self._addr(routine), 0)
+
+    def _run(self, f):
+        ''' Run substitute `f` for the routine at the current PC and then
+            return from the routine.
+        '''
+        m = self.m
+        pc = m._getpc()
+        self.calls[pc] += 1
+        regs = f(m)
+        if isinstance(regs, Mapping):
+            regs = m.Registers(**regs)
+        if isinstance(regs, m.Registers):
+            m.setregs(regs)
+        retaddr = m.getretaddr()
+        obj = m._regsobj()
+        obj.sp = (m._getsp() + 2) & self.spmask
+        obj.pc = retaddr
+
+    @contextmanager
+    def real(self, *routines):
+        ''' Within the context, run the real code of `routines` (default:
+            all bound routines) rather than their substitutes.
+        '''
+        addrs = [ self._addr(r) for r in routines ] or list(self.bound)
+        saved = { a: self.bound.pop(a) for a in addrs if a in self.bound }
+        try:
+            yield
+        finally:
+            self.bound.update(saved)
+
+    def crosscheck(self, routine, regs=None, **kwargs):
+        ''' Call `routine` with `regs`, first using its substitute and then,
+            from the same starting machine state, its real code. Returns a
+            pair of the `Registers` after each call. `kwargs` are passed
+            on to `m.call()`.
+
+            The machine is left in the state after the real code. Console
+            output is written to the bound streams by both calls.
+        '''
+        m = self.m
+        addr = self._addr(routine)
+        if addr not in self.bound:
+            raise KeyError(f'No substitute bound for {routine!r}')
+        snap = Snapshot(m)
+        m.call(addr, regs, **kwargs)
+        fast = m.regs
+        snap.restore(m)
+        with self.real(addr):
+            m.call(addr, regs, **kwargs)
+        return fast, m.regs
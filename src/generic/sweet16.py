@@ -0,0 +1,292 @@
+''' Tests and benchmarks for the SWEET16 interpreter, ``src/mos65/sweet16.a65``
+
+    These are imported into the ``.pt`` file for each build of the
+    interpreter: the original, and the high-speed build selected by
+    defining ``SWEET16_FAST``. The importing module's ``test_rig`` must
+    come from `rig()`, and it may set `variant` to the name under which
+    the per-opcode cycle counts from `test_cycles_sweet16` are recorded
+    (see `src.generic.bench`); the default is ``sweet16``.
+
+    ``python -m src.generic.sweet16`` prints a table comparing the cycles
+    per opcode of the builds from the committed benchmark baselines.
+'''
+
+from    testmc  import LB, MB
+from    testmc.mos65  import I
+from    src.generic.bench  import Result, check, load_baseline
+from    src.generic.profiler  import Profiler
+import  pytest
+
+def rig(fast=False, org=0xF689):
+    ''' Return a ``test_rig`` for the interpreter at `org` (by default
+        the original listing/Integer BASIC ROM location), using the
+        high-speed build if `fast` is true. SAVE and RESTORE are just
+        an RTS; for unit testing we don't bother to restore the 6502
+        registers after a Sweet 16 call.
+    '''
+    return f'''
+        cpu 6502
+        include "src/mos65/std.a65"
+''' + ('SWEET16_FAST equ 1\n' if fast else '') + f'''
+        org ${org:04X}
+        include "src/mos65/sweet16.a65"
+
+SAVE
+RESTORE rts
+'''
+
+def runSweet16(m, sweet16instrs, startaddr=0x300, dump=False):
+    ''' Run the given list of `sweet16instrs` by placing them after a JMP
+        to the Sweet 16 interpreter, followed by an RTS, and `call()`ing
+        the constructed code.
+
+        The following can be inserted at any line in your Sweet 16 program
+        to return early, for debugging purposes::
+            [ 0x00, I.RTS,        # DEBUG RTN ]
+    '''
+    S = m.symtab
+    m.deposit(startaddr,
+        I.JSR, LB(S.SW16), MB(S.SW16),  # JSR SW16
+        *sweet16instrs,
+        I.RTS,
+        )
+    if dump:
+        l = len(sweet16instrs) + 4
+        print(m.hexdump(startaddr, l))
+    m.call(startaddr)
+
+def test_RTN(m, R, S):
+    ' Just enter and return from the Sweet 16 interpreter. '
+    addr = 0x404                            # start of code to call SW16
+    rtsaddr = addr + 3 + 1                  # JSR SW16, RTN, leaving us at RTS
+    runSweet16(m, [0x00], startaddr=addr)   # Sweet 16 RTN instruction
+    assert m.regs == R(pc=m.CALL_DEFAULT_RETADDR), 'Returned to caller'
+
+def test_Sedgewick(m, R, S):
+    ''' This is the example from the Sedgewick article in Woz Pak II.
+
+        However, it's simplified in that it's not concerned with
+        interacting with Integer BASIC in any way; it simply copies 8 bytes
+        of data from the source to the target. (It would make more sense to
+        do word copies, but the original used bytes, so we do here as well.)
+    '''
+    assert (0x0000,)*16 == m.words(0, 16)       # SW16 registers all clear
+
+    target = 0x1234
+    data = (0xFEDC, 0xBA98, 0x7654, 0x3210)
+    m.depword(0x0800, data)
+    assert (0x0000,)*4 == m.words(target, 4)    # target empty
+
+    runSweet16(m, [
+        0x11, 0x00, 0x08,   # $303  SET R1      source address ($800)
+        0x12, 0x34, 0x12,   # $306  SET R2      destination address ($1234)
+        0x13, 0x08, 0x00,   # $309  SET R3      length (in bytes, 8)
+        0x41,               # $30C  LD  @R1     (move single byte)
+        0x52,               # $30D  ST  @R2
+       #0x00, I.RTS,        # DEBUG RTN
+        0xF3,               # $30E  DCR R3
+        0x07, 0xFB,         # $30F  BNZ $30C
+        0x00,               # $311  RTN
+        ], dump=True)
+
+    print(m.hexdump(0x0800, 8))                 # debug: source
+    print(m.hexdump(target, 8))                 # debug: target
+    print(m.hexdump(0, 16))                     # debug: examine registers
+    assert data == m.words(target, 4)
+
+####################################################################
+#   Individual instructions
+
+DATA = 0x0900       # data area for the register-indirect instructions
+
+def sweet16regs(m):
+    ' Return R0 through R15 and R14H (the prior result register × 2). '
+    return m.words(0, 16), m.byte(0x1D)
+
+@pytest.mark.parametrize('code, regs, expected, r14h', [
+    #   Expected values are R0 and the register used, or their changes.
+    #   For R14 the dispatch sets R14H before the instruction executes.
+    ([0x15, 0x34, 0x12],    {},             {5: 0x1234},            5*2),
+    ([0x25],                {5: 0xABCD},    {0: 0xABCD},            5*2),
+    ([0x35],                {0: 0xABCD},    {5: 0xABCD},            5*2),
+    ([0x45],                {5: DATA},      {0: 0x0042, 5: DATA+1}, 0),
+    ([0x55],                {0: 0x1234, 5: DATA},   {5: DATA+1},    0),
+    ([0x65],                {5: DATA},      {0: 0x9942, 5: DATA+2}, 0),
+    ([0x75],                {0: 0x1234, 5: DATA},   {5: DATA+2},    0),
+    ([0x85],                {5: DATA+2},    {0: 0x0099, 5: DATA+1}, 0),
+    ([0x95],                {0: 0x1234, 5: DATA+1}, {5: DATA},      0),
+    ([0xA5],                {0: 0x8001, 5: 0x8002}, {0: 0x0003},    1),
+    ([0xA5],                {0: 0x1001, 5: 0x2002}, {0: 0x3003},    0),
+    ([0xB5],                {0: 0x3003, 5: 0x2002}, {0: 0x1001},    1),
+    ([0xB5],                {0: 0x1001, 5: 0x2002}, {0: 0xEFFF},    0),
+    ([0xC5],                {5: DATA+2},    {0: 0x9942, 5: DATA},   0),
+    ([0xD5],                {0: 0x3003, 5: 0x1001}, {13: 0x2002},   13*2+1),
+    ([0xD5],                {0: 0x1001, 5: 0x3003}, {13: 0xDFFE},   13*2),
+    ([0xE5],                {5: 0x00FF},    {5: 0x0100},            5*2),
+    ([0xF5],                {5: 0x0100},    {5: 0x00FF},            5*2),
+    ([0xE0],                {0: 0xFFFF},    {0: 0x0000},            0),
+    ([0x2E],                {14: 0x1234},   {0: 0x1C34},            14*2),
+])
+def test_instruction(m, code, regs, expected, r14h):
+    ''' Execute one instruction, then RTN, with registers initialised
+        from `regs` (others zero) and data ``42 99 77`` at `DATA`,
+        checking R0-R13, R14H and the memory stored to.
+    '''
+    m.deposit(DATA, [0x42, 0x99, 0x77, 0x00])
+    m.deposit(0, [0] * 32)
+    for r, v in regs.items():  m.depword(2*r, v)
+    runSweet16(m, code + [0x00])
+    before = [ regs.get(r, 0) for r in range(16) ]
+    after = [ expected.get(r, before[r]) for r in range(14) ]
+    words, r14hval = sweet16regs(m)
+    assert (after, r14h) == (list(words[:14]), r14hval)
+    if code[0] in (0x55, 0x95):             # ST @R5, STP @R5
+        assert 0x34 == m.byte(DATA)
+    if code[0] == 0x75:                     # STD @R5
+        assert (0x34, 0x12) == tuple(m.bytes(DATA, 2))
+
+@pytest.mark.parametrize('branch, taken', [
+    #   (opcode, R14H, R0): expected to branch?
+    ((0x01, 0x00, 0x0000), True),       # BR
+    ((0x02, 0x00, 0x0000), True),       # BNC
+    ((0x02, 0x01, 0x0000), False),
+    ((0x03, 0x01, 0x0000), True),       # BC
+    ((0x03, 0x00, 0x0000), False),
+    ((0x04, 0x00, 0x7FFF), True),       # BP
+    ((0x04, 0x00, 0x8000), False),
+    ((0x05, 0x00, 0x8000), True),       # BM
+    ((0x05, 0x00, 0x7FFF), False),
+    ((0x06, 0x00, 0x0000), True),       # BZ
+    ((0x06, 0x00, 0x0100), False),
+    ((0x07, 0x00, 0x0001), True),       # BNZ
+    ((0x07, 0x00, 0x0000), False),
+    ((0x08, 0x00, 0xFFFF), True),       # BM1
+    ((0x08, 0x00, 0xFFFE), False),
+    ((0x09, 0x00, 0xFF7F), True),       # BNM1
+    ((0x09, 0x00, 0xFFFF), False),
+])
+def test_branch(m, branch, taken):
+    op, r14h, r0 = branch
+    m.deposit(0, [0] * 32)
+    m.depword(0, r0)
+    m.deposit(0x1D, r14h)
+    runSweet16(m, [
+        op, 0x03,           # $303  branch to $308
+        0x15, 0x01, 0x00,   # $305  SET R5 1    (not taken)
+        0x00,               # $308  RTN
+        ])
+    assert (0 if taken else 1) == m.word(2*5)
+
+def test_BS_RS(m):
+    m.deposit(0, [0] * 32)
+    m.depword(2*12, 0x1C00)                     # R12: subroutine stack
+    runSweet16(m, [
+        0x01, 0x04,         # $303  BR $309
+        0x16, 0x02, 0x00,   # $305  SET R6 2    (subroutine)
+        0x0B,               # $308  RS
+        0x0C, 0xFA,         # $309  BS $305
+        0x15, 0x01, 0x00,   # $30B  SET R5 1
+        0x00,               # $30E  RTN
+        ])
+    assert (1, 2, 0x1C00) == (m.word(2*5), m.word(2*6), m.word(2*12))
+    assert 0x030A == m.word(0x1C00)             # return addr was pushed
+
+def test_NUL_and_R15(m):
+    m.deposit(0, [0] * 32)
+    runSweet16(m, [
+        0x0D, 0xFF,         # $303  NUL     (two-byte no-op)
+        0xEF,               # $305  INR R15 (skip next byte)
+        0x00,               # $306
+        0x1F, 0x0B, 0x03,   # $307  SET R15 $30B: continue at $30E
+        0x15, 0x01, 0x00,   # $30A  SET R5 1
+        0x00,               # $30D  RTN
+        0x16, 0x02, 0x00,   # $30E  SET R6 2
+        0x00,               # $311  RTN
+        ])
+    assert (0, 2) == (m.word(2*5), m.word(2*6))
+
+####################################################################
+#   Cycles per opcode
+
+#   For each instruction benchmarked, its name, the registers to set
+#   before executing it (others zero) and its code. Branches have
+#   a displacement of 0, so execution continues with the next
+#   instruction whether or not the branch is taken.
+BENCH = (
+    ('SET',     {},                     [0x15, 0x34, 0x12]),
+    ('LD',      {},                     [0x25]),
+    ('ST',      {},                     [0x35]),
+    ('LD@',     {5: DATA},              [0x45]),
+    ('ST@',     {5: DATA},              [0x55]),
+    ('LDD@',    {5: DATA},              [0x65]),
+    ('STD@',    {5: DATA},              [0x75]),
+    ('POP@',    {5: DATA+2},            [0x85]),
+    ('STP@',    {5: DATA+2},            [0x95]),
+    ('ADD',     {},                     [0xA5]),
+    ('SUB',     {},                     [0xB5]),
+    ('POPD@',   {5: DATA+2},            [0xC5]),
+    ('CPR',     {},                     [0xD5]),
+    ('INR',     {},                     [0xE5]),
+    ('DCR',     {},                     [0xF5]),
+    ('BR',      {},                     [0x01, 0x00]),
+    ('BNC',     {},                     [0x02, 0x00]),
+    ('BNC-not', {14: 0x0100},           [0x02, 0x00]),
+    ('BZ',      {},                     [0x06, 0x00]),
+    ('BZ-not',  {0: 1},                 [0x06, 0x00]),
+    ('BM1',     {0: 0xFFFF},            [0x08, 0x00]),
+    ('BM1-not', {},                     [0x08, 0x00]),
+    ('BS+RS',   {12: 0x1C00},           [0x0C, 0x01, 0x00, 0x0B]),
+    ('NUL',     {},                     [0x0D, 0x00]),
+    ('RTN',     None,                   []),
+)
+
+def cycles(m, code, regs):
+    ' Return the instructions and cycles to run `code`, then RTN. '
+    m.deposit(0, [0] * 32)
+    for r, v in regs.items():  m.depword(2*r, v)
+    with Profiler(m) as p:
+        runSweet16(m, code + [0x00])
+    return p.insns, p.cycles
+
+@pytest.mark.parametrize('name, regs, code', BENCH, ids=[b[0] for b in BENCH])
+def test_cycles_sweet16(request, m, name, regs, code):
+    ''' Record the instructions and cycles taken by each instruction
+        (excluding those of the RTN that follows it), for comparing the
+        builds in the benchmark summary. ``RTN`` is the total for entering
+        the interpreter and returning with RTN, including the JSR.
+    '''
+    variant = getattr(request.module, 'variant', 'sweet16')
+    insns, n = cycles(m, [], {})
+    if regs is not None:
+        insns0, n0 = cycles(m, code, regs)
+        insns, n = insns0 - insns, n0 - n
+    check(request.config, f'{variant}/{name}', m.Registers.machname,
+        Result(1, insns, n, None))
+    print(f'{variant} {name}: {n} cycles')
+
+####################################################################
+#   Reporting
+
+VARIANTS = ('sweet16', 'sweet16_fast')
+
+def table(routines, cpu='6502'):
+    ''' Return a text table of the cycles for each instruction (rows) in
+        each build (columns) from `routines`, ``{ routine: { cpu: result } }``
+        as in the benchmark baseline, with the speedup of the last build
+        over the first.
+    '''
+    lines = [f'{"instr":10}' + ''.join(f'{v:>14}' for v in VARIANTS)
+        + f'{"speedup":>10}']
+    for name, _, _ in BENCH:
+        counts = [ routines.get(f'{v}/{name}', {}).get(cpu, {}).get('cycles')
+            for v in VARIANTS ]
+        if counts == [None] * len(VARIANTS):  continue
+        line = f'{name:10}' + ''.join(
+            f'{"-" if c is None else c:>14}' for c in counts)
+        if None not in (counts[0], counts[-1]):
+            line += f'{counts[0] / counts[-1]:>9.2f}×'
+        lines.append(line)
+    return '\n'.join(lines)
+
+if __name__ == '__main__':
+    print(table(load_baseline()['routines']))
@@ -0,0 +1,289 @@
+''' Binary execution trace ring buffer, and an offline trace viewer.
+
+    ``m.call(..., trace=True)`` prints every instruction as it's executed,
+    which is too slow and verbose for anything but short runs. A `Tracer`
+    attached to a machine instead records each instruction executed into
+    a fixed-size ring buffer of packed binary records (no Python objects
+    are kept per step):
+
+    - the step number, the PC and the three bytes at the PC, and the
+      registers and flags before the instruction is executed;
+    - each memory write (address and value) and the step at which it
+      was made, in a second ring buffer four times the size.
+
+    So after a failure the last `size` instructions of a run of any
+    length (e.g., ten million steps of a CRC or a tmon prompt loop) are
+    available. `Tracer.dump()` saves them, with the machine's symbol
+    table, to a file, which can be viewed with::
+
+        python -m src.generic.trace FILE [-r ROUTINE] [-a START-END] [-n N]
+
+    To trace code in a single test::
+
+        with Tracer(m) as t:
+            m.call(S.cmd_examine_cur)
+            t.dump('examine.trace')
+
+    With ``./Test --simtrace[=STEPS]`` the `m` fixture attaches a `Tracer`
+    to every machine it creates (cleared at the start of each test) and
+    the trace of every failing test is dumped under ``.build/trace/``;
+    the file name is added to the test's report.
+
+    While attached, the tracer replaces `m._step()` and the class of the
+    machine's memory (with a subclass that records writes), and so
+    `fastcall()` falls back to `m.call()`.
+'''
+
+from    argparse  import ArgumentParser
+from    bisect  import bisect_right
+from    operator  import attrgetter
+from    struct  import Struct
+import  json, re, sys
+
+__all__ = ['Tracer', 'Trace', 'MAGIC']
+
+MAGIC = b'8bitdev-trace\0\0\1'     # file format identifier and version
+HEADER = Struct('<16sI')            # MAGIC, length of JSON header
+WRITE = Struct('<QHB')              # step, address, value
+STEPHEAD = '<QH3B'                  # step, PC, 3 bytes at PC
+
+class Tracer:
+    ''' Record the last `size` instructions executed by machine `m`.
+
+        The tracer is attached to `m` on creation and may be detached with
+        `detach()`; it may also be used as a context manager, which detaches
+        on exit. While attached it's also available as ``m.tracer``.
+
+        `steps` is the total number of instructions recorded since
+        creation or the last `clear()`.
+    '''
+
+    def __init__(self, m, size=0x10000):
+        self.m = m
+        self.size = size
+        R = m.Registers
+        self.cpu = R.machname
+        obj = m._regsobj()
+        srname = R()._srname()
+        self.regnames = tuple(r.name for r in R.registers)
+        if srname and hasattr(obj, srname):
+            self.regnames += (srname,)
+            self.regfmt = ''.join( 'H' if r.width > 8 else 'B'
+                for r in R.registers ) + 'B'
+        else:
+            flags = tuple(b.name for b in R.srbits if b.name)
+            self.regnames += flags
+            self.regfmt = ''.join( 'H' if r.width > 8 else 'B'
+                for r in R.registers ) + '?' * len(flags)
+        self.record = Struct(STEPHEAD + self.regfmt)
+        self.steps_buf = bytearray(self.record.size * size)
+        self.writes_buf = bytearray(WRITE.size * size * 4)
+        self.clear()
+        self.attach()
+
+    def __enter__(self):    return self
+    def __exit__(self, *exc_info):  self.detach()
+
+    def clear(self):
+        ' Discard everything recorded so far. '
+        self.steps = 0
+        self.writes = 0
+        self.current = 0        # 1 + number of step executing, or 0
+
+    def attach(self):
+        m = self.m
+        self._saved_step = m.__dict__.get('_step')
+        step = m._step
+        mem = m.get_memory_seq()
+        self._memclass = memclass = type(mem)
+        mv = memoryview(mem)
+        getregs = attrgetter(*self.regnames)
+        getpc, obj = m._getpc, m._regsobj()
+        pack = self.record.pack_into
+        buf, recsize, size = self.steps_buf, self.record.size, self.size
+
+        def traced_step():
+            n = self.steps
+            pc = getpc()
+            pack(buf, (n % size) * recsize, n, pc,
+                mv[pc], mv[(pc+1) & 0xFFFF], mv[(pc+2) & 0xFFFF],
+                *getregs(obj))
+            self.steps = self.current = n + 1
+            try:
+                step()
+            finally:
+                self.current = 0
+
+        wbuf, wsize, wcount = self.writes_buf, WRITE.size, size * 4
+        wpack = WRITE.pack_into
+        setitem = memclass.__setitem__
+
+        def __setitem__(mem, key, value):
+            setitem(mem, key, value)
+            if self.current and isinstance(key, int):
+                #   Only writes made by instructions; not deposits by tests.
+                w = self.writes
+                wpack(wbuf, (w % wcount) * wsize, self.current - 1, key, value)
+                self.writes = w + 1
+
+        mem.__class__ = type('Traced' + memclass.__name__, (memclass,),
+            { '__setitem__': __setitem__ })
+        m._step = traced_step
+        m.tracer = self
+
+    def detach(self):
+        ' Restore `m` as it was before attaching. '
+        m = self.m
+        m.get_memory_seq().__class__ = self._memclass
+        if self._saved_step is None:    m.__dict__.pop('_step', None)
+        else:                           m._step = self._saved_step
+        if m.__dict__.get('tracer') is self:  del m.tracer
+
+    def _ring(self, buf, recsize, capacity, total):
+        ' The records in `buf`, oldest first. '
+        if total <= capacity:
+            return bytes(buf[:total * recsize])
+        split = (total % capacity) * recsize
+        return bytes(buf[split:]) + bytes(buf[:split])
+
+    def dump(self, path):
+        ''' Write the recorded trace, with the machine's symbols, to `path`
+            (a `str` or `Path`) for viewing with `Trace`.
+        '''
+        header = json.dumps({
+            'cpu':      self.cpu,
+            'regs':     self.regnames,
+            'regfmt':   self.regfmt,
+            'steps':    self.steps,
+            'writes':   self.writes,
+            'symbols':  { name: value for name, value in self.m.symtab
+                          if isinstance(value, int) },
+            }).encode()
+        steps = self._ring(self.steps_buf, self.record.size, self.size,
+            self.steps)
+        writes = self._ring(self.writes_buf, WRITE.size, self.size * 4,
+            self.writes)
+        with open(path, 'wb') as f:
+            f.write(HEADER.pack(MAGIC, len(header)))
+            f.write(header)
+            f.write(len(steps).to_bytes(4, 'little'))
+            f.write(steps)
+            f.write(writes)
+        return path
+
+####################################################################
+#   Viewing
+
+class Trace:
+    ''' A trace read from a file written by `Tracer.dump()`.
+
+        `steps` is a list of tuples ``(step, pc, opbytes, regs)`` and
+        `writes` a `dict` of lists of ``(addr, value)`` by step number.
+    '''
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        magic, hlen = HEADER.unpack_from(data)
+        if magic != MAGIC:
+            raise ValueError(f'{path}: not a trace file')
+        off = HEADER.size
+        self.header = h = json.loads(data[off:off+hlen])
+        off += hlen
+        slen = int.from_bytes(data[off:off+4], 'little'); off += 4
+        self.cpu, self.regnames, self.total = h['cpu'], h['regs'], h['steps']
+        self.steps = [ (s[0], s[1], bytes(s[2:5]), s[5:])
+            for s in Struct(STEPHEAD + h['regfmt']).iter_unpack(
+                data[off:off+slen]) ]
+        self.writes = {}
+        for step, addr, value in WRITE.iter_unpack(data[off+slen:]):
+            self.writes.setdefault(step, []).append((addr, value))
+
+        #   Symbol lookup table; prefer non-local, then alphabetically first.
+        starts = {}
+        for name, value in h['symbols'].items():
+            cur = starts.get(value)
+            if cur is None or ('.' in cur, cur) > ('.' in name, name):
+                starts[value] = name
+        self.symaddrs = sorted(starts)
+        self.symnames = [ starts[a] for a in self.symaddrs ]
+        self.symbols = h['symbols']
+
+    def symbolize(self, addr):
+        ''' Return ``symbol+offset`` for the nearest symbol at or below
+            `addr`, or just the hex address if there is none.
+        '''
+        i = bisect_right(self.symaddrs, addr) - 1
+        if i < 0:  return f'${addr:04X}'
+        off = addr - self.symaddrs[i]
+        name = self.symnames[i]
+        return f'{name}+{off}' if off else name
+
+    def routine(self, addr):
+        ' The non-local symbol at or below `addr`, or `None`. '
+        i = bisect_right(self.symaddrs, addr) - 1
+        while i >= 0 and '.' in self.symnames[i]:
+            i -= 1
+        return self.symnames[i] if i >= 0 else None
+
+    def select(self, routine=None, start=None, end=None, last=None):
+        ''' Return the steps executed in `routine` (including its local
+            labels) and within `start` to `end` (inclusive), the last
+            `last` of them if given.
+        '''
+        steps = self.steps
+        if routine is not None:
+            steps = [ s for s in steps if self.routine(s[1]) == routine ]
+        if start is not None:
+            steps = [ s for s in steps if start <= s[1] ]
+        if end is not None:
+            steps = [ s for s in steps if s[1] <= end ]
+        if last is not None:
+            steps = steps[-last:]
+        return steps
+
+    def format(self, s):
+        ' Format step `s` as a line of text. '
+        step, pc, opbytes, values = s
+        regs, flags = [], ''
+        for name, fmt, v in zip(self.regnames, self.header['regfmt'], values):
+            if name == 'pc':    continue
+            elif fmt == '?':    flags += name if v else '-'
+            elif fmt == 'H':    regs.append(f'{name}={v:04X}')
+            else:               regs.append(f'{name}={v:02X}')
+        if flags:  regs.append(flags)
+        line = f'{step:10d} {pc:04X}: {opbytes.hex(" ")}  {" ".join(regs)}' \
+            f'  {self.symbolize(pc)}'
+        ws = self.writes.get(step)
+        if ws:
+            line += '  ' + ' '.join( f'[{a:04X}]={v:02X}' for a, v in ws )
+        return line
+
+def addrrange(s):
+    ' Parse ``START-END`` (hex) as a pair of `int`s. '
+    m = re.fullmatch(r'\$?([0-9A-Fa-f]+)-\$?([0-9A-Fa-f]+)', s)
+    if m is None:
+        raise ValueError(f'bad address range: {s!r}')
+    return int(m[1], 16), int(m[2], 16)
+
+def main(argv=None):
+    p = ArgumentParser(description='View a simulator execution trace.')
+    p.add_argument('-r', '--routine',
+        help='show only steps in ROUTINE (and its local labels)')
+    p.add_argument('-a', '--addrs', type=addrrange, metavar='START-END',
+        help='show only steps with PC in this (hex) range')
+    p.add_argument('-n', '--last', type=int, metavar='N',
+        help='show only the last N (selected) steps')
+    p.add_argument('file')
+    args = p.parse_args(argv)
+
+    t = Trace(args.file)
+    start, end = args.addrs or (None, None)
+    steps = t.select(args.routine, start, end, args.last)
+    print(f'# {t.cpu}: {len(t.steps)} of {t.total} steps recorded,'
+        f' {len(steps)} shown')
+    for s in steps:
+        print(t.format(s))
+
+if __name__ == '__main__':
+    sys.exit(main())
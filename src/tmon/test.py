@@ -1,5 +1,9 @@
 from    random  import randrange
 import  pytest
+
+from    src.generic.console  import StreamInput, StreamOutput
+from    src.generic.profiler  import Profiler
+from    src.tmon.upload  import block_record, block_records, ihex_records
 param = pytest.mark.parametrize
 
 NAK     = b'\x15'   # Ctrl-U
@@ -273,6 +277,30 @@ def test_intelhex_good(m, S, loadbios, command, addr, expected_dep):
         == (m.word(S.vL_calc), m.word(S.vR_calc)) \
         ,  'Record count incremented; success count incremented'
 
+def test_intelhex_stream(m, S, loadbios):
+    ''' Upload a few kilobytes of Intel hex through the prompt loop, with
+        the records fed to tmon as it reads them and each response checked
+        as it's printed.
+    '''
+    addr = 0x4000
+    data = bytes( (i * 29 + (i >> 8)) & 0xFF for i in range(0x800) )
+    records = ihex_records(addr, data)
+    m.deposit(addr, bytes(len(data)))
+    record_count = m.word(S.vL_calc)
+
+    inp, out = loadbios(
+        input=StreamInput(iter(records)),
+        output=StreamOutput(keep=0x100,
+            expect=( b'.' + r + NL for r in records )))
+    out.expect(b'.')                            # final prompt before EOF
+    with pytest.raises(EOFError):
+        m.call(S.prompt, maxsteps=float('inf'))
+
+    assert b'' == out.pending()
+    assert len(records) * 2 + 1 + sum(map(len, records)) == out.total
+    assert data == m.bytes(addr, len(data))
+    assert record_count + len(records) == m.word(S.vL_calc)
+
 IHE = b'\a\n?\n'        # error indicator: beep and '?' on a new line
 IHP = b'.Z'             # prompt and ^Z bad command echoed at `prompt.cmderr`
 IH_ = b'00aaaa01cc'     # good end record (note no ':' prefix)
@@ -315,3 +343,96 @@ def test_intelhex_errors(m, S, loadbios, rcincr, command, expected):
     assert (   record_count+1+rcincr,   success_count+0+rcincr) \
         == (m.word(S.vL_calc), m.word(S.vR_calc)) \
         ,  'Record count incremented; success count not incremented'
+
+#   `L` binary block format: `Lhhh…`, the six-bit encoding (three bytes to
+#   four chars) of:
+#       nn   byte count for data portion
+#       AAAA address (little-endian)
+#       DD…  data bytes, 0-255
+#       CCCC CRC-16-CCITT of all the above (big-endian)
+#   See `src.tmon.upload.encode6()` for the encoding.
+@param('addr, data', [
+    (0xAABB, b''),                              # data len=0
+    (0xAACC, b'\x12'),                          # data len=1
+    (0xCCCC, b'\x87\x65\x43'),                  # data len=3 (one group)
+    (0x4123, bytes(range(0x20, 0x80))),         # bytes with all high bits
+    (0x43FE, bytes(range(0xFF, 0x00, -1))),     # maximum length
+])
+def test_load_block_good(m, S, loadbios, addr, data):
+    sentinel = b'\xEE'
+    m.deposit(addr-1, sentinel*(len(data)+2))
+    expected_dep = sentinel + data + sentinel
+
+    record_count = randrange(60000); m.depword(S.vL_calc, record_count)
+    success_count  = randrange(60000); m.depword(S.vR_calc, success_count)
+
+    command = block_record(addr, data)
+    inp, out = loadbios(input=command)
+    try:
+        m.call(S['prompt.read'], stopat=[S.prompt])
+    except EOFError as ex:  print(f'OVERRUN! {ex}')
+
+    unread, echo, output = log_interaction(command, '\n', inp, out)
+    assert expected_dep == sentinel + m.bytes(addr, len(data)) + sentinel
+    assert b'' == unread, 'unread'
+    assert b'L' + NL == echo, 'echoed command char and added newline'
+    assert (   record_count+1,   success_count+1) \
+        == (m.word(S.vL_calc), m.word(S.vR_calc)) \
+        ,  'Record count incremented; success count incremented'
+
+LB_ = block_record(0x4000, b'\x01\x02\x03\x04')    # 3 groups, L+12 chars
+@param('command', [
+    LB_[:6] + b'\r',                            # CR in block
+    LB_[:6] + b'>' + LB_[7:] + b'\r',            # char below encoding range
+    LB_[:6] + b'\x7F' + LB_[7:] + b'\r',         # char above encoding range
+    LB_[:8] + b'A' + LB_[9:] + b'\r',            # data $03→$02: bad CRC
+    LB_[:-1] + bytes([LB_[-1]^1]) + b'\r',      # bad CRC
+])
+def test_load_block_errors(m, S, loadbios, command):
+    record_count = randrange(60000); m.depword(S.vL_calc, record_count)
+    success_count  = randrange(60000); m.depword(S.vR_calc, success_count)
+
+    command += ZCMD             # bad command if sent back to prompt
+    expected = b'.L' + IHE + IHP
+
+    inp, out = loadbios(input=command)
+    try:
+        m.call(S['prompt'], stopat=[S['prompt.cmderr']])
+    except EOFError as ex:  print(f'OVERRUN! {ex}')
+
+    unread_actual, echo, output = log_interaction(command, expected, inp, out)
+    assert expected == echo
+    assert (   record_count+1,   success_count) \
+        == (m.word(S.vL_calc), m.word(S.vR_calc)) \
+        ,  'Record count incremented; success count not incremented'
+
+def test_load_block_cycles(m, S, loadbios):
+    ''' Compare the simulated cost of loading the same data with `L` blocks
+        and Intel hex records. A serial upload is limited by either the
+        chars to be sent or the CPU time to process them; `L` should need
+        about half the chars and less CPU time per byte.
+    '''
+    data = bytes( (i * 73) & 0xFF for i in range(192) )
+    addr = 0x4000
+
+    def load(records):
+        chars = cycles = 0
+        for record in records:
+            loadbios(input=record)
+            with Profiler(m) as p:
+                m.call(S['prompt.read'], stopat=[S.prompt], maxsteps=1e6)
+            print(f'{p.cycles:7} cycles {len(record):4} chars'
+                f' {record[:24]!r}')
+            chars += len(record); cycles += p.cycles
+        assert data == m.bytes(addr, len(data))
+        m.deposit(addr, bytes(len(data)))
+        return chars, cycles
+
+    hchars, hcycles = load(ihex_records(addr, data))
+    bchars, bcycles = load(block_records(addr, data))
+    print(f'Intel hex: {hchars/len(data):.2f} chars/byte,'
+        f' {hcycles/len(data):.0f} cycles/byte')
+    print(f'  L block: {bchars/len(data):.2f} chars/byte,'
+        f' {bcycles/len(data):.0f} cycles/byte')
+    assert bchars * 1.9 < hchars
+    assert bcycles < hcycles
@@ -0,0 +1,472 @@
+''' Flow-controlled serial upload to tmon and other echoing targets.
+
+    Rather than sending at a fixed worst-case pace (the ``char_delay`` and
+    ``line_delay`` settings in ``conf/t8t.conf``), the uploaders here pace
+    themselves from what the target sends back:
+
+    - `IntelHexUpload` sends Intel hex records to tmon, which echoes each
+      character of a record as it reads it, prints a newline when the
+      record has been deposited and prints `ERROR` (``\\a\\n?\\n``) when it
+      could not parse the record. At most `window` characters are sent
+      ahead of their echo; the window grows after each good record and is
+      halved when a record fails (error, wrong echo or timeout), after
+      which the target is resynchronised and the record is sent again.
+    - `BlockUpload` does the same with tmon's ``L`` binary blocks, which
+      carry three data bytes per four chars and a CRC, but are not echoed;
+      only the final newline or error indicator paces the upload.
+    - `LineUpload` sends lines of text to targets (such as BASIC) that
+      echo lines, waiting for each line's echo and then the newline after
+      the line is entered. Errors are not detected.
+
+    `PtyTarget` connects the console of a simulated machine (or a Python
+    stand-in) to a pseudo-terminal, with a receive FIFO of limited size
+    that drops characters on overrun as a real UART does, so that the
+    uploaders can be tested against tmon itself. Usage from the command
+    line, in the project directory::
+
+        python -m src.tmon.upload [-c CONF] TARGET FILE
+
+    where `TARGET` is a section in `CONF` (default ``conf/t8t.conf``)
+    giving the ``device``, ``baud``, ``send_format``, ``send_prefix``
+    and ``flow`` (``'tmon'`` or ``'echo'``; unpaced if not set).
+'''
+
+from    argparse  import ArgumentParser
+from    binascii  import crc_hqx
+from    collections  import deque
+from    pathlib  import Path
+from    threading  import Condition, Thread
+from    time  import monotonic
+import  codecs, os, select, sys, termios, tty
+
+__all__ = ['Port', 'open_serial', 'UploadError', 'Stats',
+    'IntelHexUpload', 'BlockUpload', 'LineUpload',
+    'ihex_records', 'block_record', 'block_records', 'encode6', 'PtyTarget']
+
+BEL     = 0x07
+NL      = 0x0A
+ERROR   = b'\a\n?\n'            # tmon's error indicator
+
+####################################################################
+#   Serial ports
+
+class Port:
+    ' Unbuffered I/O on file descriptor `fd`, with timeouts on reads. '
+
+    def __init__(self, fd):
+        self.fd = fd
+
+    def write(self, data):
+        view = memoryview(data)
+        while view:
+            n = os.write(self.fd, view)
+            view = view[n:]
+
+    def read(self, timeout):
+        ''' Return whatever data are available, waiting up to `timeout`
+            seconds for some to arrive. Returns ``b''`` on timeout.
+        '''
+        r, _, _ = select.select([self.fd], [], [], timeout)
+        if not r:  return b''
+        try:
+            return os.read(self.fd, 4096)
+        except OSError:                 # pty closed at other end
+            return b''
+
+    def drain(self, quiet):
+        ' Discard input until none has arrived for `quiet` seconds. '
+        while self.read(quiet):  pass
+
+    def close(self):
+        os.close(self.fd)
+
+def open_serial(device, baud=None):
+    ''' Open serial `device` in raw mode at speed `baud` (if given),
+        returning a `Port`.
+    '''
+    fd = os.open(device, os.O_RDWR | os.O_NOCTTY)
+    tty.setraw(fd)
+    if baud is not None:
+        speed = getattr(termios, f'B{baud}', None)
+        if speed is None:
+            os.close(fd)
+            raise ValueError(f'unsupported baud rate: {baud}')
+        attrs = termios.tcgetattr(fd)
+        attrs[4] = attrs[5] = speed             # ispeed, ospeed
+        termios.tcsetattr(fd, termios.TCSANOW, attrs)
+    return Port(fd)
+
+####################################################################
+#   Uploaders
+
+class UploadError(Exception):
+    ' A record could not be sent successfully within the retry limit. '
+
+class Stats:
+    ''' Statistics for an upload: `records` sent, `retries` (records sent
+        again after failing), `bytes` of data, `chars` sent (including
+        retries and resynchronisation), `elapsed` seconds and the `window`
+        at the end of the upload.
+    '''
+
+    def __init__(self):
+        self.records = self.retries = self.bytes = self.chars = 0
+        self.elapsed = 0.0
+        self.window = None
+
+    @property
+    def rate(self):
+        ' Effective data bytes per second. '
+        return self.bytes / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        return (f'{self.records} records, {self.bytes} bytes'
+            f' in {self.elapsed:.2f}s ({self.rate:.0f} bytes/s);'
+            f' {self.retries} retries, {self.chars} chars sent,'
+            f' window {self.window}')
+
+class EchoUpload:
+    ''' Base class for uploaders that send data to `port` with at most
+        `window` characters outstanding before they've been echoed.
+        Characters before the echo of the first one sent are ignored.
+    '''
+
+    def __init__(self, port, *, window=4, maxwindow=64, timeout=1.0):
+        self.port = port
+        self.window = window
+        self.maxwindow = maxwindow
+        self.timeout = timeout
+        self.stats = Stats()
+        self._rx = deque()
+
+    def recv(self):
+        ' Return the next char from the target, or `None` on timeout. '
+        if not self._rx:
+            self._rx.extend(self.port.read(self.timeout))
+            if not self._rx:  return None
+        return self._rx.popleft()
+
+    def send(self, data):
+        ''' Send `data`, returning `True` if it was all echoed correctly,
+            or `False` if something else or nothing (within the timeout)
+            was received instead.
+        '''
+        sent = echoed = 0
+        while echoed < len(data):
+            limit = min(len(data), echoed + self.window)
+            if sent < limit:
+                self.port.write(data[sent:limit])
+                self.stats.chars += limit - sent
+                sent = limit
+            c = self.recv()
+            if c == data[echoed]:
+                echoed += 1
+            elif echoed or c is None:
+                return False
+        return True
+
+    def expect(self, char):
+        ''' Wait for `char`, ignoring anything else except `BEL`, returning
+            `True` if it arrives and `False` on `BEL` or timeout.
+        '''
+        while True:
+            c = self.recv()
+            if c == char:               return True
+            if c is None or c == BEL:   return False
+
+    def upload(self, items):
+        ''' Send each of `items` with `put()`, returning the `Stats`. '''
+        self.stats = stats = Stats()
+        start = monotonic()
+        for item in items:
+            self.put(item)
+            stats.records += 1
+        stats.elapsed = monotonic() - start
+        stats.window = self.window
+        return stats
+
+class IntelHexUpload(EchoUpload):
+    ''' Upload Intel hex records to tmon. A failing record is sent again up
+        to `retries` times before giving up with an `UploadError`; the
+        target is resynchronised before resending by sending CRs and
+        waiting for `settle` seconds of quiet.
+
+        Note that tmon does not (yet) check the record checksum, so a
+        character dropped by the target may deposit bad data before the
+        record fails; resending the record will correct this only if the
+        character was not part of the address.
+    '''
+
+    def __init__(self, port, *, retries=8, settle=0.2, **kwargs):
+        super().__init__(port, **kwargs)
+        self.retries = retries
+        self.settle = settle
+        self._slowstart = True
+
+    def put(self, record):
+        ''' Send one `record` (`bytes` with or without the leading ``:``
+            and trailing newline), paced by tmon's echo.
+        '''
+        line = self.line(record)
+        for attempt in range(self.retries + 1):
+            if attempt:  self.stats.retries += 1
+            if self.sendline(line):
+                self.stats.bytes += self.datalen(line)
+                if self._slowstart:
+                    self.window = min(self.maxwindow, self.window * 2)
+                else:
+                    self.window = min(self.maxwindow, self.window + 1)
+                return
+            self._slowstart = False
+            self.window = max(1, self.window // 2)
+            self.resync()
+        raise UploadError(f'failed after {self.retries} retries: {line!r}')
+
+    def line(self, record):
+        return b':' + record.strip().lstrip(b':')
+
+    def sendline(self, line):
+        return self.send(line) and self.expect(NL)
+
+    def datalen(self, line):
+        return int(line[1:3], 16)
+
+    def resync(self):
+        ''' Return tmon to its prompt. A CR is ignored at the prompt; if
+            tmon is still reading the record the first CR makes it fail,
+            and after failing it discards input up to the next CR.
+        '''
+        self._rx.clear()
+        self.port.write(b'\r\r')
+        self.stats.chars += 2
+        self.port.drain(self.settle)
+
+class BlockUpload(IntelHexUpload):
+    ''' Upload tmon ``L`` binary blocks (from `block_records()`). The
+        command char is paced by its echo; the rest of the block is sent
+        at full speed and then the result awaited.
+    '''
+
+    def line(self, record):
+        record = record.strip()
+        return record if record.startswith(b'L') else b'L' + record
+
+    def sendline(self, line):
+        if not self.send(line[:1]):  return False
+        self.port.write(line[1:])
+        self.stats.chars += len(line) - 1
+        return self.expect(NL)
+
+    def datalen(self, line):
+        return (line[1] - B64BASE & 0x03) << 6 | line[2] - B64BASE
+
+class LineUpload(EchoUpload):
+    ''' Upload lines of text to a target that echoes them, sending each
+        line's characters paced by their echo, then CR and waiting for the
+        newline that follows its echo.
+    '''
+
+    def put(self, line):
+        line = line.rstrip(b'\r\n')
+        if not self.send(line):
+            raise UploadError(f'no echo from target: {line!r}')
+        self.port.write(b'\r')
+        self.stats.chars += 1
+        if not self.expect(NL):
+            raise UploadError(f'no newline from target: {line!r}')
+        self.stats.bytes += len(line) + 1
+
+def ihex_records(addr, data, reclen=16):
+    ''' Return Intel hex records (as `bytes` starting with ``:``) to
+        load `data` at `addr`, followed by an end record.
+    '''
+    def record(addr, rtype, data):
+        rec = bytes([len(data), addr >> 8, addr & 0xFF, rtype]) + data
+        return b':' + (rec + bytes([-sum(rec) & 0xFF])).hex().upper().encode()
+    records = [ record(addr + i, 0, data[i:i+reclen])
+        for i in range(0, len(data), reclen) ]
+    records.append(record(0, 1, b''))
+    return records
+
+B64BASE = ord('?')
+
+def encode6(data):
+    ''' Encode `data` six bits per char as tmon's ``L`` command reads it:
+        each group of up to three bytes is a char with their high two
+        bits (first byte's lowest) followed by a char for each byte's low
+        six bits, all offset by `B64BASE`.
+    '''
+    out = bytearray()
+    for i in range(0, len(data), 3):
+        group = data[i:i+3]
+        out.append(B64BASE
+            + sum( (b >> 6) << 2*j for j, b in enumerate(group) ))
+        out.extend( B64BASE + (b & 0x3F) for b in group )
+    return bytes(out)
+
+def block_record(addr, data):
+    ''' Return a tmon ``L`` binary block record (as `bytes` starting with
+        ``L``) to load `data`, at most 255 bytes, at `addr`.
+    '''
+    block = bytes([len(data), addr & 0xFF, addr >> 8]) + data
+    crc = crc_hqx(block, 0xFFFF)
+    return b'L' + encode6(block + bytes([crc >> 8, crc & 0xFF]))
+
+def block_records(addr, data, blocklen=192):
+    ''' Return `block_record()`s to load `data` at `addr` in blocks of
+        `blocklen` bytes.
+    '''
+    return [ block_record(addr + i, data[i:i+blocklen])
+        for i in range(0, len(data), blocklen) ]
+
+####################################################################
+#   Stand-in target on a pseudo-terminal
+
+class PtyTarget:
+    ''' A pseudo-terminal whose "target" side is connected to a simulated
+        machine's console. Pass this object as both `input` and `output`
+        to ``loadbios()`` (or anything else using `read(1)` and `write()`
+        streams), then `start()` a function that runs the target code.
+        The host side is the `Port` `host`.
+
+        Chars arriving from the host are placed in a receive FIFO of
+        `fifo` chars; any arriving when it's full are dropped and counted
+        in `overruns`. The target's `read()` blocks until a char is
+        available, and raises `EOFError` when the target is closed.
+    '''
+
+    def __init__(self, fifo=16):
+        master, self._slave = os.openpty()
+        tty.setraw(master); tty.setraw(self._slave)
+        self.host = Port(master)
+        self.fifosize = fifo
+        self.overruns = 0
+        self._fifo = deque()
+        self._cond = Condition()
+        self._closed = False
+        self._threads = []
+        self.exception = None
+
+    def start(self, run):
+        ''' Start the receiver and a thread calling `run()` to run the
+            target. `EOFError` from `run()` is expected when the target is
+            closed; any other exception is saved in `exception`.
+        '''
+        for f in (self._receive, lambda: self._run(run)):
+            t = Thread(target=f, daemon=True)
+            t.start()
+            self._threads.append(t)
+        return self
+
+    def _run(self, run):
+        try:
+            run()
+        except EOFError:
+            pass
+        except Exception as ex:
+            self.exception = ex
+
+    def _receive(self):
+        while not self._closed:
+            r, _, _ = select.select([self._slave], [], [], 0.05)
+            if not r:  continue
+            try:
+                data = os.read(self._slave, 256)
+            except OSError:
+                return
+            with self._cond:
+                for c in data:
+                    if len(self._fifo) < self.fifosize:
+                        self._fifo.append(c)
+                    else:
+                        self.overruns += 1
+                self._cond.notify_all()
+
+    def read(self, n=1):
+        with self._cond:
+            while not self._fifo:
+                if self._closed:  raise EOFError('PtyTarget closed')
+                self._cond.wait()
+            return bytes([self._fifo.popleft()])
+
+    def write(self, data):
+        if not self._closed:
+            os.write(self._slave, data)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        for t in self._threads:  t.join(5)
+        os.close(self._slave)
+        self.host.close()
+        if self.exception is not None:
+            raise self.exception
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+####################################################################
+#   Command line
+
+def load_conf(path, target):
+    import tomllib
+    with open(path, 'rb') as f:
+        conf = tomllib.load(f)
+    if target not in conf:
+        raise SystemExit(f'{path}: no target {target!r}')
+    return conf[target]
+
+def main(argv=None):
+    p = ArgumentParser(description='Upload a file to a serial target.')
+    p.add_argument('-c', '--conf', default='conf/t8t.conf')
+    p.add_argument('-a', '--addr', type=lambda s: int(s, 16),
+        help='load address (hex) for a binary FILE')
+    p.add_argument('-b', '--blocks', action='store_true',
+        help="send binary FILE as tmon 'L' blocks")
+    p.add_argument('target')
+    p.add_argument('file', type=Path)
+    args = p.parse_args(argv)
+
+    conf = load_conf(args.conf, args.target)
+    data = args.file.read_bytes()
+    if args.blocks and conf.get('flow') != 'tmon':
+        p.error(f"--blocks requires flow = 'tmon' for {args.target}")
+    if args.blocks or conf.get('send_format') == 'intelhex' \
+            and not data.startswith(b':'):
+        if args.addr is None:
+            p.error('--addr required for binary file')
+        records = block_records if args.blocks else ihex_records
+        items = records(args.addr, data)
+    else:
+        items = [ l for l in data.splitlines() if l.strip() ]
+
+    port = open_serial(conf['device'], conf.get('baud'))
+    try:
+        prefix = codecs.decode(conf.get('send_prefix', ''), 'unicode_escape')
+        port.write(prefix.encode('latin-1').replace(b'\n', b'\r'))
+        flow = conf.get('flow')
+        if flow == 'tmon':
+            up = (BlockUpload if args.blocks else IntelHexUpload)(port)
+        elif flow == 'echo':
+            up = LineUpload(port)
+        elif flow is None:
+            eol = b'\r' if conf.get('send_format') == 'cr' else b'\n'
+            port.write(b''.join( i + eol for i in items ))
+            return
+        else:
+            raise SystemExit(f'{args.conf}: unknown flow {flow!r}')
+        try:
+            print(up.upload(items), file=sys.stderr)
+        except UploadError as ex:
+            print(f'{args.target}: {ex}', file=sys.stderr)
+            print(up.stats, file=sys.stderr)
+            return 1
+    finally:
+        port.close()
+
+if __name__ == '__main__':
+    sys.exit(main())